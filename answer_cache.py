@@ -0,0 +1,158 @@
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional
+import numpy as np
+import config
+import utils
+
+logger = utils.setup_logging()
+
+_QUERY_PUNCTUATION_RE = re.compile(r'[^\w\s]+')
+
+def normalize_query(query: str) -> str:
+    """Lowercase, drop punctuation and collapse whitespace, so trivially different phrasings share an entry."""
+    return " ".join(_QUERY_PUNCTUATION_RE.sub(" ", query.lower()).split())
+
+def context_key(retrieved_docs: List[Dict[str, Any]], model: str) -> str:
+    """Hash of the model and the retrieved chunks (IDs, text and metadata), in any order.
+
+    A chunk that is re-indexed with different text or metadata changes the
+    hash, so stale answers are missed even when another process re-indexed.
+    """
+    digest = hashlib.sha256(model.encode("utf-8"))
+    for doc in sorted(retrieved_docs, key=lambda doc: str(doc.get("id"))):
+        digest.update(json.dumps([doc.get("id"), doc.get("document"), doc.get("metadata")], sort_keys=True,
+                                 default=str).encode("utf-8"))
+    return digest.hexdigest()
+
+class AnswerCache:
+    """Generated answers keyed by (normalized query, retrieved chunks, model).
+
+    Entries expire after ttl seconds and the least recently used are evicted
+    beyond max_entries. With an embed function, a miss falls back to a
+    semantic lookup: an answer cached for the same retrieved chunks whose
+    query embedding is within semantic_threshold cosine similarity is reused.
+    """
+
+    def __init__(self, ttl: float = config.ANSWER_CACHE_TTL_SECONDS, max_entries: int = config.ANSWER_CACHE_MAX_ENTRIES,
+                 embed: Optional[Callable[[str], np.ndarray]] = None,
+                 semantic_threshold: float = config.ANSWER_CACHE_SEMANTIC_THRESHOLD):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.embed = embed
+        self.semantic_threshold = semantic_threshold
+        self._entries = OrderedDict()
+        # context key -> exact keys of the entries cached for it, for the semantic tier
+        self._by_context = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    def _drop(self, key: tuple):
+        entry = self._entries.pop(key)
+        keys = self._by_context.get(key[1])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_context[key[1]]
+        return entry
+
+    def _live(self, key: tuple, now: float) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if now - entry["created"] > self.ttl:
+            self._drop(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _embedding(self, query: str) -> np.ndarray:
+        vector = np.asarray(self.embed(query), dtype=np.float32)
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+    def get(self, query: str, retrieved_docs: List[Dict[str, Any]], model: str) -> Optional[Dict[str, Any]]:
+        """Cached result for this query and retrieval, or None.
+
+        The result is a copy of what was stored, plus "cache": "exact" or "semantic".
+        """
+        key = (normalize_query(query), context_key(retrieved_docs, model))
+        now = time.time()
+        with self._lock:
+            entry = self._live(key, now)
+            if entry is not None:
+                self.hits += 1
+                return {**entry["result"], "cache": "exact"}
+            candidates = [other for other in list(self._by_context.get(key[1], ())) if self._live(other, now) is not None]
+        if self.embed is None or not candidates:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        # Only answers for the very same retrieved chunks are candidates, so this is a handful of dot products
+        vector = self._embedding(query)
+        with self._lock:
+            best, best_score = None, self.semantic_threshold
+            for other in candidates:
+                entry = self._entries.get(other)
+                if entry is None:
+                    continue
+                score = float(np.dot(vector, entry["embedding"]))
+                if score >= best_score:
+                    best, best_score = entry, score
+            if best is None:
+                self.misses += 1
+                return None
+            self.semantic_hits += 1
+            return {**best["result"], "cache": "semantic"}
+
+    def put(self, query: str, retrieved_docs: List[Dict[str, Any]], model: str, result: Dict[str, Any]):
+        """Cache a generated result for this query and retrieval."""
+        key = (normalize_query(query), context_key(retrieved_docs, model))
+        embedding = self._embedding(query) if self.embed is not None else None
+        files = {doc.get("metadata", {}).get("sha256_file") for doc in retrieved_docs}
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = {"result": dict(result), "embedding": embedding, "files": files, "created": time.time()}
+            self._by_context.setdefault(key[1], set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+
+    def invalidate_files(self, sha256_files: Iterable[str]):
+        """Drop every answer built on chunks of these files; register with Indexer.add_change_listener."""
+        sha256_files = set(sha256_files)
+        with self._lock:
+            stale = [key for key, entry in self._entries.items() if entry["files"] & sha256_files]
+            for key in stale:
+                self._drop(key)
+        if stale:
+            logger.info(f"Invalidated {len(stale)} cached answers for {len(sha256_files)} re-indexed files")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_context.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.semantic_hits + self.misses
+            return {"entries": len(self._entries), "hits": self.hits, "semantic_hits": self.semantic_hits,
+                    "misses": self.misses, "hit_rate": (self.hits + self.semantic_hits) / lookups if lookups else 0.0}
+
+def make_answer_cache(query_processor) -> Optional[AnswerCache]:
+    """AnswerCache as configured, embedding with and invalidated by query_processor's embedder and index."""
+    if not config.ANSWER_CACHE_ENABLED:
+        return None
+    embed = None
+    if config.ANSWER_CACHE_SEMANTIC_ENABLED:
+        # The query was just embedded for retrieval, so this is normally an embedding cache hit
+        embed = lambda query: query_processor.embedder.encode_chunks([query])[0]
+    cache = AnswerCache(embed=embed)
+    query_processor.indexer.add_change_listener(cache.invalidate_files)
+    return cache
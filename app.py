@@ -1,45 +1,82 @@
 import streamlit as st
-from query_processor import QueryProcessor
-from rag import RAG
 import os
-from run_pipeline import run_full_pipeline
+import config
+import models
 
 st.set_page_config(page_title="Legal Document Q&A System", layout="wide")
 
 st.title("Legal Document Q&A System")
 
-query_processor = QueryProcessor()
-rag = RAG()
+@st.cache_resource(show_spinner="Loading models...")
+def load_services():
+    """Query processor and RAG, loaded and warmed up once per server process rather than on every rerun."""
+    if config.WARM_UP_ON_STARTUP:
+        models.warm_up_query_path()
+    return models.get_query_processor(), models.get_rag()
+
+@st.cache_resource
+def load_reindex_runner(_embedder):
+    """Background re-indexing of the upload folder, shared by every session of the server process."""
+    # Imported only when needed: the pipeline is not part of serving queries
+    from reindex_jobs import ReindexRunner
+    return ReindexRunner(embedder=_embedder, watch_interval=0)
 
 def main():
+    query_processor, rag = load_services()
+
     st.header("Ask a Legal Question")
     query = st.text_input("Enter your question here:")
 
     if st.button("Get Answer") and query.strip():
         with st.spinner("Retrieving relevant passages..."):
             results = query_processor.process_query(query)
-        with st.spinner("Generating answer..."):
-            response = rag.generate_answer(query, results)
-            answer = response.get("answer", "No answer generated.")
-            citations = response.get("citations", [])
+        # Citations are known before generation starts, so show them while the answer streams in
+        citations = rag.build_citations(results)
 
         st.subheader("Answer")
-        st.write(answer)
-
+        answer_placeholder = st.empty()
         if citations:
             st.subheader("Citations")
             for citation in citations:
                 st.markdown(f"- {citation}")
 
+        answer = ""
+        try:
+            with st.spinner("Generating answer..."):
+                for token in rag.stream_answer(query, results):
+                    answer += token
+                    answer_placeholder.markdown(answer + "▌")
+        except Exception as e:
+            st.error(f"Error in generating answer: {e}")
+        answer_placeholder.markdown(answer or "No answer generated.")
+
     st.sidebar.header("Upload Additional Documents")
     uploaded_files = st.sidebar.file_uploader("Upload .txt files", accept_multiple_files=True, type=["txt"])
-    if uploaded_files:
-        for uploaded_file in uploaded_files:
-            save_path = os.path.join("uploaded_docs", uploaded_file.name)
-            os.makedirs("uploaded_docs", exist_ok=True)
+    # The uploader keeps its files on every rerun (each question asked is one), so only
+    # files not seen before in this session are saved and handed to the re-index job
+    handled = st.session_state.setdefault("handled_uploads", set())
+    new_files = [uploaded_file for uploaded_file in uploaded_files or []
+                 if (uploaded_file.name, uploaded_file.size) not in handled]
+    if new_files:
+        os.makedirs(config.UPLOAD_FOLDER, exist_ok=True)
+        for uploaded_file in new_files:
+            save_path = os.path.join(config.UPLOAD_FOLDER, os.path.basename(uploaded_file.name))
             with open(save_path, "wb") as f:
                 f.write(uploaded_file.getbuffer())
-        st.sidebar.success(f"Uploaded {len(uploaded_files)} files successfully.")
+            handled.add((uploaded_file.name, uploaded_file.size))
+        job = load_reindex_runner(query_processor.embedder).submit("upload")
+        st.session_state["upload_job_id"] = job["id"]
+        st.sidebar.success(f"Uploaded {len(new_files)} files successfully; indexing in the background.")
+
+    job_id = st.session_state.get("upload_job_id")
+    job = load_reindex_runner(query_processor.embedder).get(job_id) if job_id else None
+    if job is not None:
+        if job["state"] == "done":
+            st.sidebar.info(f"Uploads indexed: {job['chunks_indexed']} new chunks.")
+        elif job["state"] == "failed":
+            st.sidebar.error(f"Indexing uploads failed: {job['error']}")
+        else:
+            st.sidebar.info(f"Indexing uploads ({job['state']}): {job['files']} files, {job['chunks_indexed']} chunks so far.")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,101 @@
+"""Benchmark: BM25 index build rate, size on disk and lexical query latency.
+
+Chunks are synthetic: Zipf-distributed words over a large vocabulary, with
+case citations sprinkled in, so posting-list lengths resemble a real corpus.
+Run from the repository root:
+
+    python -m benchmarks.bm25                      # 100k chunks
+    python -m benchmarks.bm25 --chunks 1000000
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+import numpy as np
+from bm25_index import BM25Index
+
+_SYLLABLES = ["ab", "al", "an", "ar", "co", "de", "di", "en", "er", "in", "is", "la", "le", "ma", "na", "ne", "or",
+              "pe", "ra", "re", "ri", "ro", "sa", "se", "ta", "te", "ti", "to", "un", "ve"]
+_KINDS = ["C.A.", "W.P.", "Constitution Petition"]
+
+def make_vocabulary(size: int, seed: int = 0) -> list:
+    rng = np.random.default_rng(seed)
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(_SYLLABLES, rng.integers(2, 5))))
+    return sorted(words)
+
+def make_corpus(num_chunks: int, vocabulary: list, words_per_chunk: int = 250, first: int = 0) -> list:
+    """Chunks first..first + num_chunks - 1 as the pipeline indexes them; one in 20 cites a case number."""
+    rng = np.random.default_rng(first)
+    vocabulary = np.array(vocabulary)
+    chunks = []
+    for i in range(first, first + num_chunks):
+        ranks = np.minimum(rng.zipf(1.1, words_per_chunk), len(vocabulary)) - 1
+        text = " ".join(vocabulary[ranks])
+        if i % 20 == 0:
+            text += f" See {_KINDS[i % 3]} No. {i} of 2019."
+        chunks.append({"chunk_text": text, "sha256": f"file{i // 50}", "section": "ORDER", "chunk_index": i % 50,
+                       "case_numbers": [str(i // 50)], "judges": []})
+    return chunks
+
+def _percentiles(latencies: list) -> str:
+    return " ".join(f"p{p}={np.percentile(latencies, p) * 1000:.2f}ms" for p in (50, 95, 99))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chunks", type=int, default=100000)
+    parser.add_argument("--vocabulary", type=int, default=50000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--segment-docs", type=int, default=10000)
+    parser.add_argument("--dir", default=None, help="Index directory (default: a temporary one, removed afterwards)")
+    args = parser.parse_args()
+
+    index_dir = args.dir or tempfile.mkdtemp(prefix="bm25_bench_")
+    vocabulary = make_vocabulary(args.vocabulary)
+    try:
+        index = BM25Index(index_dir, segment_max_docs=args.segment_docs)
+        started = time.perf_counter()
+        build_seconds = 0.0
+        for start in range(0, args.chunks, 10000):
+            chunks = make_corpus(min(10000, args.chunks - start), vocabulary, first=start)
+            build_started = time.perf_counter()
+            index.add(chunks)
+            build_seconds += time.perf_counter() - build_started
+        build_started = time.perf_counter()
+        index.flush()
+        build_seconds += time.perf_counter() - build_started
+        size = sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(index_dir) for name in names)
+        print(f"{args.chunks} chunks indexed in {build_seconds:.1f}s ({args.chunks / build_seconds:.0f} chunks/s), "
+              f"{len(index._segments)} segments, {size / 2**20:.1f} MiB on disk ({size / args.chunks:.0f} B/chunk); "
+              f"corpus generation {time.perf_counter() - started - build_seconds:.1f}s")
+
+        # A fresh searcher, as the API process would open it
+        searcher = BM25Index(index_dir)
+        rng = np.random.default_rng(1)
+        workloads = {
+            "citation": [f"{_KINDS[i % 3]} No. {i}" for i in rng.integers(0, args.chunks // 20, args.queries) * 20],
+            "rare words": [" ".join(rng.choice(vocabulary[len(vocabulary) // 2:], 3)) for _ in range(args.queries)],
+            "mixed words": [" ".join(rng.choice(vocabulary[:2000], 4)) for _ in range(args.queries)],
+        }
+        for name, queries in workloads.items():
+            searcher.search(queries[0], 10)
+            latencies = []
+            for query in queries:
+                query_started = time.perf_counter()
+                searcher.search(query, 10)
+                latencies.append(time.perf_counter() - query_started)
+            print(f"{name:<12} {_percentiles(latencies)}")
+        hits = 0
+        for query in workloads["citation"]:
+            cited = int(query.split()[-1])
+            results = searcher.search(query, 1)
+            hits += bool(results) and results[0][0] == f"file{cited // 50}_ORDER_{cited % 50}"
+        print(f"citation queries with the cited chunk ranked first: {hits}/{len(workloads['citation'])}")
+    finally:
+        if args.dir is None:
+            shutil.rmtree(index_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Micro-benchmark: legacy chunk_sentences + text.find offsets vs. chunk_sentence_spans.
+
+Run from the repository root:
+
+    python -m benchmarks.chunking                      # synthetic long judgment
+    python -m benchmarks.chunking path/to/judgment.txt
+"""
+import argparse
+import random
+import time
+import config
+import utils
+
+def make_long_judgment(num_paragraphs: int = 400, seed: int = 0) -> str:
+    """Build a long, judgment-like text from legal boilerplate sentences."""
+    rng = random.Random(seed)
+    sentences = [
+        "The learned counsel for the appellant contended that the impugned order was passed without lawful authority.",
+        "We have heard the learned counsel for the parties and perused the record with their assistance.",
+        "The High Court fell in error in holding that the petition was not maintainable under Article 199 of the Constitution.",
+        "It is settled law that a statutory functionary must act fairly, justly and within the four corners of the law.",
+        "The respondents were directed to file a comprehensive reply within a period of two weeks.",
+        "In view of the above, this appeal is allowed and the impugned judgment is set aside.",
+    ]
+    paragraphs = []
+    for i in range(num_paragraphs):
+        body = " ".join(rng.choice(sentences) for _ in range(rng.randint(3, 9)))
+        paragraphs.append(f"{i + 1}. {body}")
+    return "\n\n".join(paragraphs)
+
+def legacy_chunk_with_offsets(text: str, sentences, target_tokens: int, overlap_tokens: int):
+    """The previous Preprocessor path: chunk_sentences plus two text.find calls per chunk."""
+    chunks = utils.chunk_sentences(sentences, target_tokens, overlap_tokens)
+    return [{"chunk_text": chunk, "start_char": text.find(chunk), "end_char": text.find(chunk) + len(chunk)} for chunk in chunks]
+
+def _time(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("file", nargs="?", help="Judgment text file (default: synthetic)")
+    parser.add_argument("--paragraphs", type=int, default=400, help="Size of the synthetic judgment")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.file:
+        with open(args.file, encoding="utf-8", errors="replace") as f:
+            text = utils.normalize_text(f.read())
+    else:
+        text = make_long_judgment(args.paragraphs)
+
+    # Sentence splitting and model loading are shared by both chunkers; keep them out of the timings
+    spans = utils.sentence_spans_batch([text])[0]
+    sentences = [text[start:end] for start, end in spans]
+    utils.chunk_sentence_spans(text[:1000], utils.sentence_spans_batch([text[:1000]])[0])
+
+    legacy = lambda: legacy_chunk_with_offsets(text, sentences, config.TARGET_CHUNK_SIZE, config.CHUNK_OVERLAP)
+    span = lambda: utils.chunk_sentence_spans(text, spans, config.TARGET_CHUNK_SIZE, config.CHUNK_OVERLAP)
+    legacy_time = _time(legacy, args.repeat)
+    span_time = _time(span, args.repeat)
+    legacy_chunks = legacy()
+    span_chunks = span()
+    legacy_missing = sum(1 for c in legacy_chunks if c["start_char"] < 0)
+    exact = all(text[c["start_char"]:c["end_char"]] == c["chunk_text"] for c in span_chunks)
+
+    print(f"text: {len(text):,} chars, {len(sentences):,} sentences")
+    print(f"chunk_sentences + find: {legacy_time * 1000:9.1f} ms  {len(legacy_chunks)} chunks, {legacy_missing} offsets not found")
+    print(f"chunk_sentence_spans:   {span_time * 1000:9.1f} ms  {len(span_chunks)} chunks, exact offsets: {exact}")
+    print(f"speedup: {legacy_time / span_time:.1f}x")
+
+if __name__ == "__main__":
+    main()
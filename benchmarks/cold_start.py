@@ -0,0 +1,73 @@
+"""Benchmark: import time, startup time and first-query latency of a fresh process.
+
+Every measurement runs in a new interpreter, so nothing is imported or loaded
+beforehand, as when the API or Streamlit app starts. Searches the configured
+ChromaDB collection; run from the repository root:
+
+    python -m benchmarks.cold_start
+    python -m benchmarks.cold_start --model sentence-transformers/all-MiniLM-L6-v2
+"""
+import argparse
+import json
+import subprocess
+import sys
+import time
+import config
+
+_HEAVY_MODULES = ("torch", "transformers", "sentence_transformers", "chromadb", "spacy")
+
+def _probe(args):
+    # Runs in the child process: overrides are applied before any project module is imported
+    config.EMBEDDING_MODEL_NAME = args.model
+    config.CHUNK_TOKENIZER_NAME = args.tokenizer
+    config.WARM_UP_ON_STARTUP = args.warm_up
+    # Cached query embeddings from earlier runs would hide the encoding cost
+    config.EMBEDDING_CACHE_ENABLED = False
+    started = time.perf_counter()
+    __import__(args.probe)
+    result = {"import_s": time.perf_counter() - started,
+              "heavy_modules": [name for name in _HEAVY_MODULES if name in sys.modules]}
+    if args.probe == "main":
+        import models
+        # What the API's lifespan does before it accepts requests
+        started = time.perf_counter()
+        if args.warm_up:
+            models.warm_up_query_path()
+        query_processor, rag = models.get_query_processor(), models.get_rag()
+        result["startup_s"] = time.perf_counter() - started
+        for name, query in (("first_query_ms", "What is the law on termination of service?"),
+                            ("second_query_ms", "When is a show-cause notice required?")):
+            started = time.perf_counter()
+            rag.context_builder.build(query_processor.process_query(query))
+            result[name] = (time.perf_counter() - started) * 1000
+    print(json.dumps(result))
+
+def _run_probe(module: str, args) -> dict:
+    command = [sys.executable, "-m", "benchmarks.cold_start", "--probe", module, "--model", args.model,
+               "--tokenizer", args.tokenizer] + ([] if args.warm_up else ["--no-warm-up"])
+    output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model", default=config.EMBEDDING_MODEL_NAME)
+    parser.add_argument("--tokenizer", default=config.CHUNK_TOKENIZER_NAME, help="Chunk tokenizer (prompt token counting)")
+    parser.add_argument("--no-warm-up", dest="warm_up", action="store_false", help="Skip the startup warm-up")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--probe", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.probe:
+        _probe(args)
+        return
+
+    for module in ("main", "app"):
+        runs = [_run_probe(module, args) for _ in range(args.repeat)]
+        best = {key: min(run[key] for run in runs) for key in runs[0] if key != "heavy_modules"}
+        line = f"{module:<5} import {best['import_s']:.2f}s"
+        if "startup_s" in best:
+            line += (f", startup {best['startup_s']:.2f}s ({'with' if args.warm_up else 'no'} warm-up), "
+                     f"first query {best['first_query_ms']:.0f}ms, second query {best['second_query_ms']:.0f}ms")
+        print(f"{line}; heavy modules loaded by the import: {', '.join(runs[0]['heavy_modules']) or 'none'}")
+
+if __name__ == "__main__":
+    main()
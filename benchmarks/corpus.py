@@ -0,0 +1,142 @@
+"""Synthetic Supreme Court judgments: a reproducible corpus of any size for the benchmarks.
+
+Each judgment carries what the pipeline parses: a court header, a PRESENT
+block of judges, case numbers with their year, a title with VERSUS, hearing
+dates, section headers (FACTS ... ORDER) and, once it runs to a few pages,
+running page headers and footers between form feeds. Paragraphs mix
+boilerplate with sentences from one of a few legal topics, so queries on a
+topic retrieve its judgments. The same seed always gives the same corpus.
+Run from the repository root to write one:
+
+    python -m benchmarks.corpus /tmp/corpus --docs 1000
+    python -m benchmarks.corpus /tmp/corpus --docs 200 --paragraphs 300   # long judgments
+"""
+import argparse
+import os
+import random
+import time
+from typing import List
+
+# Without initials: utils.extract_judges stops a name at the first full stop
+JUDGES = ["IFTIKHAR MUHAMMAD CHAUDHRY", "SARDAR TARIQ MASOOD", "KHILJI ARIF HUSSAIN", "MIAN SAQIB NISAR",
+          "ASIF SAEED KHAN KHOSA", "GULZAR AHMED", "IJAZ UL AHSAN", "QAZI FAEZ ISA", "MAQBOOL BAQAR",
+          "MANZOOR AHMAD MALIK", "SAJJAD ALI SHAH", "MUNIB AKHTAR", "YAHYA AFRIDI", "AMIN-UD-DIN KHAN",
+          "MUHAMMAD ALI MAZHAR", "SYED MANSOOR ALI SHAH", "ATHAR MINALLAH", "JAMAL KHAN MANDOKHAIL"]
+PARTIES = ["Federation of Pakistan", "Province of Punjab", "Province of Sindh", "Government of Khyber Pakhtunkhwa",
+           "Muhammad Aslam", "Ghulam Rasool", "Zebunnisa", "Messrs Karachi Steel Mills", "Pakistan Railways",
+           "Capital Development Authority", "Abdul Majeed", "Collector of Customs", "State Bank of Pakistan",
+           "Shahida Parveen", "Water and Power Development Authority", "The State"]
+# Case number prefixes utils.extract_case_numbers recognises
+CASE_KINDS = ["C.A.", "W.P.", "Constitution Petition"]
+SECTIONS = ["FACTS", "ARGUMENTS", "ISSUES", "REASONING", "JUDGMENT", "ORDER"]
+
+BOILERPLATE = [
+    "We have heard the learned counsel for the parties and perused the record with their assistance.",
+    "The learned counsel for the appellant contended that the impugned order was passed without lawful authority.",
+    "The learned Deputy Attorney General supported the impugned judgment and prayed for dismissal of the appeal.",
+    "It is settled law that a statutory functionary must act fairly, justly and within the four corners of the law.",
+    "The respondents were directed to file a comprehensive reply within a period of two weeks.",
+    "Leave to appeal was granted to consider the questions of law raised in the petition.",
+]
+TOPICS = {
+    "service": [
+        "The appellant, a civil servant in BPS-17, challenged his transfer order before the Service Tribunal.",
+        "The Tribunal held that the dismissal from service without a show-cause notice was unlawful.",
+        "Pensionary benefits cannot be withheld once the civil servant has attained the age of superannuation.",
+        "Reinstatement with back benefits was ordered as the inquiry was not conducted under the Efficiency and Discipline Rules.",
+    ],
+    "criminal": [
+        "The petitioner sought bail after arrest in a case registered under section 302 of the Pakistan Penal Code.",
+        "The confession recorded before the police is inadmissible under Article 39 of the Qanun-e-Shahadat Order.",
+        "The testimony of an interested witness requires independent corroboration before a conviction can rest on it.",
+        "The High Court quashed the FIR under section 561-A of the Code of Criminal Procedure.",
+    ],
+    "property": [
+        "The respondent sued for specific performance of an agreement to sell immovable property.",
+        "The tenant resisted eviction on the ground that the notice under the Rent Restriction Ordinance was defective.",
+        "The transaction was held to be benami as the sale consideration was paid by the real owner.",
+        "The allotment of the plot was cancelled without a show-cause notice to the allottee.",
+    ],
+    "constitutional": [
+        "The writ petition under Article 199 of the Constitution was held maintainable against a statutory body.",
+        "The fundamental right to a fair trial under Article 10A includes the right to be heard.",
+        "The petition under Article 184(3) raised a question of public importance concerning fundamental rights.",
+        "Principles of natural justice are read into every statute unless expressly excluded.",
+    ],
+    "fiscal": [
+        "A fiscal statute imposing a charge cannot be given retrospective effect unless it says so expressly.",
+        "The Collector of Customs assessed the duty on the declared transaction value of the consignment.",
+        "The sales tax refund was withheld on the ground that the supplier was not registered.",
+        "Advance income tax collected at the import stage is adjustable against the final tax liability.",
+    ],
+    "procedure": [
+        "The appeal was barred by limitation and no sufficient cause for condonation of delay was shown.",
+        "The appellate court has ample power to remand the case where the trial court has not framed the issues.",
+        "A review lies only on the discovery of new evidence or an error apparent on the face of the record.",
+        "The interim injunction was refused for want of a prima facie case and irreparable loss.",
+    ],
+}
+
+def make_judgment(index: int, num_paragraphs: int = 60, seed: int = 0, lines_per_page: int = 40) -> str:
+    """Text of judgment number index; about num_paragraphs paragraphs (0.5x to 1.5x) of 3-9 sentences."""
+    rng = random.Random(seed * 1_000_003 + index)
+    topic = rng.choice(sorted(TOPICS))
+    year = rng.randint(1990, 2023)
+    kind = rng.choice(CASE_KINDS)
+    number = rng.randint(1, 3000)
+    plural = rng.random() < 0.2
+    if plural:
+        case_number = f"{kind + 's' if kind == 'Constitution Petition' else kind} Nos. {number}-{number + rng.randint(1, 4)} of {year}"
+    else:
+        case_number = f"{kind} No. {number} of {year}"
+    appellant, respondent = rng.sample(PARTIES, 2)
+    header = ["IN THE SUPREME COURT OF PAKISTAN", "(Appellate Jurisdiction)", "", "PRESENT:"]
+    header += [f"MR. JUSTICE {judge}" for judge in rng.sample(JUDGES, rng.randint(2, 3))]
+    header += ["", case_number, f"(On appeal from the judgment dated {rng.randint(1, 28)}/{rng.randint(1, 12)}/{year} of the High Court)",
+               "", f"{appellant} VERSUS {respondent}", "",
+               f"For the appellant: Mr. {rng.choice(PARTIES[4:11])}, ASC",
+               f"For the respondents: Mr. {rng.choice(PARTIES[4:11])}, Advocate-on-Record", "",
+               f"Dates of hearing: {rng.randint(1, 28)} and {rng.randint(1, 28)}/{rng.randint(1, 12)}, {year + rng.randint(0, 2)}.", ""]
+
+    num_paragraphs = max(len(SECTIONS), rng.randint(num_paragraphs // 2, num_paragraphs * 3 // 2))
+    pool = TOPICS[topic] * 2 + BOILERPLATE
+    body = []
+    for i in range(num_paragraphs):
+        if i % (num_paragraphs // len(SECTIONS)) == 0 and i // (num_paragraphs // len(SECTIONS)) < len(SECTIONS):
+            body += [SECTIONS[i // (num_paragraphs // len(SECTIONS))], ""]
+        body += [f"{i + 1}. " + " ".join(rng.choice(pool) for _ in range(rng.randint(3, 9))), ""]
+
+    # Running headers and footers repeat on every page, as in the court's text exports
+    running_header = f"SUPREME COURT OF PAKISTAN - {case_number}"
+    lines = header
+    for i, line in enumerate(body):
+        if i % lines_per_page == 0 and i:
+            lines += [f"Page {i // lines_per_page}", "\x0c", running_header, ""]
+        lines.append(line)
+    return "\n".join(lines) + "\n"
+
+def write_corpus(folder: str, num_docs: int, num_paragraphs: int = 60, seed: int = 0) -> List[str]:
+    """Write judgments 0..num_docs - 1 as text files under folder; returns their paths."""
+    os.makedirs(folder, exist_ok=True)
+    paths = []
+    for index in range(num_docs):
+        path = os.path.join(folder, f"judgment_{index:06d}.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(make_judgment(index, num_paragraphs, seed))
+        paths.append(path)
+    return paths
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("folder")
+    parser.add_argument("--docs", type=int, default=1000)
+    parser.add_argument("--paragraphs", type=int, default=60, help="Mean paragraphs per judgment")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    started = time.perf_counter()
+    paths = write_corpus(args.folder, args.docs, args.paragraphs, args.seed)
+    size = sum(os.path.getsize(path) for path in paths)
+    print(f"{len(paths)} judgments, {size / 1e6:.1f} MB in {args.folder} ({time.perf_counter() - started:.1f}s)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""Benchmark: fixed-size SentenceTransformer.encode batches vs. the token-budget Embedder.
+
+Run from the repository root:
+
+    python -m benchmarks.embedding                   # 2000 synthetic chunks
+    python -m benchmarks.embedding --chunks 5000 --processes 4
+"""
+import argparse
+import os
+import random
+import time
+import numpy as np
+import config
+from sentence_transformers import SentenceTransformer
+from embedding import Embedder
+from benchmarks.chunking import make_long_judgment
+
+def make_chunks(num_chunks: int, seed: int = 0) -> list:
+    """Chunks with the mixed lengths the pipeline produces: mostly full windows, some short tails."""
+    rng = random.Random(seed)
+    sentences = [s for paragraph in make_long_judgment(50, seed).split("\n\n") for s in paragraph.split(". ")]
+    chunks = []
+    for _ in range(num_chunks):
+        count = rng.randint(1, 4) if rng.random() < 0.3 else rng.randint(15, 40)
+        chunks.append(". ".join(rng.choice(sentences) for _ in range(count)))
+    return chunks
+
+def _rate(fn, num_chunks: int) -> float:
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    return result, num_chunks / elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--model", default=config.EMBEDDING_MODEL_NAME)
+    parser.add_argument("--legacy-batch-size", type=int, default=32, help="Fixed batch size of the previous path")
+    parser.add_argument("--token-budget", type=int, default=config.EMBEDDING_TOKEN_BUDGET)
+    parser.add_argument("--processes", type=int, default=config.EMBEDDING_NUM_PROCESSES)
+    args = parser.parse_args()
+
+    chunks = make_chunks(args.chunks)
+    model = SentenceTransformer(args.model)
+    embedder = Embedder(args.model, use_cache=False, backend="torch", token_budget=args.token_budget, num_processes=1)
+    lengths = [len(ids) for ids in embedder.tokenize(chunks)["input_ids"]]
+    print(f"{len(chunks)} chunks, {np.mean(lengths):.0f} tokens on average (max {max(lengths)})")
+    model.encode(chunks[:8])
+
+    legacy, legacy_rate = _rate(lambda: model.encode(chunks, batch_size=args.legacy_batch_size, convert_to_numpy=True),
+                                len(chunks))
+    print(f"fixed batches of {args.legacy_batch_size}: {legacy_rate:8.1f} chunks/s")
+
+    bucketed, bucketed_rate = _rate(lambda: embedder.encode_chunks(chunks), len(chunks))
+    print(f"token budget {args.token_budget}:      {bucketed_rate:8.1f} chunks/s ({bucketed_rate / legacy_rate:.2f}x)")
+    print(f"  max abs difference vs fixed batches: {np.abs(bucketed - legacy).max():.2e}")
+
+    if args.processes > 1:
+        pooled_embedder = Embedder(args.model, use_cache=False, backend="torch", token_budget=args.token_budget, num_processes=args.processes,
+                                   threads_per_process=max(1, (os.cpu_count() or 1) // args.processes))
+        # Start the workers and load their models outside the timing
+        pooled_embedder.encode_chunks(chunks[:2 * args.processes], batch_size=1)
+        pooled, pooled_rate = _rate(lambda: pooled_embedder.encode_chunks(chunks), len(chunks))
+        print(f"{args.processes} processes:          {pooled_rate:8.1f} chunks/s ({pooled_rate / legacy_rate:.2f}x)")
+        print(f"  max abs difference vs fixed batches: {np.abs(pooled - legacy).max():.2e}")
+        pooled_embedder.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Recall-vs-latency comparison of the embedding backends against PyTorch fp32.
+
+Each backend embeds the same synthetic corpus and fixed query set; the report
+shows load time, corpus throughput, single-query latency and how many of the
+fp32 top-k chunks each backend retrieves. Run from the repository root:
+
+    python -m benchmarks.embedding_backends
+    python -m benchmarks.embedding_backends --backends torch onnx-int8 --chunks 5000 --k 10
+"""
+import argparse
+import time
+import numpy as np
+import config
+from embedding import Embedder
+from embedding_backends import BACKENDS
+from benchmarks.embedding import make_chunks
+from benchmarks.queries import QUERIES
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+def run_backend(backend: str, model_name: str, chunks: list, k: int) -> dict:
+    start = time.perf_counter()
+    embedder = Embedder(model_name, use_cache=False, backend=backend, num_processes=1)
+    load_seconds = time.perf_counter() - start
+
+    embedder.encode_chunks(chunks[:8])
+    start = time.perf_counter()
+    corpus = _normalize(embedder.encode_chunks(chunks))
+    corpus_seconds = time.perf_counter() - start
+
+    # Queries one at a time, as QueryProcessor embeds them
+    latencies = []
+    queries = []
+    for query in QUERIES:
+        start = time.perf_counter()
+        queries.append(embedder.encode_chunks([query])[0])
+        latencies.append(time.perf_counter() - start)
+    top_k = np.argsort(-(_normalize(np.vstack(queries)) @ corpus.T), axis=1)[:, :k]
+    return {
+        "backend": backend,
+        "load_s": load_seconds,
+        "chunks_per_s": len(chunks) / corpus_seconds,
+        "query_p50_ms": float(np.percentile(latencies, 50) * 1000),
+        "query_p95_ms": float(np.percentile(latencies, 95) * 1000),
+        "top_k": top_k,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model", default=config.EMBEDDING_MODEL_NAME)
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=BACKENDS)
+    parser.add_argument("--chunks", type=int, default=2000, help="Synthetic corpus size")
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    backends = ["torch"] + [backend for backend in args.backends if backend != "torch"]
+    chunks = make_chunks(args.chunks)
+    results = [run_backend(backend, args.model, chunks, args.k) for backend in backends]
+
+    baseline = results[0]["top_k"]
+    print(f"{len(chunks)} chunks, {len(QUERIES)} queries, overlap@{args.k} against torch fp32")
+    print(f"{'backend':<12}{'load s':>8}{'chunks/s':>10}{'query p50 ms':>14}{'query p95 ms':>14}{'overlap':>9}")
+    for result in results:
+        overlap = np.mean([len(set(a) & set(b)) / args.k for a, b in zip(result["top_k"], baseline)])
+        print(f"{result['backend']:<12}{result['load_s']:>8.2f}{result['chunks_per_s']:>10.1f}"
+              f"{result['query_p50_ms']:>14.2f}{result['query_p95_ms']:>14.2f}{overlap:>9.1%}")
+
+if __name__ == "__main__":
+    main()
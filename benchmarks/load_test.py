@@ -0,0 +1,108 @@
+"""Load test for the API: concurrent clients firing /ask, /ask/stream or /search.
+
+For /ask/stream the report adds time to first token, measured by the client
+from sending the request to receiving the first `token` event. Start the
+Ollama stub and the API first, then run from the repository root:
+
+    python -m benchmarks.ollama_stub --delay 0.5 --token-delay 0.05 &
+    python main.py &
+    python -m benchmarks.load_test --endpoint ask --concurrency 32 --requests 500
+    python -m benchmarks.load_test --endpoint ask/stream --concurrency 32 --requests 500
+"""
+import argparse
+import asyncio
+import time
+import httpx
+import numpy as np
+from benchmarks.queries import QUERIES
+
+async def _stream(client: httpx.AsyncClient, endpoint: str, params: dict, start: float) -> tuple:
+    """Read a server-sent event stream to its end; return (status, seconds to the first token event)."""
+    first_token = None
+    async with client.stream("POST", f"/{endpoint}", params=params) as response:
+        if response.status_code != 200:
+            return response.status_code, None
+        async for line in response.aiter_lines():
+            if line == "event: token" and first_token is None:
+                first_token = time.perf_counter() - start
+            elif line == "event: error":
+                return "stream error", first_token
+    return 200, first_token
+
+async def _client(client: httpx.AsyncClient, endpoint: str, params: dict, queue: "asyncio.Queue", latencies: list,
+                  first_tokens: list, errors: dict):
+    while True:
+        try:
+            query = queue.get_nowait()
+        except asyncio.QueueEmpty:
+            return
+        start = time.perf_counter()
+        try:
+            if endpoint == "ask/stream":
+                status, first_token = await _stream(client, endpoint, {"query": query, **params}, start)
+            else:
+                status, first_token = (await client.post(f"/{endpoint}", params={"query": query, **params})).status_code, None
+            if status == 200:
+                latencies.append(time.perf_counter() - start)
+                if first_token is not None:
+                    first_tokens.append(first_token)
+            else:
+                errors[status] = errors.get(status, 0) + 1
+        except httpx.HTTPError as e:
+            errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+
+async def run(url: str, endpoint: str, concurrency: int, num_requests: int, top_k: int, timeout: float) -> dict:
+    queue = asyncio.Queue()
+    for i in range(num_requests):
+        queue.put_nowait(QUERIES[i % len(QUERIES)])
+    params = {"top_k": top_k} if endpoint == "search" else {}
+    latencies = []
+    first_tokens = []
+    errors = {}
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, timeout=timeout, limits=limits) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*[_client(client, endpoint, params, queue, latencies, first_tokens, errors) for _ in range(concurrency)])
+        elapsed = time.perf_counter() - start
+        try:
+            server_stats = (await client.get("/stats")).json()
+        except (httpx.HTTPError, ValueError):
+            server_stats = None
+    report = {"endpoint": endpoint, "concurrency": concurrency, "requests": num_requests, "ok": len(latencies),
+              "errors": errors, "seconds": elapsed, "rps": len(latencies) / elapsed,
+              "server_stats": server_stats}
+    if latencies:
+        for p in (50, 95, 99):
+            report[f"p{p}_ms"] = float(np.percentile(latencies, p) * 1000)
+    if first_tokens:
+        for p in (50, 95, 99):
+            report[f"ttft_p{p}_ms"] = float(np.percentile(first_tokens, p) * 1000)
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--endpoint", choices=["ask", "ask/stream", "search"], default="ask")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=120)
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args.url, args.endpoint, args.concurrency, args.requests, args.top_k, args.timeout))
+    print(f"{report['ok']}/{report['requests']} ok in {report['seconds']:.1f}s, {report['rps']:.1f} req/s, "
+          f"{args.concurrency} concurrent clients on /{args.endpoint}")
+    if report["ok"]:
+        print(f"latency p50 {report['p50_ms']:.0f} ms, p95 {report['p95_ms']:.0f} ms, p99 {report['p99_ms']:.0f} ms")
+    if "ttft_p50_ms" in report:
+        print(f"time to first token p50 {report['ttft_p50_ms']:.0f} ms, p95 {report['ttft_p95_ms']:.0f} ms, "
+              f"p99 {report['ttft_p99_ms']:.0f} ms")
+    if report["errors"]:
+        print(f"errors: {report['errors']}")
+    batching = (report["server_stats"] or {}).get("query_batching")
+    if batching:
+        print(f"query batching: {batching['mean_batch_size']:.1f} queries/batch on average, "
+              f"added wait p50 {batching.get('wait_p50_ms', 0):.1f} ms, p95 {batching.get('wait_p95_ms', 0):.1f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""Stand-in for Ollama's /api/generate with a fixed, configurable latency.
+
+Lets the API be load-tested without a GPU or a model. The first token comes
+after --delay seconds and each further one --token-delay seconds later;
+"stream": true requests get them as Ollama's one-JSON-object-per-line stream.
+Run from the repository root:
+
+    python -m benchmarks.ollama_stub                  # listens on config.OLLAMA_API_URL's port
+    python -m benchmarks.ollama_stub --delay 1.5 --token-delay 0.05 --tokens 40 --port 11500
+"""
+import argparse
+import asyncio
+import json
+from urllib.parse import urlparse
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+import config
+
+def make_app(delay: float, token_delay: float = 0.0, num_tokens: int = 20) -> FastAPI:
+    app = FastAPI(title="Ollama stub")
+
+    def tokens(prompt: str) -> list:
+        words = len(prompt.split())
+        text = f"Stub answer to a {words}-word prompt." + " More stub text." * max(0, num_tokens - 6)
+        return [piece + " " for piece in text.split(" ")][:num_tokens]
+
+    @app.post("/api/generate")
+    async def generate(request: Request):
+        payload = await request.json()
+        pieces = tokens(payload.get("prompt", ""))
+        if not payload.get("stream", True):
+            await asyncio.sleep(delay + token_delay * (len(pieces) - 1))
+            return {"model": payload.get("model"), "response": "".join(pieces).strip(), "done": True}
+
+        async def stream():
+            await asyncio.sleep(delay)
+            for i, piece in enumerate(pieces):
+                if i:
+                    await asyncio.sleep(token_delay)
+                yield json.dumps({"model": payload.get("model"), "response": piece, "done": False}) + "\n"
+            yield json.dumps({"model": payload.get("model"), "response": "", "done": True}) + "\n"
+
+        return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+    return app
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--delay", type=float, default=0.5, help="Seconds to the first token")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="Seconds between later tokens")
+    parser.add_argument("--tokens", type=int, default=20, help="Tokens per answer")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=urlparse(config.OLLAMA_API_URL).port or 11434)
+    args = parser.parse_args()
+
+    import uvicorn
+    uvicorn.run(make_app(args.delay, args.token_delay, args.tokens), host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,24 @@
+"""Fixed set of legal research queries shared by the benchmarks."""
+
+QUERIES = [
+    "Is a writ petition maintainable under Article 199 against a private body?",
+    "What is the limitation period for filing an appeal against a decree?",
+    "When can the High Court interfere with findings of fact in revision?",
+    "Grounds for bail in a non-bailable offence",
+    "Can a civil servant challenge a transfer order before the High Court?",
+    "Principles of natural justice and the right to be heard",
+    "Effect of a defective notice on eviction proceedings",
+    "Is specific performance available for an agreement to sell immovable property?",
+    "Powers of the appellate court to remand a case",
+    "Admissibility of a confession recorded before the police",
+    "Jurisdiction of the service tribunal over pension disputes",
+    "Burden of proof in cases of benami transactions",
+    "Condonation of delay when the appellant was misled by counsel",
+    "Interim injunction: prima facie case, balance of convenience, irreparable loss",
+    "Retrospective effect of a fiscal statute",
+    "Quashing of an FIR under section 561-A",
+    "Cancellation of allotment without a show-cause notice",
+    "Is the statement of an interested witness sufficient for conviction?",
+    "Review of a judgment on discovery of new evidence",
+    "Award of compensation for illegal dismissal from service",
+]
@@ -0,0 +1,276 @@
+"""Benchmark suite: every pipeline and query stage over a synthetic judgment corpus, as JSON.
+
+Generates judgments with benchmarks.corpus (or reads --corpus), then runs
+each stage in this process, against fresh stores and indexes in a scratch
+directory, timing every call:
+
+- per document: normalize_text, detect_sections, clean_document,
+  extract_metadata and chunk_sentences (sentence splitting and chunking,
+  as Preprocessor.detect_and_chunk_sections runs them)
+- per embedding batch: encode_chunks, store_append, upsert_chunks
+- per query: process_query, then generate_answer against the Ollama stub
+  (started on a free port unless --ollama-url is given)
+
+Each stage reports calls, items, throughput, latency percentiles and the
+process's peak RSS when it last ran. The embedding and answer caches are
+off, so every run does all the work. Settings not given as flags come from
+config.py. The table goes to stderr and the JSON to --output (or stdout);
+--compare prints throughput and p50 ratios against an earlier run's JSON.
+Run from the repository root:
+
+    python -m benchmarks.suite --docs 500 --output before.json
+    python -m benchmarks.suite --docs 500 --output after.json --compare before.json
+    python -m benchmarks.suite --corpus Supreme_court_Of_Pakistan_judgments --index-backend numpy
+"""
+import argparse
+import hashlib
+import json
+import os
+import platform
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Any, Dict, Iterator
+import numpy as np
+import config
+import utils
+from benchmarks.corpus import write_corpus
+from benchmarks.queries import QUERIES
+
+_REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def peak_rss_mb() -> float:
+    """High-water mark of this process's resident memory."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+
+class StageTimings:
+    """Per-call latencies and item counts of each stage, in the order the stages first ran."""
+
+    def __init__(self):
+        self.stages = {}
+
+    @contextmanager
+    def time(self, stage: str, items: int = 1, unit: str = "documents") -> Iterator[None]:
+        stats = self.stages.setdefault(stage, {"unit": unit, "latencies": [], "items": 0})
+        started = time.perf_counter()
+        yield
+        stats["latencies"].append(time.perf_counter() - started)
+        stats["items"] += items
+        stats["peak_rss_mb"] = peak_rss_mb()
+
+    def report(self) -> Dict[str, Dict[str, Any]]:
+        report = {}
+        for stage, stats in self.stages.items():
+            latencies = np.array(stats["latencies"])
+            seconds = float(latencies.sum())
+            report[stage] = {"unit": stats["unit"], "calls": len(latencies), "items": stats["items"], "seconds": seconds,
+                             "items_per_s": stats["items"] / seconds if seconds else 0.0,
+                             **{f"p{p}_ms": float(np.percentile(latencies, p) * 1000) for p in (50, 95, 99)},
+                             "max_ms": float(latencies.max() * 1000), "peak_rss_mb": stats["peak_rss_mb"]}
+        return report
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+@contextmanager
+def ollama_stub(delay: float, tokens: int) -> Iterator[str]:
+    """Run benchmarks.ollama_stub in a child process on a free port; yields its URL."""
+    port = _free_port()
+    process = subprocess.Popen([sys.executable, "-m", "benchmarks.ollama_stub", "--port", str(port),
+                                "--delay", str(delay), "--tokens", str(tokens)], cwd=_REPO_ROOT)
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=1).close()
+                break
+            except OSError:
+                if process.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError("The Ollama stub did not start")
+                time.sleep(0.1)
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        process.terminate()
+        process.wait()
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=_REPO_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+def run_suite(args, work_dir: str) -> Dict[str, Any]:
+    # Stores and indexes go to the scratch directory; set before the project modules read their defaults
+    config.EMBEDDING_STORE_DIR = os.path.join(work_dir, "embedding_store")
+    config.CHROMA_PERSIST_DIR = os.path.join(work_dir, "chroma_db")
+    config.BM25_INDEX_DIR = os.path.join(work_dir, "bm25_index")
+    config.JUDGMENT_INDEX_DIR = os.path.join(work_dir, "judgment_index")
+    config.EMBEDDING_CACHE_ENABLED = False
+    # Queries are timed one at a time, without waiting for batch companions
+    config.QUERY_BATCHING_ENABLED = False
+    config.INDEX_BACKEND = args.index_backend
+    import models
+    from embedding_store import EmbeddingStore
+    from preprocessing import Preprocessor
+    from rag import RAG
+
+    timings = StageTimings()
+    started = time.perf_counter()
+    if args.corpus:
+        paths = sorted(utils.list_txt_files(args.corpus))[:args.docs]
+    else:
+        with timings.time("generate_corpus", args.docs):
+            paths = write_corpus(os.path.join(work_dir, "corpus"), args.docs, args.paragraphs, args.seed)
+
+    with timings.time("load_models", 1, "loads"):
+        models.warm_up()
+        embedder = models.get_embedder()
+        embedder.warm_up()
+        indexer = models.get_indexer()
+
+    preprocessor = Preprocessor()
+    chunks = []
+    corpus_bytes = 0
+    for path in paths:
+        with open(path, "rb") as f:
+            data = f.read()
+        corpus_bytes += len(data)
+        # Decoded as ingestion does; normalize_text is ingestion's, the rest Preprocessor.process_document's
+        raw_text = data.decode("utf-8", errors="replace").replace("\r\n", "\n").replace("\r", "\n")
+        with timings.time("normalize_text"):
+            text = utils.normalize_text(raw_text)
+        with timings.time("detect_sections"):
+            utils.detect_sections(text)
+        with timings.time("clean_document"):
+            cleaned, sections = utils.clean_document(text)
+        with timings.time("extract_metadata"):
+            metadata = preprocessor.extract_metadata(cleaned)
+        with timings.time("chunk_sentences"):
+            document_chunks = preprocessor.detect_and_chunk_sections(cleaned, sections)
+        file_metadata = {"file_path": path, "file_name": os.path.basename(path), "sha256": hashlib.sha256(data).hexdigest()}
+        chunks += [{**file_metadata, **metadata, **chunk} for chunk in document_chunks]
+
+    store = EmbeddingStore(config.EMBEDDING_STORE_DIR)
+    for start in range(0, len(chunks), args.batch):
+        batch = chunks[start:start + args.batch]
+        with timings.time("encode_chunks", len(batch), "chunks"):
+            embeddings = embedder.encode_chunks([chunk["chunk_text"] for chunk in batch])
+        with timings.time("store_append", len(batch), "chunks"):
+            store.append(batch, embeddings)
+        with timings.time("upsert_chunks", len(batch), "chunks"):
+            indexer.upsert_chunks(batch, embeddings)
+    with timings.time("index_flush", 1, "flushes"):
+        indexer.flush()
+    if config.TWO_STAGE_ENABLED:
+        with timings.time("judgment_sync", len(paths)):
+            models.get_judgment_index().sync(store)
+
+    query_processor = models.get_query_processor()
+    queries = [QUERIES[i % len(QUERIES)] for i in range(args.queries)]
+    # The first search pays one-off setup (index loading, BM25 segments) that is not per-query cost
+    query_processor.process_query(queries[0], args.top_k)
+    retrieved = []
+    for query in queries:
+        with timings.time("process_query", 1, "queries"):
+            retrieved.append(query_processor.process_query(query, args.top_k))
+
+    failed_answers = 0
+    with nullcontext(args.ollama_url) if args.ollama_url else ollama_stub(args.stub_delay, args.stub_tokens) as url:
+        rag = RAG(ollama_url=url)
+        for query, results in list(zip(queries, retrieved))[:args.answers]:
+            with timings.time("generate_answer", 1, "answers"):
+                answer = rag.generate_answer(query, results)
+            failed_answers += answer["answer"] == "Error in generating answer."
+        rag.client.close()
+
+    return {"commit": _git_commit(), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                            "cpus": os.cpu_count()},
+            "settings": {"docs": len(paths), "paragraphs": None if args.corpus else args.paragraphs,
+                         "seed": None if args.corpus else args.seed, "corpus": args.corpus, "batch": args.batch,
+                         "queries": args.queries, "answers": min(args.answers, args.queries), "top_k": args.top_k,
+                         "ollama": args.ollama_url or f"stub ({args.stub_delay}s, {args.stub_tokens} tokens)",
+                         **{name.lower(): getattr(config, name) for name in (
+                             "EMBEDDING_MODEL_NAME", "EMBEDDING_BACKEND", "EMBEDDING_BATCH_SIZE", "TARGET_CHUNK_SIZE",
+                             "CHUNK_OVERLAP", "INDEX_BACKEND", "NUMPY_INDEX_MODE", "NUMPY_INDEX_DTYPE", "BM25_ENABLED",
+                             "HYBRID_SEARCH_ENABLED", "RERANK_ENABLED", "TWO_STAGE_ENABLED")}},
+            "corpus": {"documents": len(paths), "megabytes": corpus_bytes / 1e6, "chunks": len(chunks)},
+            "stages": timings.report(), "failed_answers": failed_answers,
+            "peak_rss_mb": peak_rss_mb(), "wall_seconds": time.perf_counter() - started}
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any]) -> Dict[str, Dict[str, float]]:
+    """Throughput and median latency of each stage relative to a baseline run (>1 = more / slower)."""
+    ratios = {}
+    for stage, stats in report["stages"].items():
+        before = baseline.get("stages", {}).get(stage)
+        if before and before["items_per_s"] and before["p50_ms"]:
+            ratios[stage] = {"items_per_s": stats["items_per_s"] / before["items_per_s"],
+                             "p50_ms": stats["p50_ms"] / before["p50_ms"]}
+    return ratios
+
+def format_table(report: Dict[str, Any]) -> str:
+    comparison = report.get("comparison")
+    header = (f"{'stage':<17} {'calls':>6} {'items':>7} {'unit':<9} {'items/s':>10} {'p50 ms':>9} {'p95 ms':>9} "
+              f"{'p99 ms':>9} {'RSS MB':>7}")
+    if comparison is not None:
+        header += f" {'x items/s':>9} {'x p50':>6}"
+    lines = [header, "-" * len(header)]
+    for stage, stats in report["stages"].items():
+        line = (f"{stage:<17} {stats['calls']:>6} {stats['items']:>7} {stats['unit']:<9} {stats['items_per_s']:>10.1f} "
+                f"{stats['p50_ms']:>9.2f} {stats['p95_ms']:>9.2f} {stats['p99_ms']:>9.2f} {stats['peak_rss_mb']:>7.0f}")
+        if comparison is not None and stage in comparison:
+            line += f" {comparison[stage]['items_per_s']:>9.2f} {comparison[stage]['p50_ms']:>6.2f}"
+        lines.append(line)
+    corpus = report["corpus"]
+    lines.append(f"{corpus['documents']} documents ({corpus['megabytes']:.1f} MB), {corpus['chunks']} chunks; "
+                 f"peak RSS {report['peak_rss_mb']:.0f} MB; {report['wall_seconds']:.1f}s"
+                 + (f"; {report['failed_answers']} answers failed" if report["failed_answers"] else ""))
+    return "\n".join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--docs", type=int, default=200, help="Judgments to generate (or to read from --corpus)")
+    parser.add_argument("--paragraphs", type=int, default=60, help="Mean paragraphs per generated judgment")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--corpus", default=None, help="Folder of judgment .txt files to use instead of generating")
+    parser.add_argument("--batch", type=int, default=config.PIPELINE_EMBED_BATCH_CHUNKS, help="Chunks per embedding batch")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--answers", type=int, default=20, help="Queries (of --queries) also answered")
+    parser.add_argument("--top-k", type=int, default=config.MAX_QUERY_RESULTS)
+    parser.add_argument("--index-backend", choices=["chroma", "numpy"], default=config.INDEX_BACKEND)
+    parser.add_argument("--ollama-url", default=None, help="Ollama server to answer with (default: start the stub)")
+    parser.add_argument("--stub-delay", type=float, default=0.05, help="Stub seconds per answer")
+    parser.add_argument("--stub-tokens", type=int, default=20, help="Stub tokens per answer")
+    parser.add_argument("--output", default=None, help="JSON report path (default: stdout)")
+    parser.add_argument("--compare", default=None, help="Earlier JSON report to compare against")
+    parser.add_argument("--dir", default=None, help="Scratch directory (default: a temporary one, removed afterwards)")
+    args = parser.parse_args()
+
+    work_dir = args.dir or tempfile.mkdtemp(prefix="lawbook_suite_")
+    try:
+        report = run_suite(args, work_dir)
+    finally:
+        if args.dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    if args.compare:
+        with open(args.compare) as f:
+            report["comparison"] = compare(report, json.load(f))
+    print(format_table(report), file=sys.stderr)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
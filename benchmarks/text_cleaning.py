@@ -0,0 +1,108 @@
+"""Benchmark: legacy normalize/strip/detect_sections passes vs. utils.clean_document.
+
+Run from the repository root:
+
+    python -m benchmarks.text_cleaning                    # synthetic ~2 MB judgment
+    python -m benchmarks.text_cleaning big1.txt big2.txt  # real judgments
+"""
+import argparse
+import re
+import time
+from collections import Counter
+import utils
+from benchmarks.chunking import make_long_judgment
+
+SECTION_HEADERS = ["FACTS", "ARGUMENTS", "ISSUES", "REASONING", "JUDGMENT", "ORDER"]
+
+def make_paginated_judgment(target_chars: int = 2_000_000, lines_per_page: int = 40) -> str:
+    """Judgment text with running page headers/footers and section headers, CRLF line endings."""
+    body_lines = []
+    paragraphs = 0
+    while sum(len(line) + 2 for line in body_lines) < target_chars:
+        paragraphs += 200
+        body_lines = make_long_judgment(paragraphs).split("\n")
+    lines = []
+    header_every = max(1, len(body_lines) // len(SECTION_HEADERS))
+    for i, line in enumerate(body_lines):
+        if i % lines_per_page == 0:
+            lines.extend(["\x0c", "SUPREME COURT OF PAKISTAN - Civil Appeal No. 123 of 2010", "", "", ""])
+        if i % header_every == 0 and i // header_every < len(SECTION_HEADERS):
+            lines.extend([SECTION_HEADERS[i // header_every], ""])
+        lines.append(line)
+        if i % lines_per_page == lines_per_page - 1:
+            lines.append(f"Page {i // lines_per_page + 1}")
+    return "\r\n".join(lines)
+
+# The pre-clean_document implementations, kept here for comparison
+def legacy_normalize_text(text: str) -> str:
+    text = text.replace('\r\n', '\n')
+    text = re.sub(r'\n{3,}', '\n\n', text)
+    text = text.replace('\x0c', '')
+    text = re.sub(r'\x00+', '', text)
+    return text.strip()
+
+def legacy_strip_repeated_headers_footers(text: str) -> str:
+    lines = text.split('\n')
+    line_counts = Counter(lines)
+    repeated = {line for line, count in line_counts.items() if count > 5 and len(line.strip()) > 10}
+    return '\n'.join(line for line in lines if line not in repeated)
+
+def legacy_detect_sections(text: str):
+    section_patterns = [r'ORDER', r'JUDGMENT', r'OPINION', r'ARGUMENTS', r'FACTS', r'ISSUES', r'REASONING', r'CONCLUSION', r'HELD']
+    sections = []
+    current_section = "INTRODUCTION"
+    current_text = ""
+    for line in text.split('\n'):
+        line_upper = line.upper().strip()
+        if any(re.match(pattern, line_upper) for pattern in section_patterns):
+            if current_text:
+                sections.append({"section": current_section, "text": current_text.strip()})
+            current_section = line_upper
+            current_text = ""
+        else:
+            current_text += line + '\n'
+    if current_text:
+        sections.append({"section": current_section, "text": current_text.strip()})
+    return sections
+
+def legacy_clean(text: str):
+    # Ingestion normalized, then Preprocessor stripped headers/footers and detected sections
+    cleaned = legacy_strip_repeated_headers_footers(legacy_normalize_text(text))
+    return cleaned, legacy_detect_sections(cleaned)
+
+def _time(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("files", nargs="*", help="Judgment text files (default: synthetic)")
+    parser.add_argument("--size", type=int, default=2_000_000, help="Characters in the synthetic judgment")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.files:
+        documents = []
+        for path in args.files:
+            with open(path, encoding="utf-8", errors="replace") as f:
+                documents.append((path, f.read()))
+    else:
+        documents = [("synthetic", make_paginated_judgment(args.size))]
+
+    for name, text in documents:
+        legacy_time = _time(lambda: legacy_clean(text), args.repeat)
+        new_time = _time(lambda: utils.clean_document(text), args.repeat)
+        legacy_text, legacy_sections = legacy_clean(text)
+        cleaned, spans = utils.clean_document(text)
+        same = cleaned == legacy_text and [s["text"] for s in legacy_sections if s["text"]] == \
+            [cleaned[s["start_char"]:s["end_char"]] for s in spans]
+        print(f"{name}: {len(text):,} chars, {len(spans)} sections")
+        print(f"  legacy passes:  {legacy_time * 1000:9.1f} ms")
+        print(f"  clean_document: {new_time * 1000:9.1f} ms  ({legacy_time / new_time:.1f}x)  same output: {same}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""Benchmark: numpy vector index (exact, int8, IVF) against ChromaDB: QPS, latency and recall@k.
+
+The corpus is synthetic: unit vectors drawn around a few thousand cluster
+centres (embeddings of related passages cluster similarly), 50 chunks per
+judgment, with year and judge metadata for filtered searches. Queries are
+perturbed corpus vectors; recall@k is measured against exact search. Run
+from the repository root:
+
+    python -m benchmarks.vector_index                      # 1M x 768, every backend
+    python -m benchmarks.vector_index --chunks 200000 --backends numpy-exact,numpy-ivf,chroma
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from typing import Any, Dict, List
+import numpy as np
+import utils
+from embedding_store import EmbeddingStore
+from indexing import chunk_metadata
+from vector_index import NumpyVectorIndex
+
+# name -> NumpyVectorIndex (mode, dtype); "chroma" is the ChromaDB collection
+BACKENDS = {"numpy-exact": ("exact", "float32"), "numpy-int8": ("exact", "int8"),
+            "numpy-ivf": ("ivf", "float32"), "numpy-ivf-int8": ("ivf", "int8"), "chroma": None}
+_CHUNKS_PER_FILE = 50
+
+def make_centres(num_clusters: int, dim: int, seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).normal(size=(num_clusters, dim)).astype(np.float32)
+
+def make_vectors(num_vectors: int, centres: np.ndarray, first: int = 0, spread: float = 0.6) -> np.ndarray:
+    """Unit vectors first..first + num_vectors - 1, each near a random cluster centre."""
+    rng = np.random.default_rng(first + 1)
+    vectors = centres[rng.integers(0, len(centres), num_vectors)]
+    vectors = vectors + spread * rng.normal(size=vectors.shape).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+def make_chunks(num_chunks: int, first: int = 0) -> List[Dict[str, Any]]:
+    """Chunk records as the pipeline stores them: 35 years and 40 judges, two judges per judgment."""
+    chunks = []
+    for i in range(first, first + num_chunks):
+        judgment = i // _CHUNKS_PER_FILE
+        chunks.append({"sha256": f"file{judgment}", "file_name": f"{judgment}.txt", "file_path": f"/{judgment}.txt",
+                       "case_name": f"Case {judgment}", "section": "JUDGMENT", "chunk_index": i % _CHUNKS_PER_FILE,
+                       "start_char": 0, "end_char": 0, "hearing_dates": "", "year": 1990 + judgment % 35,
+                       "case_numbers": [f"C.A. {judgment}"], "judges": [f"Judge {judgment % 40}", f"Judge {(judgment + 7) % 40}"],
+                       "chunk_text": f"chunk {i}"})
+    return chunks
+
+def _percentiles(latencies: list) -> str:
+    return " ".join(f"p{p}={np.percentile(latencies, p) * 1000:.2f}ms" for p in (50, 95))
+
+class _ChromaSearcher:
+    def __init__(self, path: str, store: EmbeddingStore, batch_size: int = 5000):
+        import chromadb
+        client = chromadb.PersistentClient(path=path)
+        self.collection = client.get_or_create_collection("bench")
+        batch_size = min(batch_size, client.get_max_batch_size())
+        self.row_of = {}
+        started = time.perf_counter()
+        for chunks, embeddings in store.iter_batches(batch_size):
+            ids = [chunk["chunk_id"] for chunk in chunks]
+            self.collection.upsert(ids=ids, embeddings=embeddings, documents=[chunk["chunk_text"] for chunk in chunks],
+                                   metadatas=[chunk_metadata(chunk) for chunk in chunks])
+        self.build_s = time.perf_counter() - started
+        for row, values in store.iter_columns(["chunk_id"]):
+            self.row_of[values["chunk_id"]] = row
+
+    def search(self, queries: np.ndarray, k: int, where: Dict[str, Any] = None) -> List[np.ndarray]:
+        ids = self.collection.query(query_embeddings=queries, n_results=k, where=where, include=[])["ids"]
+        return [np.array([self.row_of[chunk_id] for chunk_id in found]) for found in ids]
+
+class _NumpySearcher:
+    def __init__(self, store: EmbeddingStore, mode: str, dtype: str):
+        started = time.perf_counter()
+        self.index = NumpyVectorIndex(store, mode=mode, dtype=dtype)
+        if mode == "ivf":
+            self.index.train()
+        self.build_s = time.perf_counter() - started
+
+    def search(self, queries: np.ndarray, k: int, where: Dict[str, Any] = None) -> List[np.ndarray]:
+        return self.index.search(queries, k, where)[0]
+
+def _recall(found: List[np.ndarray], truth: List[np.ndarray]) -> float:
+    return float(np.mean([len(set(f.tolist()) & set(t.tolist())) / max(1, len(t)) for f, t in zip(found, truth)]))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chunks", type=int, default=1000000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--clusters", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--batch", type=int, default=32, help="Queries per call in the batched run")
+    parser.add_argument("--backends", default=",".join(BACKENDS), help=f"Comma-separated, from {', '.join(BACKENDS)}")
+    parser.add_argument("--dir", default=None, help="Store directory (default: a temporary one, removed afterwards)")
+    args = parser.parse_args()
+    backends = args.backends.split(",")
+    unknown = set(backends) - set(BACKENDS)
+    if unknown:
+        parser.error(f"unknown backends: {', '.join(sorted(unknown))}")
+
+    work_dir = args.dir or tempfile.mkdtemp(prefix="vector_bench_")
+    try:
+        store = EmbeddingStore(os.path.join(work_dir, "store"), dtype="float32")
+        centres = make_centres(args.clusters, args.dim)
+        started = time.perf_counter()
+        for start in range(len(store), args.chunks, 50000):
+            count = min(50000, args.chunks - start)
+            chunks = make_chunks(count, start)
+            for chunk in chunks:
+                chunk["chunk_id"] = utils.make_chunk_id(chunk)
+            store.append(chunks, make_vectors(count, centres, start))
+        print(f"{len(store)} x {args.dim} corpus in {store.store_dir} ({time.perf_counter() - started:.1f}s)")
+
+        rng = np.random.default_rng(1)
+        picked = np.asarray(store.vectors()[np.sort(rng.choice(len(store), args.queries, replace=False))], dtype=np.float32)
+        queries = picked + rng.normal(scale=0.5 / np.sqrt(args.dim), size=picked.shape).astype(np.float32)
+        queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+        filters = {"unfiltered": None, "year": {"year": 2005},
+                   "year+judge": {"$and": [{"year": {"$gte": 2000}}, {"judges": {"$contains": "Judge 3"}}]}}
+        exact = NumpyVectorIndex(store, mode="exact", dtype="float32")
+        truth = {name: exact.search(queries, args.k, where)[0] for name, where in filters.items()}
+
+        for name in backends:
+            if name == "chroma":
+                searcher = _ChromaSearcher(os.path.join(work_dir, "chroma"), store)
+            else:
+                searcher = _NumpySearcher(store, *BACKENDS[name])
+            print(f"{name}: built/loaded in {searcher.build_s:.1f}s")
+            for filter_name, where in filters.items():
+                searcher.search(queries[:1], args.k, where)
+                latencies, found = [], []
+                for query in queries:
+                    query_started = time.perf_counter()
+                    found += searcher.search(query[None], args.k, where)
+                    latencies.append(time.perf_counter() - query_started)
+                started = time.perf_counter()
+                for start in range(0, len(queries), args.batch):
+                    searcher.search(queries[start:start + args.batch], args.k, where)
+                batched_qps = len(queries) / (time.perf_counter() - started)
+                print(f"  {filter_name:<11} single {len(queries) / sum(latencies):8.1f} QPS {_percentiles(latencies)}, "
+                      f"batched ({args.batch}) {batched_qps:8.1f} QPS, recall@{args.k} {_recall(found, truth[filter_name]):.3f}")
+    finally:
+        if args.dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
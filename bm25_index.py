@@ -0,0 +1,430 @@
+import hashlib
+import math
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
+from array import array
+from collections import Counter
+from typing import List, Dict, Any, Tuple
+import numpy as np
+import config
+import utils
+
+logger = utils.setup_logging()
+
+_TOKEN_RE = re.compile(r'[a-z0-9]+')
+STOPWORDS = frozenset("an and are as at be by for from has have he in is it its no of on or that the this to was were "
+                      "which with".split())
+
+def _case_tokens(case_number: str) -> List[str]:
+    # Canonical "C.A. 123" -> "ca:123" and "no:123", so citations match as one term whatever their punctuation
+    kind, _, number = case_number.rpartition(" ")
+    tokens = ["no:" + number]
+    if kind:
+        tokens.append(re.sub(r'[^a-z]', '', kind.lower()) + ":" + number)
+    return tokens
+
+def analyze(text: str) -> List[str]:
+    """Lowercased alphanumeric words (no stopwords or single letters), plus tokens for cited case numbers."""
+    return [token for token in _TOKEN_RE.findall(text.lower())
+            if token not in STOPWORDS and (len(token) > 1 or token.isdigit())] + [
+        token for case_number in utils.extract_case_numbers(text) for token in _case_tokens(case_number)]
+
+def analyze_query(query: str) -> List[str]:
+    """analyze, plus a case-number token per bare number so "case 123" finds judgments numbered 123."""
+    tokens = analyze(query)
+    return tokens + [f"no:{token}" for token in tokens if token.isdigit() and f"no:{token}" not in tokens]
+
+def index_tokens(chunk: Dict[str, Any]) -> List[str]:
+    """Terms indexed for a chunk: its text, its judgment's case numbers and its judges' names."""
+    tokens = analyze(chunk["chunk_text"])
+    for case_number in chunk.get("case_numbers") or []:
+        tokens += _case_tokens(str(case_number))
+    for judge in chunk.get("judges") or []:
+        tokens += analyze(judge)
+    return tokens
+
+def _term_hash(term: str) -> int:
+    return int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest(), "little")
+
+def _load(path: str) -> np.ndarray:
+    try:
+        return np.load(path, mmap_mode="r")
+    except ValueError:
+        # Zero-length arrays cannot be memory-mapped
+        return np.load(path)
+
+class _Segment:
+    """Immutable on-disk segment, memory-mapped.
+
+    terms holds the sorted 64-bit term hashes; the postings of terms[i] are
+    docs[offsets[i]:offsets[i + 1]] (global doc numbers, ascending) with their
+    term frequencies in tfs. lengths[doc - first_doc] is a doc's token count.
+    """
+
+    FILES = ("terms", "offsets", "docs", "tfs", "lengths")
+
+    def __init__(self, path: str, first_doc: int):
+        self.path = path
+        self.first_doc = first_doc
+        for name in self.FILES:
+            setattr(self, name, _load(os.path.join(path, name + ".npy")))
+
+    def postings(self, term_hash: np.uint64):
+        i = int(np.searchsorted(self.terms, term_hash))
+        if i < len(self.terms) and self.terms[i] == term_hash:
+            start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+            return self.docs[start:end], self.tfs[start:end]
+        return None
+
+class _SegmentBuilder:
+    """In-memory postings of chunks added since the last flush."""
+
+    def __init__(self):
+        self.postings = {}
+        self.lengths = array("I")
+        self.chunk_ids = []
+        self.sha256s = []
+
+    def __len__(self) -> int:
+        return len(self.chunk_ids)
+
+    def add(self, chunk_id: str, sha256: str, tokens: List[str]):
+        local = len(self.chunk_ids)
+        for term, tf in Counter(tokens).items():
+            entry = self.postings.get(term)
+            if entry is None:
+                entry = self.postings[term] = (array("I"), array("H"))
+            entry[0].append(local)
+            entry[1].append(min(tf, 65535))
+        self.lengths.append(len(tokens))
+        self.chunk_ids.append(chunk_id)
+        self.sha256s.append(sha256)
+
+    def arrays(self, first_doc: int) -> Dict[str, np.ndarray]:
+        hashes = np.array([_term_hash(term) for term in self.postings], dtype=np.uint64)
+        entries = list(self.postings.values())
+        order = np.argsort(hashes)
+        counts = np.array([len(entries[i][0]) for i in order], dtype=np.int64)
+        return {
+            "terms": hashes[order],
+            "offsets": np.concatenate([[0], np.cumsum(counts)]).astype(np.int64),
+            "docs": (np.concatenate([np.frombuffer(entries[i][0], dtype=np.uint32) for i in order]) + first_doc
+                     if entries else np.zeros(0)).astype(np.uint32),
+            "tfs": (np.concatenate([np.frombuffer(entries[i][1], dtype=np.uint16) for i in order])
+                    if entries else np.zeros(0)).astype(np.uint16),
+            "lengths": np.frombuffer(self.lengths, dtype=np.uint32).copy(),
+        }
+
+class BM25Index:
+    """Append-only BM25 inverted index over chunks, searched through memory maps.
+
+    Added chunks are buffered and flushed as immutable segments (numbered
+    docs, CSR postings keyed by 64-bit term hashes); while the trailing
+    segment holds at least as many docs as the one before it, the two are
+    merged, so there are about log2(docs / segment_max_docs) segments. Chunk IDs, deletions and the
+    segment list live in SQLite, and searchers in other processes pick up
+    new segments on their next query. Deleted chunks are masked until their
+    segment is next merged.
+    """
+
+    def __init__(self, index_dir: str = config.BM25_INDEX_DIR, k1: float = config.BM25_K1, b: float = config.BM25_B,
+                 segment_max_docs: int = config.BM25_SEGMENT_MAX_DOCS):
+        os.makedirs(index_dir, exist_ok=True)
+        self.index_dir = index_dir
+        self.k1 = k1
+        self.b = b
+        self.segment_max_docs = segment_max_docs
+        self._lock = threading.RLock()
+        self.conn = sqlite3.connect(os.path.join(index_dir, "docs.sqlite3"), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS docs (doc INTEGER PRIMARY KEY, chunk_id TEXT, sha256 TEXT, "
+                          "deleted INTEGER DEFAULT 0)")
+        self.conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS docs_chunk_id ON docs (chunk_id) WHERE deleted = 0")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS docs_sha256 ON docs (sha256)")
+        # Segments cover docs first_doc..end_doc - 1; num_docs and total_length count the docs still in the
+        # docs table (live or masked), not those a merge dropped
+        self.conn.execute("CREATE TABLE IF NOT EXISTS segments (name TEXT PRIMARY KEY, first_doc INTEGER, "
+                          "num_docs INTEGER, total_length INTEGER, end_doc INTEGER)")
+        self.conn.commit()
+        self._migrate_segments()
+        self._builder = _SegmentBuilder()
+        self._open_segments = {}
+        self._version = None
+        self._refresh()
+
+    def _migrate_segments(self):
+        # Indexes written before end_doc existed stored the doc range as num_docs, dropped docs included
+        columns = [name for _, name, *_ in self.conn.execute("PRAGMA table_info(segments)")]
+        if "end_doc" in columns:
+            return
+        with self.conn:
+            self.conn.execute("ALTER TABLE segments ADD COLUMN end_doc INTEGER")
+            for name, first_doc, num_docs in self.conn.execute("SELECT name, first_doc, num_docs FROM segments").fetchall():
+                end = first_doc + num_docs
+                docs = [doc for (doc,) in self.conn.execute("SELECT doc FROM docs WHERE doc >= ? AND doc < ?", (first_doc, end))]
+                lengths = _load(os.path.join(self.index_dir, name, "lengths.npy"))
+                self.conn.execute("UPDATE segments SET num_docs = ?, total_length = ?, end_doc = ? WHERE name = ?",
+                                  (len(docs), int(lengths[np.array(docs, dtype=np.int64) - first_doc].sum()), end, name))
+
+    # Reading
+
+    def _refresh(self, force: bool = False):
+        try:
+            self._load_segments(force)
+        except FileNotFoundError:
+            # Another process merged and removed segments between reading the segment list and opening them
+            self._load_segments(force=True)
+
+    def _load_segments(self, force: bool):
+        # data_version changes when another connection (e.g. the pipeline) commits
+        version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        if version == self._version and not force:
+            return
+        rows = self.conn.execute("SELECT name, first_doc, end_doc, num_docs, total_length FROM segments "
+                                 "ORDER BY first_doc").fetchall()
+        segments = [self._open_segments.get(name) or _Segment(os.path.join(self.index_dir, name), first_doc)
+                    for name, first_doc, _, _, _ in rows]
+        end = max((end_doc for _, _, end_doc, _, _ in rows), default=0)
+        deleted = np.zeros(end, dtype=bool)
+        deleted_docs = [doc for (doc,) in self.conn.execute("SELECT doc FROM docs WHERE deleted = 1") if doc < end]
+        deleted[deleted_docs] = True
+        # Masked docs still count in their segment's totals until it is merged
+        num_docs = sum(num_docs for _, _, _, num_docs, _ in rows) - len(deleted_docs)
+        total_length = sum(total for _, _, _, _, total in rows) - sum(
+            int(segment.lengths[deleted[segment.first_doc:segment.first_doc + len(segment.lengths)]].sum())
+            for segment in segments)
+        avg_length = total_length / max(num_docs, 1)
+        for segment in segments:
+            # Per-doc length normalization, k1 * (1 - b + b * length / avg_length), fixed until the next refresh
+            segment.norms = (self.k1 * (1 - self.b + self.b * segment.lengths / avg_length)).astype(np.float32)
+        self._open_segments = {name: segment for (name, *_), segment in zip(rows, segments)}
+        self._segments = segments
+        self._deleted = deleted
+        self._num_docs = num_docs
+        self._avg_length = avg_length
+        self._version = version
+
+    def __len__(self) -> int:
+        """Searchable chunks (flushed and not deleted)."""
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM docs WHERE deleted = 0").fetchone()[0]
+
+    def search(self, query: str, top_k: int = config.MAX_QUERY_RESULTS) -> List[Tuple[str, float]]:
+        """(chunk_id, BM25 score) of the best-scoring chunks for query, best first."""
+        with self._lock:
+            self._refresh()
+            segments, deleted, num_docs = self._segments, self._deleted, self._num_docs
+        terms = Counter(analyze_query(query))
+        if not terms or not segments:
+            return []
+
+        scores = np.zeros(len(deleted), dtype=np.float32)
+        touched = []
+        for term, query_tf in terms.items():
+            term_hash = np.uint64(_term_hash(term))
+            found = [(segment, postings) for segment in segments
+                     if (postings := segment.postings(term_hash)) is not None]
+            df = sum(len(docs) for _, (docs, _) in found)
+            if not df:
+                continue
+            idf = math.log(1 + (num_docs - df + 0.5) / (df + 0.5))
+            for segment, (docs, tfs) in found:
+                tf = tfs.astype(np.float32)
+                norms = segment.norms[docs - segment.first_doc]
+                # Doc numbers are unique within a posting list, so fancy-index += accumulates correctly
+                scores[docs] += np.float32(query_tf * idf * (self.k1 + 1)) * tf / (tf + norms)
+                touched.append(docs)
+        if not touched:
+            return []
+
+        # A doc appears once per query term it contains, so the best top_k * terms
+        # entries hold the top_k distinct docs; only those are deduplicated
+        candidates = np.concatenate(touched)
+        candidates = candidates[~deleted[candidates]]
+        limit = top_k * len(terms)
+        if len(candidates) > limit:
+            candidates = candidates[np.argpartition(-scores[candidates], limit)[:limit]]
+        candidates = np.unique(candidates)
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")][:top_k]
+        if not len(candidates):
+            return []
+        with self._lock:
+            chunk_ids = dict(self.conn.execute(
+                f"SELECT doc, chunk_id FROM docs WHERE doc IN ({', '.join('?' * len(candidates))})",
+                [int(doc) for doc in candidates]).fetchall())
+        return [(chunk_ids[int(doc)], float(scores[doc])) for doc in candidates if int(doc) in chunk_ids]
+
+    # Writing
+
+    def existing_ids(self, chunk_ids: List[str]) -> set:
+        """Subset of chunk_ids already indexed or buffered (and not deleted)."""
+        with self._lock:
+            found = set(self._builder.chunk_ids).intersection(chunk_ids)
+            for start in range(0, len(chunk_ids), 500):
+                batch = chunk_ids[start:start + 500]
+                rows = self.conn.execute(
+                    f"SELECT chunk_id FROM docs WHERE deleted = 0 AND chunk_id IN ({', '.join('?' * len(batch))})", batch
+                ).fetchall()
+                found.update(chunk_id for (chunk_id,) in rows)
+            return found
+
+    def add(self, chunks: List[Dict[str, Any]]) -> int:
+        """Buffer chunks not indexed yet; they become searchable at the next flush."""
+        with self._lock:
+            chunk_ids = [utils.make_chunk_id(chunk) for chunk in chunks]
+            existing = self.existing_ids(chunk_ids)
+            added = 0
+            for chunk, chunk_id in zip(chunks, chunk_ids):
+                if chunk_id not in existing:
+                    self._builder.add(chunk_id, chunk["sha256"], index_tokens(chunk))
+                    existing.add(chunk_id)
+                    added += 1
+            if len(self._builder) >= self.segment_max_docs:
+                self.flush()
+            return added
+
+    def buffered(self) -> int:
+        """Chunks added but not flushed yet (lost if the process dies before the next flush)."""
+        with self._lock:
+            return len(self._builder)
+
+    def _next_doc(self) -> int:
+        last_doc = self.conn.execute("SELECT COALESCE(MAX(doc) + 1, 0) FROM docs").fetchone()[0]
+        last_segment = self.conn.execute("SELECT COALESCE(MAX(end_doc), 0) FROM segments").fetchone()[0]
+        return max(last_doc, last_segment)
+
+    def _write_segment(self, name: str, arrays: Dict[str, np.ndarray]):
+        path = os.path.join(self.index_dir, name)
+        tmp = path + ".tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        for file_name, values in arrays.items():
+            np.save(os.path.join(tmp, file_name + ".npy"), values)
+        os.replace(tmp, path)
+
+    def _remove_orphans(self):
+        # Segment directories left by an interrupted flush or merge
+        live = {name for (name,) in self.conn.execute("SELECT name FROM segments")}
+        for name in os.listdir(self.index_dir):
+            if name.startswith("seg_") and name not in live:
+                shutil.rmtree(os.path.join(self.index_dir, name), ignore_errors=True)
+
+    def flush(self):
+        """Write buffered chunks as a new segment, then merge trailing segments of similar size."""
+        with self._lock:
+            builder = self._builder
+            if not len(builder):
+                return
+            started = time.perf_counter()
+            self._remove_orphans()
+            first_doc = self._next_doc()
+            arrays = builder.arrays(first_doc)
+            name = f"seg_{first_doc:012d}_{first_doc + len(builder):012d}"
+            self._write_segment(name, arrays)
+            with self.conn:
+                self.conn.executemany("INSERT INTO docs (doc, chunk_id, sha256) VALUES (?, ?, ?)",
+                                      [(first_doc + i, chunk_id, sha256)
+                                       for i, (chunk_id, sha256) in enumerate(zip(builder.chunk_ids, builder.sha256s))])
+                self.conn.execute("INSERT INTO segments (name, first_doc, num_docs, total_length, end_doc) "
+                                  "VALUES (?, ?, ?, ?, ?)",
+                                  (name, first_doc, len(builder), int(arrays["lengths"].sum()), first_doc + len(builder)))
+            self._builder = _SegmentBuilder()
+            logger.info(f"Flushed BM25 segment of {len(builder)} chunks ({len(arrays['docs'])} postings) "
+                        f"in {time.perf_counter() - started:.2f}s")
+            self._merge_tail()
+            self._refresh(force=True)
+
+    def _merge_tail(self):
+        while True:
+            rows = self.conn.execute("SELECT name, first_doc, end_doc, num_docs FROM segments ORDER BY first_doc").fetchall()
+            if len(rows) < 2 or rows[-2][3] > rows[-1][3]:
+                return
+            self._merge(rows[-2:])
+
+    def _merge(self, rows: List[tuple]):
+        """Rewrite adjacent segments as one, dropping the postings of deleted chunks."""
+        started = time.perf_counter()
+        segments = [_Segment(os.path.join(self.index_dir, name), first_doc) for name, first_doc, _, _ in rows]
+        first_doc = rows[0][1]
+        end = rows[-1][2]
+        deleted = np.zeros(end, dtype=bool)
+        deleted[[doc for (doc,) in self.conn.execute(
+            "SELECT doc FROM docs WHERE deleted = 1 AND doc >= ? AND doc < ?", (first_doc, end))]] = True
+
+        # Pass 1: merged vocabulary and live postings per term
+        vocab = np.unique(np.concatenate([segment.terms for segment in segments]))
+        counts = np.zeros(len(vocab), dtype=np.int64)
+        for segment in segments:
+            term_index = np.repeat(np.arange(len(segment.terms), dtype=np.int32), np.diff(segment.offsets))
+            kept = np.bincount(term_index[~deleted[segment.docs]], minlength=len(segment.terms))
+            counts[np.searchsorted(vocab, segment.terms)] += kept
+        nonempty = counts > 0
+        new_index = np.cumsum(nonempty) - 1
+        offsets = np.concatenate([[0], np.cumsum(counts[nonempty])]).astype(np.int64)
+
+        # Pass 2: copy each segment's live postings after the earlier segments' postings of the same term
+        total = int(offsets[-1])
+        name = f"seg_{first_doc:012d}_{end:012d}"
+        path = os.path.join(self.index_dir, name)
+        tmp = path + ".tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        docs = np.lib.format.open_memmap(os.path.join(tmp, "docs.npy"), mode="w+", dtype=np.uint32, shape=(total,))
+        tfs = np.lib.format.open_memmap(os.path.join(tmp, "tfs.npy"), mode="w+", dtype=np.uint16, shape=(total,))
+        cursor = offsets[:-1].copy()
+        for segment in segments:
+            term_index = np.repeat(np.arange(len(segment.terms), dtype=np.int32), np.diff(segment.offsets))
+            keep = ~deleted[segment.docs]
+            term_index = term_index[keep]
+            kept = np.bincount(term_index, minlength=len(segment.terms))
+            targets = new_index[np.searchsorted(vocab, segment.terms)]
+            within = np.arange(len(term_index)) - (np.cumsum(kept) - kept)[term_index]
+            positions = cursor[targets[term_index]] + within
+            docs[positions] = segment.docs[keep]
+            tfs[positions] = segment.tfs[keep]
+            cursor[targets[kept > 0]] += kept[kept > 0]
+        docs.flush()
+        tfs.flush()
+        del docs, tfs
+        # Dropped docs keep their place in lengths (doc numbers do not change) but no longer count
+        lengths = np.concatenate([segment.lengths for segment in segments])
+        lengths[deleted[first_doc:end]] = 0
+        num_docs = sum(num_docs for _, _, _, num_docs in rows) - int(deleted[first_doc:end].sum())
+        np.save(os.path.join(tmp, "terms.npy"), vocab[nonempty])
+        np.save(os.path.join(tmp, "offsets.npy"), offsets)
+        np.save(os.path.join(tmp, "lengths.npy"), lengths)
+        os.replace(tmp, path)
+
+        with self.conn:
+            self.conn.executemany("DELETE FROM segments WHERE name = ?", [(old,) for old, *_ in rows])
+            self.conn.execute("INSERT INTO segments (name, first_doc, num_docs, total_length, end_doc) VALUES (?, ?, ?, ?, ?)",
+                              (name, first_doc, num_docs, int(lengths.sum()), end))
+            self.conn.execute("DELETE FROM docs WHERE deleted = 1 AND doc >= ? AND doc < ?", (first_doc, end))
+        del segments
+        for old, *_ in rows:
+            # Searchers still holding the old memory maps keep reading them until they refresh
+            shutil.rmtree(os.path.join(self.index_dir, old), ignore_errors=True)
+        logger.info(f"Merged {len(rows)} BM25 segments into {name} ({total} postings) "
+                    f"in {time.perf_counter() - started:.2f}s")
+
+    def delete_file(self, sha256: str):
+        """Mask every chunk of the file with this content hash."""
+        with self._lock:
+            if sha256 in self._builder.sha256s:
+                self.flush()
+            with self.conn:
+                self.conn.execute("UPDATE docs SET deleted = 1 WHERE sha256 = ? AND deleted = 0", (sha256,))
+            self._refresh(force=True)
+
+    def close(self):
+        self.conn.close()
+
+if __name__ == "__main__":
+    index = BM25Index()
+    print(f"{len(index)} chunks indexed")
+    for chunk_id, score in index.search("C.A. No. 123 termination of service"):
+        print(f"{score:8.3f}  {chunk_id}")
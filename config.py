@@ -5,25 +5,199 @@ import os
 # Dataset folder path
 DATASET_FOLDER = os.path.join(os.getcwd(), "Supreme_court_Of_Pakistan_judgments")
 
+# Documents uploaded through the API or UI; re-indexed incrementally in the background
+UPLOAD_FOLDER = os.path.join(os.getcwd(), "uploaded_docs")
+# The upload folder is polled this often (0 = only re-index on /upload and /train),
+# and finished jobs beyond REINDEX_JOB_HISTORY are forgotten
+REINDEX_WATCH_INTERVAL_SECONDS = 2
+REINDEX_JOB_HISTORY = 50
+
 # Target chunk length and overlap in tokens
 TARGET_CHUNK_SIZE = 800
 CHUNK_OVERLAP = 200
 
+# spaCy pipeline used for sentence segmentation and its max input length
+SPACY_MODEL_NAME = "en_core_web_sm"
+SPACY_MAX_LENGTH = 5_000_000
+SPACY_BATCH_SIZE = 16
+
+# Tokenizer used to measure chunk lengths
+CHUNK_TOKENIZER_NAME = "bert-base-uncased"
+
 # Embedding model name (SentenceTransformers)
 EMBEDDING_MODEL_NAME = "sentence-transformers/all-mpnet-base-v2"
 
-# Embedding batch size
-EMBEDDING_BATCH_SIZE = 32
+# Embedding inference backend: "torch" (fp32 PyTorch), "torch-int8" (dynamically
+# quantized Linear layers), "onnx" (ONNX Runtime) or "onnx-int8"; ONNX exports are
+# written once under EMBEDDING_ONNX_DIR and reused on later starts
+EMBEDDING_BACKEND = "torch"
+EMBEDDING_ONNX_DIR = os.path.join(os.getcwd(), "onnx_models")
+
+# Embedding batches are formed from length-sorted texts: at most this many texts,
+# and at most EMBEDDING_TOKEN_BUDGET padded tokens (texts x longest text) per batch
+EMBEDDING_BATCH_SIZE = 128
+EMBEDDING_TOKEN_BUDGET = 8192
+
+# CPU encoding processes (1 = encode in the calling process); each loads its own
+# copy of the model and is pinned to EMBEDDING_THREADS_PER_PROCESS torch threads
+EMBEDDING_NUM_PROCESSES = 1
+EMBEDDING_THREADS_PER_PROCESS = max(1, (os.cpu_count() or 1) // EMBEDDING_NUM_PROCESSES)
+
+# Embedding cache keyed by (model, normalized text hash): on-disk table shared by
+# the pipeline and query path, plus an in-memory LRU of this many entries
+EMBEDDING_CACHE_ENABLED = True
+EMBEDDING_CACHE_PATH = os.path.join(os.getcwd(), "embedding_cache.sqlite3")
+EMBEDDING_CACHE_LRU_SIZE = 4096
+
+# Embedding matrix (memory-mapped) and chunk metadata written by the pipeline;
+# float16 halves disk and page-cache use at a small precision cost
+EMBEDDING_STORE_DIR = os.path.join(os.getcwd(), "embedding_store")
+EMBEDDING_STORE_DTYPE = "float32"
+
+# Streaming pipeline: preprocessing worker processes (0 runs preprocessing inline)
+PIPELINE_NUM_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+# Documents submitted to the preprocessing pool but not yet collected
+PIPELINE_MAX_PENDING_DOCS = 2 * PIPELINE_NUM_WORKERS + 2
+# Chunked documents buffered between preprocessing and embedding
+PIPELINE_QUEUE_SIZE = 32
+# Chunks accumulated before each embedding/write batch
+PIPELINE_EMBED_BATCH_CHUNKS = 256
+# Embedded batches waiting to be upserted while the next batch is encoded
+PIPELINE_INDEX_QUEUE_SIZE = 2
+
+# SQLite manifest of processed files and their pipeline stage
+MANIFEST_DB_PATH = os.path.join(os.getcwd(), "processed_manifest.sqlite3")
+# Writers of the stores (pipeline runs, re-index jobs, rebuilds from the embedding store)
+# hold an exclusive lock on this file, so the CLI and the API never write at the same time
+INDEX_WRITE_LOCK_PATH = os.path.join(os.getcwd(), "index_write.lock")
 
 # ChromaDB collection name and persist directory
 CHROMA_COLLECTION_NAME = "scp_judgments"
 CHROMA_PERSIST_DIR = os.path.join(os.getcwd(), "chroma_db")
+# Upper bound on chunks per collection.upsert call (also capped by the client's max batch size)
+CHROMA_UPSERT_BATCH_SIZE = 1000
+
+# Vector search backend: "chroma", or "numpy" for in-process search over the embedding
+# store's matrix (no ChromaDB). NUMPY_INDEX_MODE "exact" scans every row in blocks of
+# NUMPY_INDEX_BLOCK_ROWS; "ivf" scans the NUMPY_IVF_PROBES k-means partitions nearest
+# the query, out of NUMPY_IVF_LISTS (0 = sqrt of the rows), trained on up to
+# NUMPY_IVF_TRAIN_SAMPLE rows once there are NUMPY_IVF_MIN_ROWS and again whenever the
+# rows double. NUMPY_INDEX_DTYPE "int8" scans a quantized in-memory copy and re-scores
+# NUMPY_INT8_RESCORE x k candidates exactly
+INDEX_BACKEND = "chroma"
+NUMPY_INDEX_MODE = "exact"
+NUMPY_INDEX_DTYPE = "float32"
+NUMPY_INDEX_BLOCK_ROWS = 65536
+NUMPY_INT8_RESCORE = 4
+NUMPY_IVF_LISTS = 0
+NUMPY_IVF_PROBES = 16
+NUMPY_IVF_MIN_ROWS = 50000
+NUMPY_IVF_TRAIN_SAMPLE = 100000
+# Metadata filters matching at most this many rows are searched exactly over those rows;
+# per-value filter bitmaps are cached in an LRU of NUMPY_BITMAP_CACHE_SIZE
+NUMPY_FILTER_EXACT_ROWS = 20000
+NUMPY_BITMAP_CACHE_SIZE = 64
+
+# BM25 inverted index over chunk text, case numbers and judges, kept next to ChromaDB
+# so exact citations ("C.A. No. 123") are found. Chunks are buffered and written as
+# memory-mapped segments of up to BM25_SEGMENT_MAX_DOCS chunks
+BM25_ENABLED = True
+BM25_INDEX_DIR = os.path.join(os.getcwd(), "bm25_index")
+BM25_SEGMENT_MAX_DOCS = 10000
+BM25_K1 = 1.2
+BM25_B = 0.75
 
 # Logging config
 LOGGING_LEVEL = "INFO"
 
+# Stage timings and counters (metrics.py) are exported by the API at /metrics in the
+# Prometheus text format and summarized per stage after each pipeline run; the last
+# METRICS_SAMPLE_SIZE timings of each stage are kept for percentiles
+METRICS_SAMPLE_SIZE = 1024
+# Profile pipeline runs and the API's lifetime: None, "cprofile" (deterministic, the
+# calling thread only) or "sampling" (every thread's stack each
+# PROFILER_SAMPLE_INTERVAL_MS); reports are written under PROFILE_DIR
+PROFILER = None
+PROFILER_SAMPLE_INTERVAL_MS = 5
+PROFILE_DIR = os.path.join(os.getcwd(), "profiles")
+
 # Ollama / LLaMA2 local inference config
 OLLAMA_API_URL = "http://localhost:11434"  # Example local API endpoint for Ollama
+OLLAMA_MODEL = "llama2"
+# Connect and read timeouts in seconds; without streaming the read timeout covers the whole answer
+OLLAMA_CONNECT_TIMEOUT_SECONDS = 5
+OLLAMA_READ_TIMEOUT_SECONDS = 120
+# Pooled keep-alive connections, and generations allowed in flight at once
+# (Ollama slows down sharply when oversubscribed; the rest wait their turn)
+OLLAMA_MAX_CONNECTIONS = 16
+OLLAMA_MAX_CONCURRENCY = 2
+# Retries on connection errors, timeouts and 5xx, after OLLAMA_RETRY_BACKOFF_SECONDS * 2^attempt (jittered)
+OLLAMA_MAX_RETRIES = 2
+OLLAMA_RETRY_BACKOFF_SECONDS = 0.5
+
+# Prompt context: overlapping chunks of the same judgment are merged, passages mostly
+# contained (word 5-grams) in a better-ranked one are dropped, and the best-ranked
+# passages are packed into CONTEXT_TOKEN_BUDGET tokens
+CONTEXT_TOKEN_BUDGET = 2048
+CONTEXT_DEDUP_THRESHOLD = 0.8
+
+# Answer cache in front of generation, keyed by (normalized query, retrieved chunks,
+# model): entries expire after ANSWER_CACHE_TTL_SECONDS and the least recently used
+# are evicted beyond ANSWER_CACHE_MAX_ENTRIES. The semantic tier also reuses an answer
+# when a differently worded query retrieves the same chunks and its embedding is
+# within ANSWER_CACHE_SEMANTIC_THRESHOLD cosine similarity of the cached query's
+ANSWER_CACHE_ENABLED = True
+ANSWER_CACHE_TTL_SECONDS = 3600
+ANSWER_CACHE_MAX_ENTRIES = 1024
+ANSWER_CACHE_SEMANTIC_ENABLED = True
+ANSWER_CACHE_SEMANTIC_THRESHOLD = 0.95
+
+# API service: threads running query embedding and ChromaDB searches off the event
+# loop, requests served at once, and how many more may wait (for at most
+# API_QUEUE_TIMEOUT_SECONDS) before the service answers 503
+API_EXECUTOR_WORKERS = 4
+API_MAX_CONCURRENT_REQUESTS = 16
+API_MAX_QUEUED_REQUESTS = 64
+API_QUEUE_TIMEOUT_SECONDS = 30
+
+# Load the query-path models and run a dummy query when the API starts, so the
+# first request does not pay for model loading and first-call initialization
+WARM_UP_ON_STARTUP = True
 
 # Other configs
 MAX_QUERY_RESULTS = 5
+
+# Concurrent queries are embedded and searched together: a batch closes
+# QUERY_BATCH_MAX_WAIT_MS after its first query or once it holds QUERY_BATCH_MAX_SIZE
+QUERY_BATCHING_ENABLED = True
+QUERY_BATCH_MAX_SIZE = 32
+QUERY_BATCH_MAX_WAIT_MS = 5
+
+# Hybrid retrieval (needs BM25_ENABLED): the top HYBRID_CANDIDATES dense and BM25
+# results of a query are fused by reciprocal rank, sum(1 / (HYBRID_RRF_K + rank))
+HYBRID_SEARCH_ENABLED = True
+HYBRID_CANDIDATES = 20
+HYBRID_RRF_K = 60
+# With metadata filters, BM25 (which cannot apply them) fetches this many times more candidates
+HYBRID_FILTER_OVERFETCH = 5
+
+# Cross-encoder re-ranking: retrieval over-fetches RERANK_CANDIDATES candidates per
+# query, which are scored against the query (RERANK_BATCH_SIZE pairs per forward pass,
+# truncated to RERANK_MAX_LENGTH tokens) and cut to top_k; pair scores are cached in
+# an LRU of RERANK_CACHE_MAX_ENTRIES
+RERANK_ENABLED = False
+RERANKER_MODEL_NAME = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+RERANK_CANDIDATES = 20
+RERANK_BATCH_SIZE = 32
+RERANK_MAX_LENGTH = 512
+RERANK_CACHE_MAX_ENTRIES = 10000
+
+# Two-stage retrieval: every judgment gets one vector (the normalized mean of its chunk
+# embeddings, kept up to date by the pipeline under JUDGMENT_INDEX_DIR); a query first
+# picks its JUDGMENT_CANDIDATES nearest judgments and the chunk search is restricted to
+# them. Independently, at most MAX_CHUNKS_PER_JUDGMENT of a query's results come from
+# one judgment while other judgments have matches (0 = no limit)
+TWO_STAGE_ENABLED = False
+JUDGMENT_INDEX_DIR = os.path.join(os.getcwd(), "judgment_index")
+JUDGMENT_CANDIDATES = 20
+MAX_CHUNKS_PER_JUDGMENT = 0
@@ -0,0 +1,133 @@
+import re
+from typing import List, Dict, Any
+import config
+import models
+import utils
+
+logger = utils.setup_logging()
+
+_WORD_RE = re.compile(r'\w+')
+
+# Word n-gram size used to compare passages for near-duplicates
+SHINGLE_SIZE = 5
+
+def _shingles(text: str) -> set:
+    words = _WORD_RE.findall(text.lower())
+    if len(words) < SHINGLE_SIZE:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+def merge_overlapping(retrieved_docs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Turn retrieved chunks into passages, merging chunks of the same file whose character spans overlap.
+
+    Chunk texts are exact slices of the cleaned judgment at start_char:end_char,
+    so the overlap is cut from the later chunk by offset. Passages are returned
+    best-ranked first; a merged passage takes its best member's rank.
+    """
+    passages = []
+    by_file = {}
+    for rank, doc in enumerate(retrieved_docs):
+        meta = doc.get("metadata") or {}
+        start, end = meta.get("start_char"), meta.get("end_char")
+        passage = {"text": doc["document"], "rank": rank, "ids": [doc.get("id")], "sha256_file": meta.get("sha256_file"),
+                   "case_name": meta.get("case_name"), "start_char": start, "end_char": end}
+        if passage["sha256_file"] and isinstance(start, int) and isinstance(end, int) and end - start == len(doc["document"]):
+            by_file.setdefault(passage["sha256_file"], []).append(passage)
+        else:
+            passages.append(passage)
+
+    for group in by_file.values():
+        group.sort(key=lambda passage: passage["start_char"])
+        current = group[0]
+        for passage in group[1:]:
+            if passage["start_char"] < current["end_char"]:
+                if passage["end_char"] > current["end_char"]:
+                    current["text"] += passage["text"][current["end_char"] - passage["start_char"]:]
+                    current["end_char"] = passage["end_char"]
+                current["ids"] += passage["ids"]
+                current["rank"] = min(current["rank"], passage["rank"])
+            else:
+                passages.append(current)
+                current = passage
+        passages.append(current)
+    return sorted(passages, key=lambda passage: passage["rank"])
+
+def drop_near_duplicates(passages: List[Dict[str, Any]], threshold: float) -> List[Dict[str, Any]]:
+    """Drop passages whose word shingles are mostly contained in a better-ranked passage's."""
+    kept = []
+    kept_shingles = []
+    for passage in passages:
+        shingles = _shingles(passage["text"])
+        duplicate = any(shingles and len(shingles & other) / min(len(shingles), len(other)) >= threshold
+                        for other in kept_shingles if other)
+        if not duplicate:
+            kept.append(passage)
+            kept_shingles.append(shingles)
+    return kept
+
+class ContextBuilder:
+    """Assemble the prompt context from retrieved chunks within a token budget.
+
+    Overlapping chunks of the same judgment are merged, near-duplicate
+    passages dropped, and the best-ranked passages packed until the budget is
+    spent. Token counts use the chunking tokenizer, so they approximate what
+    the LLM sees.
+    """
+
+    def __init__(self, token_budget: int = config.CONTEXT_TOKEN_BUDGET,
+                 dedup_threshold: float = config.CONTEXT_DEDUP_THRESHOLD, tokenizer=None):
+        self.token_budget = token_budget
+        self.dedup_threshold = dedup_threshold
+        self._tokenizer = tokenizer
+
+    @property
+    def tokenizer(self):
+        if self._tokenizer is None:
+            self._tokenizer = models.get_chunk_tokenizer()
+        return self._tokenizer
+
+    def count_tokens(self, texts: List[str]) -> List[int]:
+        if not texts:
+            return []
+        return [len(ids) for ids in self.tokenizer(texts, add_special_tokens=False)["input_ids"]]
+
+    def _truncate(self, text: str, max_tokens: int) -> str:
+        offsets = self.tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)["offset_mapping"]
+        return text[:offsets[max_tokens][0]].rstrip() if len(offsets) > max_tokens else text
+
+    def build(self, retrieved_docs: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Context text plus token accounting.
+
+        Returns text, the passages used (with their chunk ids), prompt_tokens,
+        retrieved_tokens (what joining every retrieved chunk would cost) and
+        tokens_saved.
+        """
+        retrieved_tokens = sum(self.count_tokens([doc["document"] for doc in retrieved_docs]))
+        passages = merge_overlapping(retrieved_docs)
+        merged = len(retrieved_docs) - len(passages)
+        unique = drop_near_duplicates(passages, self.dedup_threshold)
+        duplicates = len(passages) - len(unique)
+
+        selected = []
+        used = 0
+        for passage, tokens in zip(unique, self.count_tokens([passage["text"] for passage in unique])):
+            if used + tokens <= self.token_budget:
+                selected.append(passage)
+                used += tokens
+            elif not selected:
+                # Never send an empty context: cut the best passage down to the budget
+                passage = {**passage, "text": self._truncate(passage["text"], self.token_budget)}
+                selected.append(passage)
+                used += self.count_tokens([passage["text"]])[0]
+
+        context = {
+            "text": "\n\n".join(passage["text"] for passage in selected),
+            "passages": selected,
+            "prompt_tokens": used,
+            "retrieved_tokens": retrieved_tokens,
+            "tokens_saved": retrieved_tokens - used,
+        }
+        logger.info(f"Context: {len(selected)} passages, {used}/{retrieved_tokens} tokens "
+                    f"({merged} chunks merged, {duplicates} near-duplicates and "
+                    f"{len(unique) - len(selected)} passages over budget dropped, {context['tokens_saved']} tokens saved)")
+        return context
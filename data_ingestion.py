@@ -1,84 +1,137 @@
 import os
-import json
-from typing import List, Dict, Any
+import hashlib
+from typing import List, Dict, Any, Iterator, Optional, Tuple
 import config
+import metrics
 import utils
+from manifest_store import ManifestStore, stage_reached
 
 logger = utils.setup_logging()
 
 class DataIngestion:
-    def __init__(self, input_dir: str = config.DATASET_FOLDER):
+    def __init__(self, input_dir: str = config.DATASET_FOLDER, required_stage: str = "embedded"):
         self.input_dir = input_dir
+        # Files are skipped only once they have reached this pipeline stage
+        self.required_stage = required_stage
         self.manifest_file = os.path.join(os.getcwd(), "processed_manifest.json")
-        self.processed_manifest = self.load_manifest()
+        self.manifest = self.load_manifest()
 
-    def load_manifest(self) -> Dict[str, Any]:
-        """Load processed manifest for idempotence."""
-        if os.path.exists(self.manifest_file):
-            with open(self.manifest_file, 'r') as f:
-                return json.load(f)
-        return {}
-
-    def save_manifest(self):
-        """Save processed manifest."""
-        with open(self.manifest_file, 'w') as f:
-            json.dump(self.processed_manifest, f, indent=4)
+    def load_manifest(self) -> ManifestStore:
+        """Open the processed-file manifest, importing a legacy JSON manifest once."""
+        manifest = ManifestStore()
+        if manifest.count() == 0 and os.path.exists(self.manifest_file):
+            manifest.import_json(self.manifest_file)
+        return manifest
 
     def discover_files(self) -> List[str]:
         """Discover all .txt files."""
         return utils.list_txt_files(self.input_dir)
 
+    def read_if_changed(self, file_path: str) -> Optional[Tuple[bytes, Dict[str, Any]]]:
+        """Return (contents, manifest entry) if the file needs processing, else None.
+
+        Files whose size, mtime and inode match the manifest are skipped on a
+        stat() alone. Otherwise the file is read and hashed once, so a touched
+        but unchanged file is not reprocessed.
+        """
+        stat = os.stat(file_path)
+        previous = self.manifest.get(file_path)
+        complete = previous is not None and stage_reached(previous["stage"], self.required_stage)
+        if complete and utils.manifest_entry_matches_stat(previous, stat):
+            return None
+
+        with open(file_path, "rb") as f:
+            data = f.read()
+        entry = utils.build_manifest_entry(file_path, stat, hashlib.sha256(data).hexdigest())
+        entry["processed_at"] = str(stat.st_mtime)
+        if complete and previous["sha256"] == entry["sha256"]:
+            self.manifest.put(entry, previous["stage"])
+            return None
+        duplicate = self.manifest.find_by_hash(entry["sha256"], self.required_stage)
+        if duplicate is not None and duplicate["file_path"] != file_path:
+            # Same content is already processed under another path
+            self.manifest.put(entry, duplicate["stage"])
+            return None
+        return data, entry
+
     def should_process_file(self, file_path: str) -> bool:
-        """Check if file needs processing based on SHA256."""
-        sha256 = utils.get_file_sha256(file_path)
-        return sha256 not in self.processed_manifest
+        """Check if file needs processing based on stat() and, if that changed, SHA256."""
+        return self.read_if_changed(file_path) is not None
 
-    def process_file(self, file_path: str) -> Dict[str, Any]:
+    def process_file(self, file_path: str, data: bytes = None, entry: Dict[str, Any] = None) -> Dict[str, Any]:
         """Process a single file: load, normalize, extract basic metadata."""
+        if data is None:
+            with open(file_path, "rb") as f:
+                data = f.read()
+        if entry is None:
+            entry = utils.build_manifest_entry(file_path, sha256=hashlib.sha256(data).hexdigest())
+            entry["processed_at"] = str(entry["last_modified"])
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                raw_text = f.read()
+            raw_text = data.decode('utf-8')
         except UnicodeDecodeError:
-            with open(file_path, 'r', encoding='latin-1') as f:
-                raw_text = f.read()
+            raw_text = data.decode('latin-1')
+        # Universal newlines, as reading in text mode did
+        raw_text = raw_text.replace('\r\n', '\n').replace('\r', '\n')
 
         normalized_text = utils.normalize_text(raw_text)
 
         # Basic metadata
+        hearing_dates = utils.extract_dates(normalized_text)
         metadata = {
             "file_path": file_path,
             "file_name": os.path.basename(file_path),
-            "sha256": utils.get_file_sha256(file_path),
+            "sha256": entry["sha256"],
             "case_numbers": utils.extract_case_numbers(normalized_text),
             "case_name": utils.extract_title(normalized_text),
             "judges": utils.extract_judges(normalized_text),
-            "hearing_dates": utils.extract_dates(normalized_text),
+            "hearing_dates": hearing_dates,
+            "year": utils.extract_year(normalized_text, hearing_dates),
             "raw_text": normalized_text
         }
 
-        # Mark as processed
-        self.processed_manifest[metadata["sha256"]] = {
-            "file_path": file_path,
-            "processed_at": str(os.path.getmtime(file_path))
-        }
+        # Mark as ingested; later stages are recorded by the pipeline
+        self.manifest.put(entry, "ingested")
 
         return metadata
 
-    def run_ingestion(self) -> List[Dict[str, Any]]:
-        """Run full ingestion pipeline."""
-        files = self.discover_files()
-        ingested_data = []
+    def find_deleted_files(self, discovered: set) -> List[str]:
+        """Drop manifest entries for files under input_dir that no longer exist."""
+        deleted = [path for path in self.manifest.iter_paths(os.path.join(self.input_dir, ""))
+                   if path not in discovered]
+        for path in deleted:
+            self.manifest.delete(path)
+            logger.info(f"{path} was deleted since it was processed")
+        return deleted
+
+    def get_stale_hashes(self) -> List[str]:
+        """Hashes whose chunks are no longer backed by any file and should be removed from the index."""
+        return self.manifest.get_stale_hashes()
+
+    def mark_stage(self, file_path: str, stage: str):
+        """Record that a file completed a later pipeline stage."""
+        self.manifest.set_stage(file_path, stage)
 
-        for file_path in files:
-            if self.should_process_file(file_path):
+    def iter_ingestion(self) -> Iterator[Dict[str, Any]]:
+        """Yield ingested files one at a time so the corpus is never held in memory."""
+        discovered = set()
+        for file_path in self.discover_files():
+            discovered.add(file_path)
+            with metrics.span("ingest") as record:
+                changed = self.read_if_changed(file_path)
+                if changed is not None:
+                    metadata = self.process_file(file_path, *changed)
+                    record["items"] = 1
+            if changed is not None:
                 logger.info(f"Processing {file_path}")
-                data = self.process_file(file_path)
-                ingested_data.append(data)
+                yield metadata
             else:
                 logger.info(f"Skipping {file_path} (already processed)")
 
-        self.save_manifest()
-        return ingested_data
+        self.find_deleted_files(discovered)
+
+    def run_ingestion(self) -> List[Dict[str, Any]]:
+        """Run full ingestion pipeline."""
+        return list(self.iter_ingestion())
 
 if __name__ == "__main__":
     ingestion = DataIngestion()
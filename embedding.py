@@ -1,27 +1,138 @@
-from sentence_transformers import SentenceTransformer
-from typing import List
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict
 import numpy as np
 import config
+import metrics
 import utils
+from embedding_backends import load_backend
+from embedding_cache import EmbeddingCache, text_key
 
 logger = utils.setup_logging()
 
+def plan_batches(lengths: List[int], token_budget: int, max_batch_size: int) -> List[List[int]]:
+    """Group input indices into batches of similar token length.
+
+    Indices are sorted longest first, so each batch's first text sets its padded
+    length; a batch is closed once another text would push texts x padded length
+    past token_budget, or it holds max_batch_size texts.
+    """
+    order = sorted(range(len(lengths)), key=lengths.__getitem__, reverse=True)
+    batches = []
+    batch = []
+    for i in order:
+        if batch and (len(batch) >= max_batch_size or (len(batch) + 1) * lengths[batch[0]] > token_budget):
+            batches.append(batch)
+            batch = []
+        batch.append(i)
+    if batch:
+        batches.append(batch)
+    return batches
+
+# Backend of an encoding worker process, loaded once by _init_encode_worker
+_worker_backend = None
+
+def _init_encode_worker(backend: str, model_name: str, num_threads: int):
+    global _worker_backend
+    import torch
+    torch.set_num_threads(num_threads)
+    _worker_backend = load_backend(backend, model_name, num_threads=num_threads)
+
+def _encode_in_worker(features: Dict[str, List[List[int]]]) -> np.ndarray:
+    return _worker_backend.encode(features)
+
 class Embedder:
-    def __init__(self, model_name: str = config.EMBEDDING_MODEL_NAME):
-        # Workaround for meta tensor error by loading model without device param first
-        self.model = SentenceTransformer(model_name)
-        # Remove the to_empty call because it takes no arguments and causes error
-        # Instead, rely on default device or set device='cpu' in model initialization if no error
-        logger.info(f"Loaded embedding model: {model_name}")
-
-    def encode_chunks(self, chunks: List[str], batch_size: int = config.EMBEDDING_BATCH_SIZE) -> List[np.ndarray]:
-        """Encode text chunks into embeddings."""
-        embeddings = self.model.encode(chunks, batch_size=batch_size, show_progress_bar=True)
-        logger.info(f"Encoded {len(chunks)} chunks")
-        return embeddings.tolist()  # Convert to list for JSON serialization
+    def __init__(self, model_name: str = config.EMBEDDING_MODEL_NAME, cache: EmbeddingCache = None,
+                 use_cache: bool = config.EMBEDDING_CACHE_ENABLED,
+                 backend: str = config.EMBEDDING_BACKEND,
+                 token_budget: int = config.EMBEDDING_TOKEN_BUDGET,
+                 num_processes: int = config.EMBEDDING_NUM_PROCESSES,
+                 threads_per_process: int = config.EMBEDDING_THREADS_PER_PROCESS):
+        self.model_name = model_name
+        self.backend_name = backend
+        self.token_budget = token_budget
+        self.num_processes = num_processes
+        self.threads_per_process = threads_per_process
+        self.pool = None
+        # Quantized backends give slightly different vectors, so they get their own cache entries
+        cache_key = model_name if backend == "torch" else f"{model_name}:{backend}"
+        self.cache = cache if cache is not None else (EmbeddingCache(cache_key) if use_cache else None)
+        self.backend = load_backend(backend, model_name)
+        logger.info(f"Loaded embedding model: {model_name} ({backend} backend)")
+
+    def encode_chunks(self, chunks: List[str], batch_size: int = config.EMBEDDING_BATCH_SIZE) -> np.ndarray:
+        """Encode text chunks into a float32 (len(chunks), dim) array.
+
+        Texts found in the embedding cache are not re-encoded: the "embed"
+        stage includes cache lookups, "embed_model" only the texts encoded.
+        """
+        with metrics.span("embed", items=len(chunks)):
+            if self.cache is None:
+                return self._encode(chunks, batch_size)
+
+            cached = self.cache.get_many(chunks)
+            # Encode each distinct (normalized) uncached text once
+            todo = {}
+            for i, vector in enumerate(cached):
+                if vector is None:
+                    todo.setdefault(text_key(chunks[i]), []).append(i)
+            if todo:
+                texts = [chunks[indices[0]] for indices in todo.values()]
+                fresh = self._encode(texts, batch_size)
+                self.cache.put_many(texts, fresh)
+                for indices, vector in zip(todo.values(), fresh):
+                    for i in indices:
+                        cached[i] = vector
+            logger.info(f"Embedding cache: {len(chunks) - sum(len(indices) for indices in todo.values())}/{len(chunks)} hits "
+                        f"({self.cache.stats()['hit_rate']:.0%} overall)")
+            if not chunks:
+                return np.zeros((0, self.backend.dim), dtype=np.float32)
+            return np.vstack(cached).astype(np.float32, copy=False)
+
+    def tokenize(self, texts: List[str]) -> Dict[str, List[List[int]]]:
+        """Unpadded token IDs (and masks) of each text as the model will see it, truncated to its max length."""
+        return dict(self.backend.tokenizer(texts, truncation=True, max_length=self.backend.max_seq_length))
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        # Spawned rather than forked: torch's thread pools do not survive a fork
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(max_workers=self.num_processes, mp_context=multiprocessing.get_context("spawn"),
+                                            initializer=_init_encode_worker,
+                                            initargs=(self.backend_name, self.model_name, self.threads_per_process))
+            logger.info(f"Started {self.num_processes} encoding processes ({self.threads_per_process} threads each)")
+        return self.pool
+
+    def _encode(self, chunks: List[str], batch_size: int) -> np.ndarray:
+        with metrics.span("embed_model", items=len(chunks)):
+            embeddings = np.zeros((len(chunks), self.backend.dim), dtype=np.float32)
+            if not chunks:
+                return embeddings
+            # Tokenize once: the lengths drive batching and the IDs are fed to the model as they are
+            features = self.tokenize(chunks)
+            batches = plan_batches([len(ids) for ids in features["input_ids"]], self.token_budget, batch_size)
+            batch_features = [{key: [values[i] for i in batch] for key, values in features.items()} for batch in batches]
+            if self.num_processes > 1 and len(batches) > 1:
+                pool = self._get_pool()
+                for batch, result in zip(batches, pool.map(_encode_in_worker, batch_features)):
+                    embeddings[batch] = result
+            else:
+                for batch, features in zip(batches, batch_features):
+                    embeddings[batch] = self.backend.encode(features)
+            logger.info(f"Encoded {len(chunks)} chunks in {len(batches)} batches")
+        return embeddings
+
+    def warm_up(self):
+        """Run one tiny encode past the cache, so the backend's first-call setup is not paid by a real request."""
+        self._encode(["warm-up"], 1)
+
+    def close(self):
+        """Shut down the encoding processes, if any were started."""
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
 
 if __name__ == "__main__":
     embedder = Embedder()
     sample_chunks = ["This is a sample chunk.", "Another chunk for testing."]
     embeddings = embedder.encode_chunks(sample_chunks)
-    logger.info(f"Embeddings shape: {len(embeddings)} x {len(embeddings[0])}")
+    logger.info(f"Embeddings shape: {embeddings.shape[0]} x {embeddings.shape[1]}")
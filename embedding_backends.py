@@ -0,0 +1,129 @@
+import json
+import os
+import re
+from typing import List, Dict
+import numpy as np
+import config
+import utils
+
+logger = utils.setup_logging()
+
+# Names accepted by load_backend / config.EMBEDDING_BACKEND
+BACKENDS = ("torch", "torch-int8", "onnx", "onnx-int8")
+
+class TorchBackend:
+    """SentenceTransformer in PyTorch, optionally with dynamically int8-quantized Linear layers."""
+
+    def __init__(self, model_name: str, quantize: bool = False):
+        # Imported on first load: torch and sentence-transformers take seconds to import,
+        # and the ONNX backends need neither at runtime
+        import torch
+        from sentence_transformers import SentenceTransformer
+        self.torch = torch
+        if quantize:
+            # Quantized kernels are CPU-only
+            self.model = SentenceTransformer(model_name, device="cpu")
+            self.model = torch.ao.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8)
+        else:
+            # Workaround for meta tensor error by loading model without device param first
+            self.model = SentenceTransformer(model_name)
+        self.tokenizer = self.model.tokenizer
+        self.max_seq_length = self.model.max_seq_length
+        self.dim = self.model.get_sentence_embedding_dimension()
+
+    def encode(self, features: Dict[str, List[List[int]]]) -> np.ndarray:
+        """Pad one batch of pre-tokenized texts to its longest member and run it through the model."""
+        batch = self.tokenizer.pad(features, padding=True, return_tensors="pt")
+        batch = {key: value.to(self.model.device) for key, value in batch.items()}
+        with self.torch.inference_mode():
+            embeddings = self.model(batch)["sentence_embedding"]
+        return embeddings.float().cpu().numpy()
+
+def export_onnx(model_name: str, export_dir: str, quantize: bool = False) -> str:
+    """Export model_name to ONNX under export_dir (once) and return the model file path.
+
+    The tokenizer and the model's max length and dimension are saved alongside,
+    so later loads need neither PyTorch weights nor sentence-transformers.
+    """
+    onnx_path = os.path.join(export_dir, "model.onnx")
+    if not os.path.exists(onnx_path):
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        class _SentenceEmbeddingGraph(torch.nn.Module):
+            """Tensor-in/tensor-out wrapper so the whole SentenceTransformer (pooling included) exports as one graph."""
+
+            def __init__(self, model: SentenceTransformer):
+                super().__init__()
+                self.model = model
+
+            def forward(self, input_ids, attention_mask):
+                return self.model({"input_ids": input_ids, "attention_mask": attention_mask})["sentence_embedding"]
+
+        os.makedirs(export_dir, exist_ok=True)
+        model = SentenceTransformer(model_name, device="cpu").eval()
+        sample = model.tokenizer(["export sample", "a second, longer export sample"], padding=True, return_tensors="pt")
+        tmp_path = onnx_path + ".tmp"
+        torch.onnx.export(
+            _SentenceEmbeddingGraph(model), (sample["input_ids"], sample["attention_mask"]), tmp_path,
+            input_names=["input_ids", "attention_mask"], output_names=["sentence_embedding"],
+            dynamic_axes={"input_ids": {0: "batch", 1: "tokens"}, "attention_mask": {0: "batch", 1: "tokens"},
+                          "sentence_embedding": {0: "batch"}},
+            opset_version=17, dynamo=False,
+        )
+        os.replace(tmp_path, onnx_path)
+        model.tokenizer.save_pretrained(export_dir)
+        with open(os.path.join(export_dir, "embedding_config.json"), "w") as f:
+            json.dump({"model_name": model_name, "max_seq_length": model.max_seq_length,
+                       "dim": model.get_sentence_embedding_dimension()}, f)
+        logger.info(f"Exported {model_name} to {onnx_path}")
+    if not quantize:
+        return onnx_path
+
+    quantized_path = os.path.join(export_dir, "model-int8.onnx")
+    if not os.path.exists(quantized_path):
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        quantize_dynamic(onnx_path, quantized_path + ".tmp", weight_type=QuantType.QInt8)
+        os.replace(quantized_path + ".tmp", quantized_path)
+        logger.info(f"Quantized {onnx_path} to {quantized_path}")
+    return quantized_path
+
+class OnnxBackend:
+    """ONNX Runtime session over an exported (optionally int8-quantized) SentenceTransformer."""
+
+    def __init__(self, model_name: str, quantize: bool = False, onnx_dir: str = config.EMBEDDING_ONNX_DIR,
+                 num_threads: int = 0):
+        import onnxruntime
+        from transformers import AutoTokenizer
+
+        export_dir = os.path.join(onnx_dir, re.sub(r'[^A-Za-z0-9_.-]+', '_', model_name.strip("/")))
+        onnx_path = export_onnx(model_name, export_dir, quantize)
+        with open(os.path.join(export_dir, "embedding_config.json")) as f:
+            settings = json.load(f)
+        self.tokenizer = AutoTokenizer.from_pretrained(export_dir)
+        self.max_seq_length = settings["max_seq_length"]
+        self.dim = settings["dim"]
+
+        options = onnxruntime.SessionOptions()
+        # 0 lets ONNX Runtime use every core
+        options.intra_op_num_threads = num_threads
+        self.session = onnxruntime.InferenceSession(onnx_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = [graph_input.name for graph_input in self.session.get_inputs()]
+
+    def encode(self, features: Dict[str, List[List[int]]]) -> np.ndarray:
+        """Pad one batch of pre-tokenized texts to its longest member and run the session."""
+        batch = self.tokenizer.pad({name: features[name] for name in self.input_names}, padding=True, return_tensors="np")
+        inputs = {name: batch[name].astype(np.int64) for name in self.input_names}
+        return self.session.run(None, inputs)[0].astype(np.float32, copy=False)
+
+def load_backend(name: str, model_name: str, num_threads: int = 0):
+    """Load an embedding backend by name (see BACKENDS)."""
+    if name == "torch":
+        return TorchBackend(model_name)
+    if name == "torch-int8":
+        return TorchBackend(model_name, quantize=True)
+    if name == "onnx":
+        return OnnxBackend(model_name, num_threads=num_threads)
+    if name == "onnx-int8":
+        return OnnxBackend(model_name, quantize=True, num_threads=num_threads)
+    raise ValueError(f"Unknown embedding backend {name!r}; expected one of {', '.join(BACKENDS)}")
@@ -0,0 +1,110 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Optional
+import numpy as np
+import config
+import utils
+
+logger = utils.setup_logging()
+
+def text_key(text: str) -> str:
+    """Hash of the whitespace-normalized text."""
+    return hashlib.sha256(" ".join(text.split()).encode("utf-8")).hexdigest()
+
+class EmbeddingCache:
+    """Embeddings keyed by (model name, normalized text hash).
+
+    A persistent SQLite table shared by the pipeline and the query path, with
+    an in-memory LRU in front of it for hot queries.
+    """
+
+    def __init__(self, model_name: str, db_path: str = config.EMBEDDING_CACHE_PATH,
+                 lru_size: int = config.EMBEDDING_CACHE_LRU_SIZE):
+        self.model_name = model_name
+        self.lru_size = lru_size
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.conn = None
+        if db_path:
+            os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+            self.conn = sqlite3.connect(db_path, check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                " model TEXT NOT NULL, text_hash TEXT NOT NULL, vector BLOB NOT NULL,"
+                " PRIMARY KEY (model, text_hash)) WITHOUT ROWID"
+            )
+            self.conn.commit()
+
+    def _remember(self, key: str, vector: np.ndarray):
+        if self.lru_size <= 0:
+            return
+        self._lru[key] = vector
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.lru_size:
+            self._lru.popitem(last=False)
+
+    def get_many(self, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """Cached embedding for each text, or None where it is not cached."""
+        keys = [text_key(text) for text in texts]
+        results = [None] * len(texts)
+        with self._lock:
+            missing = {}
+            for i, key in enumerate(keys):
+                vector = self._lru.get(key)
+                if vector is not None:
+                    self._lru.move_to_end(key)
+                    results[i] = vector
+                    self.hits += 1
+                else:
+                    missing.setdefault(key, []).append(i)
+            if missing and self.conn is not None:
+                found = list(missing)
+                for start in range(0, len(found), 500):
+                    batch = found[start:start + 500]
+                    rows = self.conn.execute(
+                        f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({', '.join('?' * len(batch))})",
+                        [self.model_name, *batch]
+                    ).fetchall()
+                    for key, blob in rows:
+                        vector = np.frombuffer(blob, dtype=np.float32)
+                        self._remember(key, vector)
+                        for i in missing.pop(key):
+                            results[i] = vector
+                            self.hits += 1
+                            self.disk_hits += 1
+            self.misses += sum(len(indices) for indices in missing.values())
+        return results
+
+    def put_many(self, texts: List[str], embeddings: np.ndarray):
+        """Store freshly computed embeddings."""
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        keys = [text_key(text) for text in texts]
+        with self._lock:
+            for key, vector in zip(keys, embeddings):
+                self._remember(key, vector)
+            if self.conn is not None:
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings (model, text_hash, vector) VALUES (?, ?, ?)",
+                    [(self.model_name, key, vector.tobytes()) for key, vector in zip(keys, embeddings)]
+                )
+                self.conn.commit()
+
+    def stats(self) -> Dict[str, float]:
+        """Hit/miss counters since the cache was opened."""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "memory_hits": self.hits - self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "lru_entries": len(self._lru)
+        }
@@ -0,0 +1,198 @@
+import json
+import os
+import sqlite3
+import threading
+from typing import List, Dict, Any, Iterator, Tuple
+import numpy as np
+import config
+import utils
+
+logger = utils.setup_logging()
+
+# Chunk fields stored as columns; list-valued fields are JSON-encoded
+_SCALAR_FIELDS = ("chunk_id", "file_path", "file_name", "sha256", "section", "chunk_index",
+                  "start_char", "end_char", "case_name", "hearing_dates", "year", "chunk_text")
+_INTEGER_FIELDS = ("chunk_index", "start_char", "end_char", "year")
+_LIST_FIELDS = ("case_numbers", "judges")
+
+class EmbeddingStore:
+    """Append-only embedding matrix plus chunk metadata.
+
+    Embeddings live in a raw row-major float32/float16 file that is read back
+    through np.memmap; chunk metadata is a SQLite table whose `row` column is
+    the embedding's row in the matrix. Nothing is loaded until it is read.
+
+    With recover (the default for writers), vectors left past the last
+    committed row by a crash are truncated on open; readers in another
+    process than the writer open with recover=False.
+    """
+
+    def __init__(self, store_dir: str = config.EMBEDDING_STORE_DIR, dtype: str = config.EMBEDDING_STORE_DTYPE,
+                 recover: bool = True):
+        os.makedirs(store_dir, exist_ok=True)
+        self.store_dir = store_dir
+        self.vectors_path = os.path.join(store_dir, "embeddings.bin")
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(os.path.join(store_dir, "chunks.sqlite3"), check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        columns = ", ".join(f"{field} {'INTEGER' if field in _INTEGER_FIELDS else 'TEXT'}"
+                            for field in _SCALAR_FIELDS + _LIST_FIELDS)
+        self.conn.execute(f"CREATE TABLE IF NOT EXISTS chunks (row INTEGER PRIMARY KEY, {columns}, deleted INTEGER DEFAULT 0)")
+        # Stores written before a field existed get the column, empty for their rows
+        existing_columns = {row["name"] for row in self.conn.execute("PRAGMA table_info(chunks)")}
+        for field in _SCALAR_FIELDS + _LIST_FIELDS:
+            if field not in existing_columns:
+                self.conn.execute(f"ALTER TABLE chunks ADD COLUMN {field} {'INTEGER' if field in _INTEGER_FIELDS else 'TEXT'}")
+        # A chunk ID may reappear after its file was deleted and restored, but only once live
+        self.conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS chunks_chunk_id ON chunks (chunk_id) WHERE deleted = 0")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS chunks_sha256 ON chunks (sha256)")
+        self.conn.commit()
+
+        self.dtype = np.dtype(dtype)
+        self.dim = None
+        self._load_meta()
+        if recover:
+            self._truncate_to_committed_rows()
+
+    def _load_meta(self):
+        # The first append (possibly by another process) fixes the dimension and dtype
+        meta = dict(self.conn.execute("SELECT key, value FROM meta").fetchall())
+        self.dtype = np.dtype(meta.get("dtype", self.dtype))
+        self.dim = int(meta["dim"]) if "dim" in meta else None
+
+    def _truncate_to_committed_rows(self):
+        # Vectors are written before their rows are committed; drop any tail left by a crash
+        if self.dim is None or not os.path.exists(self.vectors_path):
+            return
+        expected = len(self) * self.dim * self.dtype.itemsize
+        if os.path.getsize(self.vectors_path) > expected:
+            with open(self.vectors_path, "r+b") as f:
+                f.truncate(expected)
+            logger.info(f"Truncated uncommitted embeddings in {self.vectors_path}")
+
+    def __len__(self) -> int:
+        """Rows in the matrix, including deleted ones."""
+        return self.conn.execute("SELECT COALESCE(MAX(row) + 1, 0) FROM chunks").fetchone()[0]
+
+    def existing_ids(self, chunk_ids: List[str]) -> set:
+        """Subset of chunk_ids already stored (and not deleted)."""
+        found = set()
+        for start in range(0, len(chunk_ids), 500):
+            batch = chunk_ids[start:start + 500]
+            rows = self.conn.execute(
+                f"SELECT chunk_id FROM chunks WHERE deleted = 0 AND chunk_id IN ({', '.join('?' * len(batch))})", batch
+            ).fetchall()
+            found.update(row["chunk_id"] for row in rows)
+        return found
+
+    def append(self, chunks: List[Dict[str, Any]], embeddings: np.ndarray) -> int:
+        """Append a batch of chunks and their embeddings; chunks already stored are skipped."""
+        embeddings = np.asarray(embeddings)
+        with self._lock:
+            if self.dim is None:
+                self.dim = int(embeddings.shape[1])
+                self.conn.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                                      [("dim", str(self.dim)), ("dtype", self.dtype.name)])
+                self.conn.commit()
+            elif embeddings.shape[1] != self.dim:
+                raise ValueError(f"Embedding dimension {embeddings.shape[1]} does not match store dimension {self.dim}")
+
+            chunk_ids = [utils.make_chunk_id(chunk) for chunk in chunks]
+            existing = self.existing_ids(chunk_ids)
+            keep = [i for i, chunk_id in enumerate(chunk_ids) if chunk_id not in existing]
+            if not keep:
+                return 0
+            first_row = len(self)
+            self._truncate_to_committed_rows()
+            with open(self.vectors_path, "ab") as f:
+                f.write(np.ascontiguousarray(embeddings[keep], dtype=self.dtype).tobytes())
+            rows = []
+            for offset, i in enumerate(keep):
+                chunk = {**chunks[i], "chunk_id": chunk_ids[i]}
+                rows.append((first_row + offset, *[chunk.get(field) for field in _SCALAR_FIELDS],
+                             *[json.dumps(chunk.get(field, [])) for field in _LIST_FIELDS]))
+            fields = ("row",) + _SCALAR_FIELDS + _LIST_FIELDS
+            self.conn.executemany(f"INSERT INTO chunks ({', '.join(fields)}) VALUES ({', '.join('?' * len(fields))})", rows)
+            self.conn.commit()
+            return len(keep)
+
+    def delete_file(self, sha256: str):
+        """Mark a file's chunks deleted; their rows stay in the matrix until compaction."""
+        with self._lock:
+            self.conn.execute("UPDATE chunks SET deleted = 1 WHERE sha256 = ?", (sha256,))
+            self.conn.commit()
+
+    def vectors(self) -> np.ndarray:
+        """Read-only memory map of the whole matrix (rows include deleted chunks)."""
+        rows = len(self)
+        if self.dim is None:
+            self._load_meta()
+        if self.dim is None or rows == 0:
+            return np.zeros((0, self.dim or 0), dtype=self.dtype)
+        return np.memmap(self.vectors_path, dtype=self.dtype, mode="r", shape=(rows, self.dim))
+
+    def _row_to_chunk(self, row: sqlite3.Row) -> Dict[str, Any]:
+        chunk = {field: row[field] for field in _SCALAR_FIELDS}
+        for field in _LIST_FIELDS:
+            chunk[field] = json.loads(row[field]) if row[field] else []
+        return chunk
+
+    def get_chunks(self, rows: List[int]) -> List[Dict[str, Any]]:
+        """Metadata of the chunks at the given matrix rows, in that order."""
+        by_row = {}
+        for start in range(0, len(rows), 500):
+            batch = [int(row) for row in rows[start:start + 500]]
+            for record in self.conn.execute(f"SELECT * FROM chunks WHERE row IN ({', '.join('?' * len(batch))})", batch):
+                by_row[record["row"]] = self._row_to_chunk(record)
+        return [by_row[int(row)] for row in rows]
+
+    def rows_for_ids(self, chunk_ids: List[str]) -> Dict[str, int]:
+        """Matrix row of each live chunk among chunk_ids; unknown or deleted IDs are left out."""
+        rows = {}
+        for start in range(0, len(chunk_ids), 500):
+            batch = chunk_ids[start:start + 500]
+            for record in self.conn.execute(
+                    f"SELECT chunk_id, row FROM chunks WHERE deleted = 0 AND chunk_id IN ({', '.join('?' * len(batch))})", batch):
+                rows[record["chunk_id"]] = record["row"]
+        return rows
+
+    def live_files(self) -> set:
+        """Content hashes of the files with live chunks."""
+        return {record[0] for record in self.conn.execute("SELECT DISTINCT sha256 FROM chunks WHERE deleted = 0")}
+
+    def file_rows(self, sha256s: List[str]) -> Dict[str, List[int]]:
+        """Matrix rows of the live chunks of each file, in order; files without live chunks are left out."""
+        rows = {}
+        for start in range(0, len(sha256s), 500):
+            batch = sha256s[start:start + 500]
+            for record in self.conn.execute(f"SELECT sha256, row FROM chunks WHERE deleted = 0 AND "
+                                            f"sha256 IN ({', '.join('?' * len(batch))}) ORDER BY row", batch):
+                rows.setdefault(record["sha256"], []).append(record["row"])
+        return rows
+
+    def deleted_rows(self) -> np.ndarray:
+        """Rows of deleted chunks, still present in the matrix."""
+        return np.array([record[0] for record in self.conn.execute("SELECT row FROM chunks WHERE deleted = 1")], dtype=np.int64)
+
+    def iter_columns(self, fields: List[str], first_row: int = 0) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        """(row, {field: value}) for every row from first_row on, deleted ones included; list fields are decoded."""
+        cursor = self.conn.execute(f"SELECT row, {', '.join(fields)} FROM chunks WHERE row >= ? ORDER BY row", (first_row,))
+        for record in cursor:
+            yield record["row"], {field: (json.loads(record[field]) if record[field] else [])
+                                  if field in _LIST_FIELDS else record[field] for field in fields}
+
+    def iter_batches(self, batch_size: int = 1000) -> Iterator[Tuple[List[Dict[str, Any]], np.ndarray]]:
+        """Yield (chunks, float32 embeddings) for live chunks, one bounded batch at a time."""
+        matrix = self.vectors()
+        cursor = self.conn.execute("SELECT * FROM chunks WHERE deleted = 0 ORDER BY row")
+        while True:
+            records = cursor.fetchmany(batch_size)
+            if not records:
+                return
+            rows = [record["row"] for record in records]
+            yield [self._row_to_chunk(record) for record in records], np.asarray(matrix[rows], dtype=np.float32)
+
+    def close(self):
+        self.conn.close()
@@ -1,61 +1,191 @@
-import chromadb
-from chromadb.config import Settings
 import os
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Callable, Iterable
+import numpy as np
 import config
+import metrics
 import utils
+from bm25_index import BM25Index
+from vector_index import NumpyVectorIndex
 
 logger = utils.setup_logging()
 
+def chunk_metadata(chunk: Dict[str, Any]) -> Dict[str, Any]:
+    """ChromaDB metadata of a chunk, typed for where filters.
+
+    year is an int and case_numbers (canonical, e.g. "C.A. 123") and judges
+    are lists, matched with $contains. ChromaDB rejects None and empty lists,
+    so unknown values are left out.
+    """
+    metadata = {
+        "file_name": chunk["file_name"],
+        "file_path": chunk["file_path"],
+        "case_name": chunk["case_name"],
+        "section": chunk["section"],
+        "start_char": chunk["start_char"],
+        "end_char": chunk["end_char"],
+        "chunk_index": chunk["chunk_index"],
+        "sha256_file": chunk["sha256"],
+        "hearing_dates": chunk["hearing_dates"]
+    }
+    if chunk.get("year"):
+        metadata["year"] = int(chunk["year"])
+    if chunk.get("case_numbers"):
+        metadata["case_numbers"] = list(chunk["case_numbers"])
+    if chunk.get("judges"):
+        metadata["judges"] = list(chunk["judges"])
+    return metadata
+
+class _NumpyCollection:
+    """The part of the ChromaDB collection API the query path uses, answered by a NumpyVectorIndex."""
+
+    def __init__(self, index: NumpyVectorIndex):
+        self.index = index
+
+    def count(self) -> int:
+        return len(self.index)
+
+    def _records(self, rows: List[int]) -> Dict[int, Dict[str, Any]]:
+        rows = sorted(set(rows))
+        return dict(zip(rows, self.index.chunks(rows)))
+
+    def query(self, query_embeddings: np.ndarray, n_results: int = 10, where: Dict[str, Any] = None) -> Dict[str, List]:
+        rows_batch, distances_batch = self.index.search(np.asarray(query_embeddings), n_results, where)
+        # Chunks of the whole batch are read in one pass
+        records = self._records([int(row) for rows in rows_batch for row in rows])
+        results = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        for rows, distances in zip(rows_batch, distances_batch):
+            chunks = [records[int(row)] for row in rows]
+            results["ids"].append([chunk["chunk_id"] for chunk in chunks])
+            results["documents"].append([chunk["chunk_text"] for chunk in chunks])
+            results["metadatas"].append([chunk_metadata(chunk) for chunk in chunks])
+            results["distances"].append([float(distance) for distance in distances])
+        return results
+
+    def get(self, ids: List[str], where: Dict[str, Any] = None, include: List[str] = ("documents", "metadatas")) -> Dict[str, List]:
+        found = self.index.rows_for_ids(ids)
+        rows = self.index.filter_rows([found[chunk_id] for chunk_id in ids if chunk_id in found], where)
+        records = self._records(rows)
+        chunks = [records[row] for row in rows]
+        results = {"ids": [chunk["chunk_id"] for chunk in chunks]}
+        if "documents" in include:
+            results["documents"] = [chunk["chunk_text"] for chunk in chunks]
+        if "metadatas" in include:
+            results["metadatas"] = [chunk_metadata(chunk) for chunk in chunks]
+        return results
+
 class Indexer:
-    def __init__(self, collection_name: str = config.CHROMA_COLLECTION_NAME, persist_dir: str = config.CHROMA_PERSIST_DIR):
-        self.client = chromadb.PersistentClient(path=persist_dir)
-        self.collection = self.client.get_or_create_collection(name=collection_name)
-        logger.info(f"Initialized ChromaDB collection: {collection_name}")
-
-    def upsert_chunks(self, chunks: List[Dict[str, Any]], embeddings: List[List[float]]):
-        """Upsert chunks with embeddings and metadata to ChromaDB."""
-        ids = []
-        documents = []
-        metadatas = []
-
-        for i, chunk in enumerate(chunks):
-            chunk_id = f"{chunk['sha256']}_{chunk['section']}_{chunk['chunk_index']}"
-            ids.append(chunk_id)
-            documents.append(chunk["chunk_text"])
-            metadata = {
-                "file_name": chunk["file_name"],
-                "file_path": chunk["file_path"],
-                "case_name": chunk["case_name"],
-                "case_number": str(chunk["case_numbers"]),
-                "year": "",  # Extract year if available
-                "judges": str(chunk["judges"]),
-                "section": chunk["section"],
-                "start_char": chunk["start_char"],
-                "end_char": chunk["end_char"],
-                "chunk_index": chunk["chunk_index"],
-                "sha256_file": chunk["sha256"],
-                "hearing_dates": chunk["hearing_dates"]
-            }
-            metadatas.append(metadata)
-
-        self.collection.upsert(
-            ids=ids,
-            documents=documents,
-            embeddings=embeddings,
-            metadatas=metadatas
-        )
-        logger.info(f"Upserted {len(chunks)} chunks to ChromaDB")
+    """Dense index (ChromaDB, or with backend "numpy" the in-process NumpyVectorIndex) plus the BM25 index."""
+
+    def __init__(self, collection_name: str = config.CHROMA_COLLECTION_NAME, persist_dir: str = config.CHROMA_PERSIST_DIR,
+                 backend: str = config.INDEX_BACKEND):
+        self.backend = backend
+        self.client = None
+        self.vectors = None
+        if backend == "numpy":
+            # Searches the embedding store the pipeline writes, so chunks are not stored twice
+            self.vectors = NumpyVectorIndex()
+            self.collection = _NumpyCollection(self.vectors)
+            self.upsert_batch_size = config.CHROMA_UPSERT_BATCH_SIZE
+        elif backend == "chroma":
+            # Imported here: chromadb takes about a second to import and most importers never open it
+            import chromadb
+            self.client = chromadb.PersistentClient(path=persist_dir)
+            self.collection = self.client.get_or_create_collection(name=collection_name)
+            # Chroma rejects upserts above the client's max batch size
+            max_batch_size = getattr(self.client, "get_max_batch_size", lambda: config.CHROMA_UPSERT_BATCH_SIZE)()
+            self.upsert_batch_size = min(config.CHROMA_UPSERT_BATCH_SIZE, max_batch_size)
+        else:
+            raise ValueError(f"Unknown index backend {backend!r}; expected 'chroma' or 'numpy'")
+        self._change_listeners = []
+        # Lexical index kept in step with the collection, for hybrid search
+        self.lexical = BM25Index() if config.BM25_ENABLED else None
+        logger.info(f"Initialized {backend} index" + (f" of collection {collection_name}" if backend == "chroma" else ""))
+
+    def add_change_listener(self, listener: Callable[[Iterable[str]], None]):
+        """Call listener with the content hashes of files whose chunks are upserted or deleted."""
+        self._change_listeners.append(listener)
+
+    def _notify(self, sha256_files: Iterable[str]):
+        sha256_files = set(sha256_files)
+        for listener in self._change_listeners:
+            try:
+                listener(sha256_files)
+            except Exception as e:
+                logger.error(f"Index change listener failed: {e}")
+
+    def existing_ids(self, ids: List[str]) -> set:
+        """Subset of ids already stored in the collection."""
+        if self.vectors is not None:
+            return self.vectors.existing_ids(ids)
+        found = set()
+        for start in range(0, len(ids), self.upsert_batch_size):
+            found.update(self.collection.get(ids=ids[start:start + self.upsert_batch_size], include=[])["ids"])
+        return found
+
+    def upsert_chunks(self, chunks: List[Dict[str, Any]], embeddings: np.ndarray):
+        """Upsert chunks with embeddings and metadata to ChromaDB, in size-bounded batches."""
+        with metrics.span("index_upsert", items=len(chunks)):
+            if self.vectors is not None:
+                self.vectors.add(chunks, embeddings)
+                if self.lexical is not None:
+                    self.lexical.add(chunks)
+                logger.info(f"Indexed {len(chunks)} chunks in the numpy vector index")
+                self._notify(chunk["sha256"] for chunk in chunks)
+                return
+            ids = []
+            documents = []
+            metadatas = []
+
+            for i, chunk in enumerate(chunks):
+                chunk_id = utils.make_chunk_id(chunk)
+                ids.append(chunk_id)
+                documents.append(chunk["chunk_text"])
+                metadatas.append(chunk_metadata(chunk))
+
+            for start in range(0, len(ids), self.upsert_batch_size):
+                end = start + self.upsert_batch_size
+                self.collection.upsert(
+                    ids=ids[start:end],
+                    documents=documents[start:end],
+                    embeddings=embeddings[start:end],
+                    metadatas=metadatas[start:end]
+                )
+            if self.lexical is not None:
+                self.lexical.add(chunks)
+            logger.info(f"Upserted {len(chunks)} chunks to ChromaDB")
+            self._notify(chunk["sha256"] for chunk in chunks)
+
+    def delete_file_chunks(self, sha256: str):
+        """Remove every chunk that came from the file with this content hash."""
+        with metrics.span("index_delete"):
+            if self.vectors is not None:
+                self.vectors.delete_file(sha256)
+            else:
+                self.collection.delete(where={"sha256_file": sha256})
+            if self.lexical is not None:
+                self.lexical.delete_file(sha256)
+        logger.info(f"Deleted chunks of file {sha256} from the {self.backend} index")
+        self._notify([sha256])
+
+    def flush(self):
+        """Make chunks buffered by the lexical index searchable, and (re)train IVF partitions when due."""
+        with metrics.span("index_flush"):
+            if self.lexical is not None:
+                self.lexical.flush()
+            if self.vectors is not None:
+                self.vectors.flush()
 
     def persist(self):
         """Persist the database."""
+        if self.client is None:
+            return
         self.client.persist()
         logger.info("ChromaDB persisted")
 
 if __name__ == "__main__":
     indexer = Indexer()
     # Example
-    sample_chunks = [{"sha256": "abc", "section": "ORDER", "chunk_index": 0, "chunk_text": "Sample", "file_name": "test.txt", "file_path": "path", "case_name": "", "case_numbers": [], "judges": [], "hearing_dates": "", "start_char": 0, "end_char": 10}]
-    sample_embeddings = [[0.1] * 768]  # Dummy
+    sample_chunks = [{"sha256": "abc", "section": "ORDER", "chunk_index": 0, "chunk_text": "Sample", "file_name": "test.txt", "file_path": "path", "case_name": "", "case_numbers": ["C.A. 1"], "judges": [], "hearing_dates": "", "year": 2010, "start_char": 0, "end_char": 10}]
+    sample_embeddings = np.full((1, 768), 0.1, dtype=np.float32)  # Dummy
     indexer.upsert_chunks(sample_chunks, sample_embeddings)
     indexer.persist()
@@ -0,0 +1,93 @@
+import threading
+from typing import Any, Dict, List, Optional
+import numpy as np
+import config
+import metrics
+import utils
+from embedding_store import EmbeddingStore
+from vector_index import NumpyVectorIndex
+
+logger = utils.setup_logging()
+
+# Chunk metadata that varies within a judgment; judgments cannot be filtered by it
+_CHUNK_FIELDS = ("section", "chunk_index", "start_char", "end_char")
+
+def judgment_where(where: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """The part of a chunk where clause (see build_where) that applies to whole judgments.
+
+    Year, judges, case numbers and names are document-level, so a judgment
+    matches them exactly; clauses on chunk-level fields such as section are
+    dropped (an $or containing one is dropped whole), which only widens the
+    judgment-level filter.
+    """
+    if not where:
+        return None
+    if "$and" in where:
+        clauses = [clause for clause in map(judgment_where, where["$and"]) if clause]
+        return None if not clauses else clauses[0] if len(clauses) == 1 else {"$and": clauses}
+    if "$or" in where:
+        clauses = [judgment_where(clause) for clause in where["$or"]]
+        return None if any(clause is None for clause in clauses) else {"$or": clauses}
+    return None if next(iter(where)) in _CHUNK_FIELDS else where
+
+def _judgment_record(chunk: Dict[str, Any]) -> Dict[str, Any]:
+    # Stored like a chunk, so the same metadata filters apply; the text is only a label
+    return {"sha256": chunk["sha256"], "file_name": chunk["file_name"], "file_path": chunk["file_path"],
+            "case_name": chunk["case_name"], "section": "", "chunk_index": 0, "start_char": 0, "end_char": 0,
+            "hearing_dates": chunk["hearing_dates"], "year": chunk["year"], "case_numbers": chunk["case_numbers"],
+            "judges": chunk["judges"], "chunk_text": chunk["case_name"] or chunk["file_name"]}
+
+class JudgmentIndex:
+    """One vector per judgment (sha256_file): the normalized mean of its chunk embeddings.
+
+    sync() brings it in line with the embedding store the pipeline writes.
+    Vectors and judgment-level metadata live in an EmbeddingStore of their
+    own and are searched exactly in-process: there are orders of magnitude
+    fewer judgments than chunks.
+    """
+
+    def __init__(self, index_dir: str = config.JUDGMENT_INDEX_DIR):
+        # Both the pipeline and the API's re-index jobs write here; appends drop a crashed writer's tail themselves
+        self.store = EmbeddingStore(index_dir, dtype="float32", recover=False)
+        self.index = NumpyVectorIndex(self.store, mode="exact", dtype="float32")
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def sync(self, chunk_store: EmbeddingStore, batch_size: int = 256) -> Dict[str, int]:
+        """Pool a vector for every judgment with live chunks and none yet, and drop judgments whose chunks are gone."""
+        with self._lock, metrics.span("judgment_sync") as record:
+            live = chunk_store.live_files()
+            indexed = self.store.live_files()
+            for sha256 in indexed - live:
+                self.index.delete_file(sha256)
+            new = sorted(live - indexed)
+            record["items"] = len(new)
+            matrix = chunk_store.vectors()
+            for start in range(0, len(new), batch_size):
+                file_rows = chunk_store.file_rows(new[start:start + batch_size])
+                records, vectors = [], []
+                for sha256, rows in file_rows.items():
+                    pooled = np.asarray(matrix[rows], dtype=np.float32).mean(axis=0)
+                    vectors.append(pooled / max(float(np.linalg.norm(pooled)), 1e-12))
+                    # Metadata is extracted per document, so any chunk carries the judgment's
+                    records.append(_judgment_record(chunk_store.get_chunks(rows[:1])[0]))
+                if records:
+                    self.index.add(records, np.stack(vectors))
+        if new or indexed - live:
+            logger.info(f"Judgment index: {len(new)} judgments added, {len(indexed - live)} removed")
+        return {"added": len(new), "removed": len(indexed - live)}
+
+    def search(self, query_embeddings: np.ndarray, k: int, where: Optional[Dict[str, Any]] = None) -> List[List[str]]:
+        """Content hashes of the k judgments nearest each query, nearest first; where is a chunk where clause."""
+        rows_batch, _ = self.index.search(query_embeddings, k, judgment_where(where))
+        rows = sorted({int(row) for rows in rows_batch for row in rows})
+        sha256_of = {row: chunk["sha256"] for row, chunk in zip(rows, self.index.chunks(rows))}
+        return [[sha256_of[int(row)] for row in rows] for rows in rows_batch]
+
+if __name__ == "__main__":
+    judgments = JudgmentIndex()
+    with utils.index_write_lock():
+        print(judgments.sync(EmbeddingStore()))
+    print(f"{len(judgments)} judgments indexed")
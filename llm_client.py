@@ -0,0 +1,220 @@
+import asyncio
+import hashlib
+import json
+import random
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, AsyncIterator, Dict, Iterator
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+import config
+import utils
+
+logger = utils.setup_logging()
+
+def _payload_key(payload: Dict[str, Any]) -> str:
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+def _is_retryable(e: Exception) -> bool:
+    """Connection failures, timeouts and 5xx responses are worth retrying; 4xx are not."""
+    if isinstance(e, (requests.ConnectionError, requests.Timeout, httpx.TransportError)):
+        return True
+    if isinstance(e, requests.HTTPError):
+        return e.response is not None and e.response.status_code >= 500
+    if isinstance(e, httpx.HTTPStatusError):
+        return e.response.status_code >= 500
+    return False
+
+class OllamaClient:
+    """Pooled Ollama /api/generate client for sync and async callers.
+
+    Connections are kept alive and reused, at most max_concurrency generations
+    run against Ollama at once, failed calls are retried with exponential
+    backoff, and identical non-streaming requests already in flight are
+    coalesced into one generation whose result every caller receives.
+    """
+
+    def __init__(self, base_url: str = config.OLLAMA_API_URL,
+                 connect_timeout: float = config.OLLAMA_CONNECT_TIMEOUT_SECONDS,
+                 read_timeout: float = config.OLLAMA_READ_TIMEOUT_SECONDS,
+                 max_connections: int = config.OLLAMA_MAX_CONNECTIONS,
+                 max_concurrency: int = config.OLLAMA_MAX_CONCURRENCY,
+                 max_retries: int = config.OLLAMA_MAX_RETRIES,
+                 retry_backoff: float = config.OLLAMA_RETRY_BACKOFF_SECONDS):
+        self.base_url = base_url.rstrip("/")
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_connections = max_connections
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_connections)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+        # Async state is created on first async use so it binds to the running event loop
+        self._async_client = None
+        self._async_slots = None
+        self._async_inflight = {}
+
+        self.counters = {"requests": 0, "retries": 0, "coalesced": 0, "failures": 0}
+
+    def _count(self, name: str):
+        with self._lock:
+            self.counters[name] += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.counters)
+
+    def _backoff(self, attempt: int) -> float:
+        # Exponential with jitter so retries of a burst do not arrive together
+        return self.retry_backoff * (2 ** attempt) * random.uniform(0.5, 1.0)
+
+    def _should_retry(self, e: Exception, attempt: int) -> bool:
+        if attempt < self.max_retries and _is_retryable(e):
+            self._count("retries")
+            logger.warning(f"Ollama request failed ({e}); retry {attempt + 1} of {self.max_retries}")
+            return True
+        self._count("failures")
+        return False
+
+    # Sync API
+
+    def _post(self, payload: Dict[str, Any], stream: bool = False) -> requests.Response:
+        response = self.session.post(f"{self.base_url}/api/generate", json=payload, stream=stream,
+                                     timeout=(self.connect_timeout, self.read_timeout))
+        response.raise_for_status()
+        return response
+
+    def _generate_once(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        attempt = 0
+        while True:
+            self._count("requests")
+            try:
+                with self._slots:
+                    return self._post(payload).json()
+            except Exception as e:
+                if not self._should_retry(e, attempt):
+                    raise
+            time.sleep(self._backoff(attempt))
+            attempt += 1
+
+    def generate(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """POST a non-streaming generate request and return Ollama's JSON response."""
+        key = _payload_key(payload)
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+        if not leader:
+            self._count("coalesced")
+            return future.result()
+        try:
+            result = self._generate_once(payload)
+            future.set_result(result)
+            return result
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+    def stream(self, payload: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        """POST a streaming generate request and yield each JSON object Ollama sends.
+
+        Failures are retried only until the first object has been yielded.
+        """
+        attempt = 0
+        while True:
+            self._count("requests")
+            yielded = False
+            try:
+                with self._slots, self._post(payload, stream=True) as response:
+                    for line in response.iter_lines():
+                        if line:
+                            yielded = True
+                            yield json.loads(line)
+                return
+            except Exception as e:
+                if yielded or not self._should_retry(e, attempt):
+                    raise
+            time.sleep(self._backoff(attempt))
+            attempt += 1
+
+    def close(self):
+        self.session.close()
+
+    # Async API
+
+    def _ensure_async(self):
+        if self._async_client is None:
+            limits = httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections)
+            timeout = httpx.Timeout(self.read_timeout, connect=self.connect_timeout)
+            self._async_client = httpx.AsyncClient(base_url=self.base_url, limits=limits, timeout=timeout)
+            self._async_slots = asyncio.Semaphore(self.max_concurrency)
+
+    async def _agenerate_once(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        attempt = 0
+        while True:
+            self._count("requests")
+            try:
+                async with self._async_slots:
+                    response = await self._async_client.post("/api/generate", json=payload)
+                    response.raise_for_status()
+                    return response.json()
+            except Exception as e:
+                if not self._should_retry(e, attempt):
+                    raise
+            await asyncio.sleep(self._backoff(attempt))
+            attempt += 1
+
+    async def agenerate(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """generate for async callers."""
+        self._ensure_async()
+        key = _payload_key(payload)
+        task = self._async_inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._agenerate_once(payload))
+            self._async_inflight[key] = task
+            task.add_done_callback(lambda _: self._async_inflight.pop(key, None))
+        else:
+            self._count("coalesced")
+        # Shielded: a caller that disconnects does not cancel the generation the others wait for
+        return await asyncio.shield(task)
+
+    async def astream(self, payload: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+        """stream for async callers."""
+        self._ensure_async()
+        attempt = 0
+        while True:
+            self._count("requests")
+            yielded = False
+            try:
+                async with self._async_slots:
+                    async with self._async_client.stream("POST", "/api/generate", json=payload) as response:
+                        response.raise_for_status()
+                        async for line in response.aiter_lines():
+                            if line:
+                                yielded = True
+                                yield json.loads(line)
+                return
+            except Exception as e:
+                if yielded or not self._should_retry(e, attempt):
+                    raise
+            await asyncio.sleep(self._backoff(attempt))
+            attempt += 1
+
+    async def aclose(self):
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
@@ -1,44 +1,253 @@
-from fastapi import FastAPI, UploadFile, File
-from query_processor import QueryProcessor
+from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, Query, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from query_processor import QueryProcessor, build_where, group_by_judgment
 from rag import RAG
+from reindex_jobs import ReindexRunner
+from typing import Any, Dict, List, Optional
+import asyncio
+import config
+import json
+import metrics
+import models
 import os
+import re
 import shutil
+import time
+import utils
 
-app = FastAPI(title="Legal Document Q&A API")
+logger = utils.setup_logging()
 
-query_processor = QueryProcessor()
-rag = RAG()
+class RequestLimiter:
+    """Serve at most max_concurrent requests at once.
+
+    Up to max_queued more wait for a slot, each for at most timeout seconds;
+    beyond that the request is rejected with 503 instead of piling up.
+    """
+
+    def __init__(self, max_concurrent: int, max_queued: int, timeout: float):
+        self.semaphore = asyncio.Semaphore(max_concurrent)
+        self.max_queued = max_queued
+        self.timeout = timeout
+        self.queued = 0
+
+    async def acquire(self):
+        """Wait for a slot, or raise a 503 HTTPException; pair with release()."""
+        if self.semaphore.locked() and self.queued >= self.max_queued:
+            raise HTTPException(status_code=503, detail="Server busy, try again later", headers={"Retry-After": "1"})
+        self.queued += 1
+        try:
+            await asyncio.wait_for(self.semaphore.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=503, detail="Timed out waiting for a free slot", headers={"Retry-After": "1"})
+        finally:
+            self.queued -= 1
+
+    def release(self):
+        self.semaphore.release()
+
+    @asynccontextmanager
+    async def slot(self):
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global query_processor, rag, reindex_runner
+    # Models load here rather than at import, and are warmed up before the first request is accepted
+    await run_in_threadpool(models.warm_up_query_path if config.WARM_UP_ON_STARTUP else models.get_rag)
+    query_processor = models.get_query_processor()
+    rag = models.get_rag()
+    # Uploads are indexed in the background with the already-loaded embedder and shared index
+    reindex_runner = ReindexRunner(embedder=query_processor.embedder)
+    # Uploads saved while the service was down are picked up by this first job
+    reindex_runner.submit("startup")
+    with metrics.profile("api"):
+        yield
+    reindex_runner.close(timeout=5)
+    await rag.aclose()
+    executor.shutdown(wait=False)
+
+app = FastAPI(title="Legal Document Q&A API", lifespan=lifespan)
+
+query_processor: QueryProcessor = None
+rag: RAG = None
+reindex_runner: ReindexRunner = None
+# Embedding and ChromaDB searches are CPU-bound and synchronous; they run here (or on the
+# query batcher's thread when batching is on) so the event loop stays free
+executor = ThreadPoolExecutor(max_workers=config.API_EXECUTOR_WORKERS, thread_name_prefix="query")
+limiter = RequestLimiter(config.API_MAX_CONCURRENT_REQUESTS, config.API_MAX_QUEUED_REQUESTS, config.API_QUEUE_TIMEOUT_SECONDS)
+REQUEST_SECONDS = metrics.REGISTRY.histogram("lawbook_http_request_seconds", "Time to respond to each API request "
+                                             "(to the start of the body for streamed responses)")
+
+@app.middleware("http")
+async def record_request(request: Request, call_next):
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Labelled by route template (/train/{job_id}), not by raw path
+        route = request.scope.get("route")
+        REQUEST_SECONDS.observe(time.perf_counter() - started, method=request.method,
+                                route=route.path if route is not None else "unmatched", status=status)
+
+def search_filters(year: Optional[int] = None, year_from: Optional[int] = None, year_to: Optional[int] = None,
+                   judge: Optional[List[str]] = Query(None), case_number: Optional[str] = None,
+                   section: Optional[str] = None) -> Dict[str, Any]:
+    """Metadata filters of the search endpoints, pushed into the ChromaDB query (see build_where)."""
+    filters = {"year": year, "year_from": year_from, "year_to": year_to, "judge": judge,
+               "case_number": case_number, "section": section}
+    try:
+        build_where(filters)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return filters
+
+async def _process_query(query: str, top_k: int = config.MAX_QUERY_RESULTS, filters: Dict[str, Any] = None):
+    if query_processor.batcher is not None:
+        # Awaited directly: waiting for the batch does not hold an executor thread
+        return await asyncio.wrap_future(query_processor.submit_query(query, top_k, filters))
+    return await asyncio.get_running_loop().run_in_executor(executor, query_processor.process_query, query, top_k, filters)
 
 @app.post("/ask")
-async def ask_question(query: str):
+async def ask_question(query: str, filters: Dict[str, Any] = Depends(search_filters)):
     """Query the system and get answer with citations."""
-    results = query_processor.process_query(query)
-    answer = rag.generate_answer(query, results)
+    async with limiter.slot():
+        results = await _process_query(query, filters=filters)
+        answer = await rag.agenerate_answer(query, results)
     return {"query": query, "answer": answer, "retrieved_passages": results}
 
+def _sse(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.api_route("/ask/stream", methods=["GET", "POST"])
+async def ask_question_stream(query: str, filters: Dict[str, Any] = Depends(search_filters)):
+    """Stream the answer as server-sent events.
+
+    Events: `citations` (citations and retrieved passages, sent before
+    generation starts), one `token` per generated piece of text, then `done`
+    with time-to-first-token and total generation time, or `error`.
+    """
+    # The slot is held until the stream ends, not just until the response starts. It is released
+    # by whichever runs first: the generator's finally, or the response's background task (which
+    # also runs if the body is never iterated)
+    await limiter.acquire()
+    released = False
+
+    def release():
+        nonlocal released
+        if not released:
+            released = True
+            limiter.release()
+
+    try:
+        results = await _process_query(query, filters=filters)
+    except BaseException:
+        release()
+        raise
+
+    async def events():
+        try:
+            yield _sse("citations", {"query": query, "citations": rag.build_citations(results), "retrieved_passages": results})
+            started = time.perf_counter()
+            first_token = None
+            try:
+                async for token in rag.astream_answer(query, results):
+                    if first_token is None:
+                        first_token = time.perf_counter() - started
+                    yield _sse("token", {"text": token})
+            except Exception as e:
+                logger.error(f"Error streaming answer: {e}")
+                yield _sse("error", {"detail": "Error in generating answer."})
+                return
+            yield _sse("done", {"time_to_first_token_ms": first_token * 1000 if first_token is not None else None,
+                                "total_ms": (time.perf_counter() - started) * 1000})
+        finally:
+            release()
+
+    return StreamingResponse(events(), media_type="text/event-stream", background=BackgroundTask(release),
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 @app.post("/search")
-async def search_passages(query: str, top_k: int = 5):
-    """Retrieve top-k passages without generation."""
-    results = query_processor.process_query(query, top_k)
+async def search_passages(query: str, top_k: int = 5, group_by_case: bool = False,
+                          filters: Dict[str, Any] = Depends(search_filters)):
+    """Retrieve top-k passages without generation, optionally filtered by year, judge, case number or section.
+
+    With group_by_case, the passages are also returned grouped by judgment under `cases`.
+    """
+    async with limiter.slot():
+        results = await _process_query(query, top_k, filters)
+    if group_by_case:
+        return {"query": query, "results": results, "cases": group_by_judgment(results)}
     return {"query": query, "results": results}
 
+@app.get("/stats")
+async def stats():
+    """Query batching (achieved batch sizes, added queueing latency), re-ranking, Ollama client and answer cache statistics."""
+    return {"query_batching": query_processor.batcher.stats() if query_processor.batcher is not None else None,
+            "reranker": query_processor.reranker.stats() if query_processor.reranker is not None else None,
+            "llm": rag.client.stats(),
+            "answer_cache": rag.cache.stats() if rag.cache is not None else None}
+
+def _gauges(prefix: str, value: Any) -> Dict[str, float]:
+    # Numeric leaves of a nested stats dict, named by their path
+    if isinstance(value, dict):
+        return {name: number for key, item in value.items()
+                for name, number in _gauges(f"{prefix}_{re.sub('[^a-zA-Z0-9_]', '_', str(key))}", item).items()}
+    return {prefix: float(value)} if isinstance(value, (int, float)) else {}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Stage timings, item and error counts, request latencies and /stats values, in the Prometheus text format."""
+    gauges = _gauges("lawbook", await stats())
+    gauges["lawbook_api_requests_queued"] = limiter.queued
+    return PlainTextResponse(metrics.REGISTRY.render(gauges), media_type="text/plain; version=0.0.4")
+
+def _save_upload(file: UploadFile) -> str:
+    file_name = os.path.basename(file.filename)
+    os.makedirs(config.UPLOAD_FOLDER, exist_ok=True)
+    # Written under a temporary name and renamed, so the watcher never indexes half a file
+    save_path = os.path.join(config.UPLOAD_FOLDER, file_name)
+    with open(save_path + ".part", "wb") as f:
+        shutil.copyfileobj(file.file, f)
+    os.replace(save_path + ".part", save_path)
+    return file_name
+
 @app.post("/upload")
 async def upload_documents(files: list[UploadFile] = File(...)):
-    """Upload additional documents."""
+    """Upload additional documents; they are indexed in the background and searchable once the job is done."""
     uploaded = []
     for file in files:
-        save_path = os.path.join("uploaded_docs", file.filename)
-        os.makedirs("uploaded_docs", exist_ok=True)
-        with open(save_path, "wb") as f:
-            shutil.copyfileobj(file.file, f)
-        uploaded.append(file.filename)
-    return {"uploaded_files": uploaded}
+        uploaded.append(await run_in_threadpool(_save_upload, file))
+    return {"uploaded_files": uploaded, "job": reindex_runner.submit("upload")}
 
 @app.post("/train")
 async def reindex():
-    """Re-index new uploads."""
-    # Trigger re-indexing pipeline
-    return {"message": "Re-indexing initiated."}
+    """Re-index new, changed and deleted uploads in the background; poll /train/{job_id} for progress."""
+    job = reindex_runner.submit("train")
+    return {"message": "Re-indexing initiated.", "job": job}
+
+@app.get("/train")
+async def reindex_jobs():
+    """Recent re-index jobs, newest first."""
+    return {"jobs": reindex_runner.list_jobs()}
+
+@app.get("/train/{job_id}")
+async def reindex_status(job_id: str):
+    """State, progress (files and chunks) and throughput of a re-index job."""
+    job = reindex_runner.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    return job
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,146 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import List, Dict, Any, Optional, Iterator
+import config
+import utils
+
+logger = utils.setup_logging()
+
+# Pipeline stages in completion order
+STAGES = ("ingested", "chunked", "embedded", "indexed")
+
+def stage_reached(stage: str, required: str) -> bool:
+    """True if stage is at or past required."""
+    return STAGES.index(stage) >= STAGES.index(required)
+
+_FIELDS = ("file_path", "file_name", "file_size", "last_modified", "inode", "sha256", "processed_at", "stage")
+
+class ManifestStore:
+    """SQLite-backed manifest of processed files and their pipeline stage.
+
+    Every write is committed on its own, so an interrupted run keeps all the
+    progress it made; lookups are primary-key/index hits rather than a load of
+    the whole manifest.
+    """
+
+    def __init__(self, db_path: str = config.MANIFEST_DB_PATH):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        # Autocommit: each statement is its own transaction
+        self.conn = sqlite3.connect(db_path, isolation_level=None, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            " file_path TEXT PRIMARY KEY, file_name TEXT, file_size INTEGER, last_modified REAL,"
+            " inode INTEGER, sha256 TEXT NOT NULL, processed_at TEXT, stage TEXT NOT NULL, updated_at REAL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS files_sha256 ON files (sha256)")
+        # Content hashes whose chunks must still be removed from the index
+        self.conn.execute("CREATE TABLE IF NOT EXISTS stale_hashes (sha256 TEXT PRIMARY KEY)")
+
+    def get(self, file_path: str) -> Optional[Dict[str, Any]]:
+        """Manifest entry for a file, or None."""
+        with self._lock:
+            row = self.conn.execute("SELECT * FROM files WHERE file_path = ?", (file_path,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def put(self, entry: Dict[str, Any], stage: str):
+        """Insert or replace a file's entry at the given stage.
+
+        If the file previously had different content, the old hash is marked
+        stale in the same transaction.
+        """
+        values = {field: entry.get(field) for field in _FIELDS}
+        values["stage"] = stage
+        with self._lock:
+            self.conn.execute("BEGIN")
+            try:
+                row = self.conn.execute("SELECT sha256 FROM files WHERE file_path = ?", (entry["file_path"],)).fetchone()
+                if row is not None and row["sha256"] != entry["sha256"]:
+                    self.conn.execute("INSERT OR IGNORE INTO stale_hashes (sha256) VALUES (?)", (row["sha256"],))
+                self.conn.execute(
+                    f"INSERT OR REPLACE INTO files ({', '.join(_FIELDS)}, updated_at) VALUES ({', '.join('?' * len(_FIELDS))}, ?)",
+                    (*[values[field] for field in _FIELDS], time.time())
+                )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def set_stage(self, file_path: str, stage: str):
+        """Record that a file completed a pipeline stage."""
+        with self._lock:
+            self.conn.execute("UPDATE files SET stage = ?, updated_at = ? WHERE file_path = ?",
+                              (stage, time.time(), file_path))
+
+    def delete(self, file_path: str):
+        """Forget a file and mark its content hash stale."""
+        with self._lock:
+            self.conn.execute("BEGIN")
+            try:
+                self.conn.execute("INSERT OR IGNORE INTO stale_hashes (sha256) SELECT sha256 FROM files WHERE file_path = ?", (file_path,))
+                self.conn.execute("DELETE FROM files WHERE file_path = ?", (file_path,))
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def find_by_hash(self, sha256: str, stage: str = None) -> Optional[Dict[str, Any]]:
+        """Any file with this content hash (optionally at or past stage)."""
+        with self._lock:
+            rows = self.conn.execute("SELECT * FROM files WHERE sha256 = ?", (sha256,)).fetchall()
+        for row in rows:
+            if stage is None or stage_reached(row["stage"], stage):
+                return dict(row)
+        return None
+
+    def iter_paths(self, prefix: str = "") -> Iterator[str]:
+        """File paths in the manifest starting with prefix."""
+        with self._lock:
+            rows = self.conn.execute("SELECT file_path FROM files WHERE substr(file_path, 1, ?) = ?",
+                                     (len(prefix), prefix)).fetchall()
+        return (row["file_path"] for row in rows)
+
+    def get_stale_hashes(self) -> List[str]:
+        """Stale hashes no longer referenced by any file."""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT sha256 FROM stale_hashes WHERE sha256 NOT IN (SELECT sha256 FROM files) ORDER BY sha256"
+            ).fetchall()
+        return [row["sha256"] for row in rows]
+
+    def clear_stale_hash(self, sha256: str):
+        """Call once the index no longer holds chunks for sha256."""
+        with self._lock:
+            self.conn.execute("DELETE FROM stale_hashes WHERE sha256 = ?", (sha256,))
+
+    def count(self) -> int:
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+    def import_json(self, json_path: str, stage: str = "embedded") -> int:
+        """One-off import of a processed_manifest.json written by earlier versions."""
+        with open(json_path, 'r') as f:
+            manifest = json.load(f)
+        with self._lock:
+            self.conn.execute("BEGIN")
+            for key, entry in manifest.items():
+                # The oldest manifests were keyed by sha256 with only file_path/processed_at
+                values = {"sha256": key, **entry}
+                values["file_name"] = values.get("file_name") or os.path.basename(values["file_path"])
+                values["stage"] = stage
+                self.conn.execute(
+                    f"INSERT OR IGNORE INTO files ({', '.join(_FIELDS)}, updated_at) VALUES ({', '.join('?' * len(_FIELDS))}, ?)",
+                    (*[values.get(field) for field in _FIELDS], time.time())
+                )
+            self.conn.execute("COMMIT")
+        logger.info(f"Imported {len(manifest)} entries from {json_path}")
+        return len(manifest)
+
+    def close(self):
+        self.conn.close()
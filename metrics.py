@@ -0,0 +1,304 @@
+import bisect
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter as _Tally, deque
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import numpy as np
+import config
+import utils
+
+logger = utils.setup_logging()
+
+# Histogram bucket upper bounds in seconds, from sub-millisecond lookups to long generations
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def _labels_key(labels: Dict[str, Any]) -> Tuple[Tuple[str, str], ...]:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+def _format_labels(key: Tuple[Tuple[str, str], ...], extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    pairs = key + extra
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value != int(value) or abs(value) >= 1e15 else str(int(value))
+
+class Counter:
+    """Monotonic count per label set."""
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = _labels_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        with self.lock:
+            return self.values.get(_labels_key(labels), 0.0)
+
+    def totals(self) -> Dict[Tuple[Tuple[str, str], ...], float]:
+        with self.lock:
+            return dict(self.values)
+
+    def render(self) -> List[str]:
+        with self.lock:
+            values = sorted(self.values.items())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{_format_labels(key)} {_format_value(value)}" for key, value in values]
+        return lines
+
+class Histogram:
+    """Bucketed observations per label set, plus the last sample_size of them for percentiles."""
+
+    def __init__(self, name: str, help_text: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS,
+                 sample_size: int = config.METRICS_SAMPLE_SIZE):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self.sample_size = sample_size
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = _labels_key(labels)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = {"buckets": [0] * len(self.buckets), "count": 0, "sum": 0.0,
+                                             "recent": deque(maxlen=self.sample_size)}
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series["buckets"][index] += 1
+            series["count"] += 1
+            series["sum"] += value
+            series["recent"].append(value)
+
+    def totals(self) -> Dict[Tuple[Tuple[str, str], ...], Tuple[int, float]]:
+        """(count, sum) per label set."""
+        with self.lock:
+            return {key: (series["count"], series["sum"]) for key, series in self.series.items()}
+
+    def percentiles(self, percentiles: Tuple[int, ...] = (50, 95, 99), **labels) -> Dict[int, float]:
+        """Percentiles of the recent observations of one label set; empty if there are none."""
+        with self.lock:
+            series = self.series.get(_labels_key(labels))
+            recent = list(series["recent"]) if series is not None else []
+        return {p: float(np.percentile(recent, p)) for p in percentiles} if recent else {}
+
+    def render(self) -> List[str]:
+        with self.lock:
+            series = sorted((key, list(s["buckets"]), s["count"], s["sum"]) for key, s in self.series.items())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, buckets, count, total in series:
+            cumulative = 0
+            for bound, bucket in zip(self.buckets, buckets):
+                cumulative += bucket
+                lines.append(f"{self.name}_bucket{_format_labels(key, (('le', _format_value(bound)),))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(key, (('le', '+Inf'),))} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+class Registry:
+    """Named metrics of the process, rendered together in the Prometheus text format."""
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def _get(self, name: str, factory):
+        with self.lock:
+            if name not in self.metrics:
+                self.metrics[name] = factory()
+            return self.metrics[name]
+
+    def counter(self, name: str, help_text: str) -> Counter:
+        return self._get(name, lambda: Counter(name, help_text))
+
+    def histogram(self, name: str, help_text: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._get(name, lambda: Histogram(name, help_text, buckets))
+
+    def render(self, gauges: Dict[str, float] = None) -> str:
+        """Every metric, followed by point-in-time gauges (name -> value) supplied by the caller."""
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines += metric.render()
+        for name, value in sorted((gauges or {}).items()):
+            lines += [f"# TYPE {name} gauge", f"{name} {_format_value(value)}"]
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+# Every instrumented component reports its work as stages of these
+STAGE_SECONDS = REGISTRY.histogram("lawbook_stage_seconds", "Time spent per call of each pipeline and query stage")
+STAGE_ITEMS = REGISTRY.counter("lawbook_stage_items_total", "Items (files, chunks, queries) processed by each stage")
+STAGE_ERRORS = REGISTRY.counter("lawbook_stage_errors_total", "Calls of each stage that raised")
+
+def observe(stage: str, seconds: float, items: int = 0):
+    """Record one call of stage timed elsewhere (e.g. in a worker process)."""
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    if items:
+        STAGE_ITEMS.inc(items, stage=stage)
+
+@contextmanager
+def span(stage: str, items: int = 0) -> Iterator[Dict[str, int]]:
+    """Time the block as one call of stage.
+
+    Yields a dict whose "items" (initially items) is counted when the block
+    exits, for counts known only at the end.
+    """
+    record = {"items": items}
+    started = time.perf_counter()
+    try:
+        yield record
+    except Exception:
+        STAGE_ERRORS.inc(stage=stage)
+        raise
+    finally:
+        observe(stage, time.perf_counter() - started, record["items"])
+
+def stage_totals() -> Dict[str, Tuple[int, float, float]]:
+    """(calls, seconds, items) of every stage so far."""
+    items = {dict(key)["stage"]: value for key, value in STAGE_ITEMS.totals().items()}
+    return {dict(key)["stage"]: (count, total, items.get(dict(key)["stage"], 0.0))
+            for key, (count, total) in STAGE_SECONDS.totals().items()}
+
+def summary_table(since: Dict[str, Tuple[int, float, float]] = None, wall_seconds: float = None) -> str:
+    """Per-stage calls, time and throughput since an earlier stage_totals(), as a text table.
+
+    busy is the stage's time as a share of wall_seconds; stages running in
+    parallel threads or processes, or nested in each other, add up to more
+    than 100%.
+    """
+    since = since or {}
+    header = f"{'stage':<18} {'calls':>7} {'total s':>9} {'mean ms':>9} {'p95 ms':>9} {'items':>9} {'items/s':>9}"
+    if wall_seconds:
+        header += f" {'busy':>6}"
+    lines = [header, "-" * len(header)]
+    for stage, (calls, seconds, items) in sorted(stage_totals().items(), key=lambda item: -item[1][1]):
+        before = since.get(stage, (0, 0.0, 0.0))
+        calls, seconds, items = calls - before[0], seconds - before[1], items - before[2]
+        if not calls:
+            continue
+        p95 = STAGE_SECONDS.percentiles((95,), stage=stage).get(95, 0.0)
+        line = (f"{stage:<18} {calls:>7} {seconds:>9.2f} {seconds / calls * 1000:>9.1f} {p95 * 1000:>9.1f} "
+                f"{items:>9.0f} {items / seconds if seconds else 0.0:>9.1f}")
+        if wall_seconds:
+            line += f" {seconds / wall_seconds:>6.0%}"
+        lines.append(line)
+    return "\n".join(lines)
+
+# Stacks whose innermost frame is in these modules are threads blocked on a lock, queue or socket
+_IDLE_MODULES = ("threading.py", "queue.py", "selectors.py")
+
+class SamplingProfiler:
+    """Sample every thread's Python stack at a fixed interval from a background thread.
+
+    Unlike cProfile, which sees only the thread that enabled it, this covers
+    the pipeline's stage threads and the API's executor threads, at a cost
+    that does not depend on how many calls they make. Samples of idle
+    threads are counted but not attributed to functions.
+    """
+
+    def __init__(self, interval: float = config.PROFILER_SAMPLE_INTERVAL_MS / 1000):
+        self.interval = interval
+        self.samples = 0
+        self.idle = 0
+        self.own = _Tally()
+        self.cumulative = _Tally()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stopped.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                self.samples += 1
+                if os.path.basename(frame.f_code.co_filename) in _IDLE_MODULES:
+                    self.idle += 1
+                    continue
+                self.own[self._location(frame)] += 1
+                # A recursive function counts once per sample
+                seen = set()
+                while frame is not None:
+                    location = self._location(frame)
+                    if location not in seen:
+                        seen.add(location)
+                        self.cumulative[location] += 1
+                    frame = frame.f_back
+
+    @staticmethod
+    def _location(frame) -> str:
+        code = frame.f_code
+        return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+    def report(self, limit: int = 30) -> str:
+        """The functions seen most often, on top of the stack (own) and anywhere on it (cumulative)."""
+        lines = [f"{self.samples} thread samples every {self.interval * 1000:.0f}ms, {self.idle} idle"]
+        for title, tally in (("own", self.own), ("cumulative", self.cumulative)):
+            lines.append(f"\n{'samples':>8} {'share':>6}  {title}")
+            for location, count in tally.most_common(limit):
+                lines.append(f"{count:>8} {count / max(self.samples, 1):>6.1%}  {location}")
+        return "\n".join(lines)
+
+@contextmanager
+def profile(name: str, profiler: Optional[str] = None):
+    """Profile the block with config.PROFILER ("cprofile", "sampling", or None for no profiling).
+
+    The report is written under config.PROFILE_DIR, named after name and
+    the start time: a .prof file (pstats, snakeviz) for cProfile, a text
+    report for the sampling profiler; the top entries are also logged.
+    """
+    profiler = profiler if profiler is not None else config.PROFILER
+    if not profiler:
+        yield
+        return
+    if profiler not in ("cprofile", "sampling"):
+        raise ValueError(f"Unknown profiler {profiler!r}; expected 'cprofile' or 'sampling'")
+    os.makedirs(config.PROFILE_DIR, exist_ok=True)
+    path = os.path.join(config.PROFILE_DIR, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}")
+    if profiler == "cprofile":
+        # Only the calling thread is profiled
+        collector = cProfile.Profile()
+        collector.enable()
+    else:
+        collector = SamplingProfiler()
+        collector.start()
+    try:
+        yield
+    finally:
+        if profiler == "cprofile":
+            collector.disable()
+            collector.dump_stats(path + ".prof")
+            summary = io.StringIO()
+            pstats.Stats(collector, stream=summary).sort_stats("cumulative").print_stats(20)
+            logger.info(f"cProfile of {name} saved to {path}.prof\n{summary.getvalue()}")
+        else:
+            collector.stop()
+            report = collector.report()
+            with open(path + ".txt", "w") as f:
+                f.write(report)
+            logger.info(f"Sampling profile of {name} saved to {path}.txt\n{collector.report(limit=15)}")
@@ -0,0 +1,109 @@
+import collections
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List
+import numpy as np
+import utils
+
+logger = utils.setup_logging()
+
+class MicroBatcher:
+    """Coalesce items submitted from many threads into batches for one handler call.
+
+    A batch opens with the first waiting item and closes after max_wait_ms or
+    once it holds max_batch_size items; handle_batch gets the items in order
+    and must return one result per item, which resolves that caller's future.
+    """
+
+    def __init__(self, handle_batch: Callable[[List[Any]], List[Any]], max_batch_size: int, max_wait_ms: float,
+                 name: str = "micro-batcher", history: int = 1000):
+        self.handle_batch = handle_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+        # Recent batch sizes and per-item queueing delays, for percentiles
+        self.batch_sizes = collections.deque(maxlen=history)
+        self.waits = collections.deque(maxlen=history)
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self.thread.start()
+
+    def submit(self, item: Any) -> Future:
+        """Queue an item; the future resolves to its result from handle_batch."""
+        future = Future()
+        self.queue.put((item, future, time.perf_counter()))
+        return future
+
+    def _collect(self) -> list:
+        # Items whose callers cancelled their future (e.g. a client disconnected) are dropped;
+        # the rest are marked running, so they can no longer be cancelled
+        batch = []
+        while not batch:
+            entry = self.queue.get()
+            if entry[1].set_running_or_notify_cancel():
+                batch.append(entry)
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                entry = self.queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if entry[1].set_running_or_notify_cancel():
+                batch.append(entry)
+        return batch
+
+    @staticmethod
+    def _resolve(future: Future, result: Any = None, error: BaseException = None):
+        if future.done():
+            return
+        try:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+        except Exception as e:
+            logger.error(f"Could not resolve a batched item: {e}")
+
+    def _run(self):
+        # Nothing raised here may end the thread: every later submit would wait forever
+        while True:
+            batch = self._collect()
+            started = time.perf_counter()
+            try:
+                results = self.handle_batch([item for item, _, _ in batch])
+                if len(results) != len(batch):
+                    raise RuntimeError(f"handle_batch returned {len(results)} results for {len(batch)} items")
+            except Exception as e:
+                logger.error(f"{self.thread.name} batch of {len(batch)} failed: {e}")
+                for _, future, _ in batch:
+                    self._resolve(future, error=e)
+            else:
+                for (_, future, _), result in zip(batch, results):
+                    self._resolve(future, result)
+            with self.lock:
+                self.batches += 1
+                self.items += len(batch)
+                self.batch_sizes.append(len(batch))
+                self.waits.extend(started - submitted for _, _, submitted in batch)
+
+    def stats(self) -> Dict[str, float]:
+        """Achieved batch sizes and the queueing delay batching added to each item."""
+        with self.lock:
+            sizes = list(self.batch_sizes)
+            waits = list(self.waits)
+            batches, items = self.batches, self.items
+        stats = {"batches": batches, "items": items, "mean_batch_size": items / batches if batches else 0.0}
+        if sizes:
+            stats["recent_max_batch_size"] = max(sizes)
+        if waits:
+            stats["wait_p50_ms"] = float(np.percentile(waits, 50) * 1000)
+            stats["wait_p95_ms"] = float(np.percentile(waits, 95) * 1000)
+            stats["wait_max_ms"] = max(waits) * 1000
+        return stats
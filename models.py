@@ -0,0 +1,114 @@
+import threading
+import time
+from typing import Any, Callable, Dict
+import config
+import utils
+
+logger = utils.setup_logging()
+
+# Process-wide registry of loaded models. Each process (including every
+# pipeline pool worker) loads a given model at most once, on first use.
+# Reentrant, since a loader may itself get other models.
+_models: Dict[str, Any] = {}
+_lock = threading.RLock()
+
+def get_model(key: str, loader: Callable[[], Any]) -> Any:
+    """Return the model registered under key, loading it on first use."""
+    model = _models.get(key)
+    if model is None:
+        with _lock:
+            model = _models.get(key)
+            if model is None:
+                model = loader()
+                _models[key] = model
+    return model
+
+def _load_sentence_splitter():
+    import spacy
+    # Only sentence boundaries are needed: drop the tagger, parser, NER, etc.
+    nlp = spacy.load(config.SPACY_MODEL_NAME, exclude=["tagger", "parser", "ner", "lemmatizer", "attribute_ruler"])
+    if "senter" in nlp.disabled:
+        nlp.enable_pipe("senter")
+    elif not nlp.has_pipe("senter"):
+        nlp.add_pipe("sentencizer")
+    nlp.max_length = config.SPACY_MAX_LENGTH
+    logger.info(f"Loaded sentence splitter: {config.SPACY_MODEL_NAME} ({', '.join(nlp.pipe_names)})")
+    return nlp
+
+def get_sentence_splitter():
+    """spaCy pipeline configured for sentence segmentation only."""
+    return get_model("spacy:" + config.SPACY_MODEL_NAME, _load_sentence_splitter)
+
+def _load_chunk_tokenizer():
+    from transformers import AutoTokenizer
+    tokenizer = AutoTokenizer.from_pretrained(config.CHUNK_TOKENIZER_NAME)
+    logger.info(f"Loaded chunk tokenizer: {config.CHUNK_TOKENIZER_NAME}")
+    return tokenizer
+
+def get_chunk_tokenizer():
+    """Tokenizer used to measure chunk lengths."""
+    return get_model("tokenizer:" + config.CHUNK_TOKENIZER_NAME, _load_chunk_tokenizer)
+
+def _load_nltk_punkt():
+    import nltk
+    nltk.download('punkt', quiet=True)
+    from nltk.tokenize import sent_tokenize
+    return sent_tokenize
+
+def get_nltk_sentence_tokenizer():
+    """NLTK fallback used when spaCy is not installed."""
+    return get_model("nltk:punkt", _load_nltk_punkt)
+
+def warm_up():
+    """Load the preprocessing models up front, e.g. in a pool worker initializer."""
+    try:
+        get_sentence_splitter()
+    except ImportError:
+        get_nltk_sentence_tokenizer()
+    get_chunk_tokenizer()
+
+# Query-path services. Their modules are imported on first use, so importing
+# this module (or the API and UI that use it) stays cheap.
+
+def get_embedder():
+    """Embedder for the configured model and backend, shared by the query path and in-process re-indexing."""
+    from embedding import Embedder
+    return get_model(f"embedder:{config.EMBEDDING_MODEL_NAME}:{config.EMBEDDING_BACKEND}", Embedder)
+
+def get_indexer():
+    """ChromaDB collection (and its BM25 index) shared by every searcher and writer in the process."""
+    from indexing import Indexer
+    return get_model("indexer", Indexer)
+
+def get_judgment_index():
+    """Judgment-level vectors for two-stage retrieval, shared by the query path and in-process re-indexing."""
+    from judgment_index import JudgmentIndex
+    return get_model("judgment_index", JudgmentIndex)
+
+def get_query_processor():
+    """QueryProcessor with the configured batching, hybrid search, two-stage retrieval and re-ranking."""
+    from query_processor import QueryProcessor
+    return get_model("query_processor", QueryProcessor)
+
+def _load_rag():
+    from answer_cache import make_answer_cache
+    from rag import RAG
+    return RAG(cache=make_answer_cache(get_query_processor()))
+
+def get_rag():
+    """RAG with its pooled Ollama client and an answer cache invalidated by the shared index."""
+    return get_model("rag", _load_rag)
+
+def warm_up_query_path():
+    """Load the query-path models and run a dummy query through them.
+
+    The first real request then finds the embedder, ChromaDB, BM25 segments,
+    re-ranker and context tokenizer loaded and their first-call setup done.
+    """
+    started = time.perf_counter()
+    query_processor = get_query_processor()
+    rag = get_rag()
+    query_processor.embedder.warm_up()
+    query_processor.search_batch(["warm-up query"], 1)
+    rag.context_builder.count_tokens(["warm-up query"])
+    logger.info(f"Query path warmed up in {time.perf_counter() - started:.1f}s")
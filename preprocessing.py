@@ -1,5 +1,7 @@
-from typing import List, Dict, Any
+import time
+from typing import List, Dict, Any, Tuple
 import config
+import models
 import utils
 
 logger = utils.setup_logging()
@@ -17,44 +19,51 @@ class Preprocessor:
 
     def extract_metadata(self, text: str) -> Dict[str, Any]:
         """Extract detailed metadata."""
+        hearing_dates = utils.extract_dates(text)
         return {
             "case_numbers": utils.extract_case_numbers(text),
             "case_name": utils.extract_title(text),
             "judges": utils.extract_judges(text),
-            "hearing_dates": utils.extract_dates(text)
+            "hearing_dates": hearing_dates,
+            "year": utils.extract_year(text, hearing_dates)
         }
 
-    def detect_and_chunk_sections(self, text: str) -> List[Dict[str, Any]]:
-        """Detect sections and chunk them."""
-        sections = utils.detect_sections(text)
+    def detect_and_chunk_sections(self, text: str, sections: List[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """Detect sections (unless their spans are given) and chunk them."""
+        if sections is None:
+            sections = utils.section_spans(text)
         chunked_sections = []
 
-        for section in sections:
-            sentences = utils.sentence_tokenize(section["text"])
-            chunks = utils.chunk_sentences(sentences, config.TARGET_CHUNK_SIZE, config.CHUNK_OVERLAP)
-            for i, chunk in enumerate(chunks):
+        section_texts = [text[section["start_char"]:section["end_char"]] for section in sections]
+        section_sentence_spans = utils.sentence_spans_batch(section_texts)
+        for section, section_text, spans in zip(sections, section_texts, section_sentence_spans):
+            offset = section["start_char"]
+            chunks = utils.chunk_sentence_spans(section_text, spans, config.TARGET_CHUNK_SIZE, config.CHUNK_OVERLAP)
+            for chunk in chunks:
                 chunked_sections.append({
                     "section": section["section"],
-                    "chunk_index": i,
-                    "chunk_text": chunk,
-                    "start_char": text.find(chunk),  # Approximate
-                    "end_char": text.find(chunk) + len(chunk)
+                    # Numbered across the document: section names can repeat, chunk IDs must not
+                    "chunk_index": len(chunked_sections),
+                    "chunk_text": chunk["chunk_text"],
+                    "start_char": offset + chunk["start_char"],
+                    "end_char": offset + chunk["end_char"]
                 })
 
         return chunked_sections
 
     def process_document(self, metadata: Dict[str, Any]) -> List[Dict[str, Any]]:
         """Process a single document: preprocess, extract, chunk."""
-        raw_text = metadata["raw_text"]
-        cleaned_text = self.preprocess_text(raw_text)
+        # Normalize, strip headers/footers and find section spans in one pass
+        cleaned_text, sections = utils.clean_document(metadata["raw_text"])
         detailed_metadata = self.extract_metadata(cleaned_text)
-        chunks = self.detect_and_chunk_sections(cleaned_text)
+        chunks = self.detect_and_chunk_sections(cleaned_text, sections)
 
-        # Combine metadata with chunks
+        # Combine metadata with chunks; the full document text is not repeated per chunk
+        file_metadata = {key: value for key, value in metadata.items() if key != "raw_text"}
         processed_chunks = []
         for chunk in chunks:
             chunk_metadata = {
-                **metadata,
+                **file_metadata,
                 **detailed_metadata,
                 **chunk
             }
@@ -62,6 +71,27 @@ class Preprocessor:
 
         return processed_chunks
 
+# Per-process preprocessor used by the pipeline's worker pool
+_worker_preprocessor = None
+
+def init_worker():
+    """Create the preprocessor and load its models once per pool worker."""
+    global _worker_preprocessor
+    _worker_preprocessor = Preprocessor()
+    models.warm_up()
+
+def process_document_in_worker(metadata: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], float]:
+    """Pool entry point: process one document with the worker's preprocessor.
+
+    Returns the chunks and the seconds it took; the caller records the
+    timing, since metrics collected in a worker process are never exported.
+    """
+    if _worker_preprocessor is None:
+        init_worker()
+    started = time.perf_counter()
+    chunks = _worker_preprocessor.process_document(metadata)
+    return chunks, time.perf_counter() - started
+
 if __name__ == "__main__":
     # Example usage
     preprocessor = Preprocessor()
@@ -1,40 +1,234 @@
-from typing import List, Dict, Any
+import json
+from concurrent.futures import Future
+from typing import List, Dict, Any, Optional, Tuple
+import numpy as np
 import config
+import metrics
+import models
 import utils
-from embedding import Embedder
-from indexing import Indexer
+from micro_batcher import MicroBatcher
+from reranker import CrossEncoderReranker
 
 logger = utils.setup_logging()
 
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = config.HYBRID_RRF_K) -> List[Tuple[str, float]]:
+    """Fuse ranked ID lists: an ID scores sum(1 / (k + rank)) over the lists it is in, best first."""
+    scores = {}
+    for ranking in rankings:
+        for rank, item_id in enumerate(ranking, start=1):
+            scores[item_id] = scores.get(item_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+def build_where(filters: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """ChromaDB where clause for search filters, or None to search everything.
+
+    year, year_from and year_to match the judgment year; judge (a name or a
+    list of names, all required) and case_number ("C.A. No. 123", or a bare
+    number for any case type) match the canonical metadata; section,
+    case_name and file_name match exactly. None values are ignored and
+    unknown keys raise ValueError.
+    """
+    clauses = []
+    for key, value in (filters or {}).items():
+        if value is None or value == []:
+            continue
+        if key == "year":
+            clauses.append({"year": int(value)})
+        elif key == "year_from":
+            clauses.append({"year": {"$gte": int(value)}})
+        elif key == "year_to":
+            clauses.append({"year": {"$lte": int(value)}})
+        elif key == "judge":
+            names = [value] if isinstance(value, str) else value
+            clauses += [{"judges": {"$contains": utils.normalize_judge(name)}} for name in names]
+        elif key == "case_number":
+            options = [{"case_numbers": {"$contains": case_number}} for case_number in utils.canonical_case_numbers(str(value))]
+            clauses.append(options[0] if len(options) == 1 else {"$or": options})
+        elif key == "section":
+            clauses.append({"section": str(value).strip().upper()})
+        elif key in ("case_name", "file_name"):
+            clauses.append({key: value})
+        else:
+            raise ValueError(f"Unknown search filter: {key}")
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+def diversify(results: List[Dict[str, Any]], top_k: int, per_judgment: int) -> List[Dict[str, Any]]:
+    """The best top_k results, at most per_judgment from any one judgment.
+
+    When too few judgments match, the remaining slots are filled with the
+    best skipped results, ranked after the others.
+    """
+    kept, skipped, counts = [], [], {}
+    for result in results:
+        sha256 = result["metadata"].get("sha256_file")
+        if counts.get(sha256, 0) < per_judgment:
+            counts[sha256] = counts.get(sha256, 0) + 1
+            kept.append(result)
+        else:
+            skipped.append(result)
+    return (kept + skipped)[:top_k]
+
+def group_by_judgment(results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Results grouped by judgment, in the order of each judgment's best-ranked passage."""
+    groups = {}
+    for rank, result in enumerate(results):
+        metadata = result["metadata"]
+        group = groups.setdefault(metadata.get("sha256_file"), {
+            "sha256_file": metadata.get("sha256_file"), "case_name": metadata.get("case_name"),
+            "file_name": metadata.get("file_name"), "year": metadata.get("year"),
+            "case_numbers": metadata.get("case_numbers", []), "best_rank": rank, "passages": []})
+        group["passages"].append(result)
+    return list(groups.values())
+
 class QueryProcessor:
-    def __init__(self):
-        self.embedder = Embedder()
-        self.indexer = Indexer()
+    def __init__(self, batching: bool = config.QUERY_BATCHING_ENABLED, hybrid: bool = config.HYBRID_SEARCH_ENABLED,
+                 rerank: bool = config.RERANK_ENABLED, two_stage: bool = config.TWO_STAGE_ENABLED,
+                 per_judgment: int = config.MAX_CHUNKS_PER_JUDGMENT):
+        # Process-wide instances: every QueryProcessor, and the pipeline when it runs in this
+        # process, share one loaded model and one index (so upserts reach this index's listeners)
+        self.embedder = models.get_embedder()
+        self.indexer = models.get_indexer()
+        # Dense results are fused with BM25 matches, which catch exact citations and case numbers
+        self.lexical = self.indexer.lexical if hybrid else None
+        # Concurrent queries share one embedding pass and one collection.query
+        self.batcher = None
+        if batching:
+            self.batcher = MicroBatcher(self._search_items, config.QUERY_BATCH_MAX_SIZE, config.QUERY_BATCH_MAX_WAIT_MS,
+                                        name="query-batcher")
+        # Retrieval over-fetches candidates and the cross-encoder picks the top_k
+        self.reranker = CrossEncoderReranker() if rerank else None
+        # Chunk searches are restricted to the judgments whose pooled vectors are nearest the query
+        self.judgments = models.get_judgment_index() if two_stage else None
+        self.per_judgment = per_judgment
+
+    def process_query(self, query: str, top_k: int = config.MAX_QUERY_RESULTS,
+                      filters: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """Process a query: embed, search (only chunks matching filters, see build_where), return results."""
+        if self.batcher is not None:
+            return self.submit_query(query, top_k, filters).result()
+        return self.search_batch([query], top_k, build_where(filters))[0]
+
+    def submit_query(self, query: str, top_k: int = config.MAX_QUERY_RESULTS,
+                     filters: Optional[Dict[str, Any]] = None) -> Future:
+        """Queue a query for the next batch; the future resolves to process_query's result."""
+        # Invalid filters raise here, in the caller
+        return self.batcher.submit((query, top_k, build_where(filters)))
 
-    def process_query(self, query: str, top_k: int = config.MAX_QUERY_RESULTS) -> List[Dict[str, Any]]:
-        """Process a query: embed, search, return results."""
-        # Embed query
-        query_embedding = self.embedder.encode_chunks([query])[0]
+    def _search_items(self, items: List[Tuple[str, int, Optional[Dict[str, Any]]]]) -> List[List[Dict[str, Any]]]:
+        # One embedding pass for the whole batch, then one search per distinct filter, run at
+        # its largest top_k; each query's results are trimmed to its own top_k
+        with metrics.span("query_embed", items=len(items)):
+            query_embeddings = self.embedder.encode_chunks([query for query, _, _ in items])
+        groups = {}
+        for i, (_, _, where) in enumerate(items):
+            groups.setdefault(json.dumps(where, sort_keys=True), []).append(i)
+        results = [None] * len(items)
+        for indices in groups.values():
+            group = self._search([items[i][0] for i in indices], query_embeddings[indices],
+                                 max(items[i][1] for i in indices), items[indices[0]][2])
+            for i, formatted in zip(indices, group):
+                results[i] = formatted[:items[i][1]]
+        return results
+
+    def search_batch(self, queries: List[str], top_k: int = config.MAX_QUERY_RESULTS,
+                     where: Optional[Dict[str, Any]] = None) -> List[List[Dict[str, Any]]]:
+        """Embed queries in one pass and search them with one ChromaDB call, fused with BM25 when hybrid
+        and re-ranked by the cross-encoder when reranking.
+
+        where (see build_where) is pushed into the ChromaDB query, so only matching chunks are scanned.
+        """
+        with metrics.span("query_embed", items=len(queries)):
+            query_embeddings = self.embedder.encode_chunks(queries)
+        return self._search(queries, query_embeddings, top_k, where)
+
+    def _search(self, queries: List[str], query_embeddings: np.ndarray, top_k: int,
+                where: Optional[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+        # With a per-judgment limit, a larger pool of results is cut down to top_k
+        pool = top_k * 4 if self.per_judgment else top_k
+        candidates = max(pool, config.RERANK_CANDIDATES) if self.reranker is not None else pool
+        n_results = max(candidates, config.HYBRID_CANDIDATES) if self.lexical is not None else candidates
 
         # Search in ChromaDB
-        results = self.indexer.collection.query(
-            query_embeddings=[query_embedding],
-            n_results=top_k
-        )
-
-        # Format results
-        formatted_results = []
-        for i in range(len(results['ids'][0])):
-            result = {
-                "id": results['ids'][0][i],
-                "document": results['documents'][0][i],
-                "metadata": results['metadatas'][0][i],
-                "distance": results['distances'][0][i] if 'distances' in results else None
-            }
-            formatted_results.append(result)
-
-        logger.info(f"Retrieved {len(formatted_results)} results for query: {query}")
-        return formatted_results
+        with metrics.span("dense_search", items=len(queries)):
+            if self.judgments is not None and len(self.judgments):
+                results = self._query_within_judgments(query_embeddings, n_results, where)
+            else:
+                results = self.indexer.collection.query(
+                    query_embeddings=query_embeddings,
+                    n_results=n_results,
+                    where=where
+                )
+
+        # Format results, one list per query
+        batch_results = []
+        for q, query in enumerate(queries):
+            formatted_results = []
+            for i in range(len(results['ids'][q])):
+                result = {
+                    "id": results['ids'][q][i],
+                    "document": results['documents'][q][i],
+                    "metadata": results['metadatas'][q][i],
+                    "distance": results['distances'][q][i] if results.get('distances') is not None else None
+                }
+                formatted_results.append(result)
+            batch_results.append(formatted_results)
+
+        if self.lexical is not None:
+            # BM25 does not see the metadata: over-fetch, and _fuse drops the chunks the filter excludes
+            lexical_results = n_results * config.HYBRID_FILTER_OVERFETCH if where else n_results
+            with metrics.span("bm25_search", items=len(queries)):
+                lexical_batch = [self.lexical.search(query, lexical_results) for query in queries]
+            with metrics.span("fuse", items=len(queries)):
+                batch_results = self._fuse(batch_results, lexical_batch, candidates, where)
+        if self.reranker is not None:
+            with metrics.span("rerank", items=len(queries)):
+                batch_results = self.reranker.rerank_batch(queries, batch_results, pool)
+        if self.per_judgment:
+            batch_results = [diversify(formatted_results, top_k, self.per_judgment) for formatted_results in batch_results]
+        for query, formatted_results in zip(queries, batch_results):
+            logger.info(f"Retrieved {len(formatted_results)} results for query: {query}")
+        return batch_results
+
+    def _query_within_judgments(self, query_embeddings: np.ndarray, n_results: int,
+                                where: Optional[Dict[str, Any]]) -> Dict[str, List]:
+        # Each query has its own candidate judgments, so the chunk search runs per query; in the
+        # result layout of collection.query. BM25 matches are fused later from the whole corpus.
+        results = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        with metrics.span("judgment_search", items=len(query_embeddings)):
+            candidates = self.judgments.search(query_embeddings, config.JUDGMENT_CANDIDATES, where)
+        for query_embedding, sha256s in zip(query_embeddings, candidates):
+            found = {key: [[]] for key in results}
+            if sha256s:
+                within = {"sha256_file": {"$in": sha256s}}
+                found = self.indexer.collection.query(query_embeddings=query_embedding[None], n_results=n_results,
+                                                      where={"$and": [where, within]} if where else within)
+            for key in results:
+                results[key].append(found[key][0])
+        return results
+
+    def _fuse(self, dense_batch: List[List[Dict[str, Any]]], lexical_batch: List[List[Tuple[str, float]]],
+              top_k: int, where: Optional[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+        # BM25 matches no query's dense search returned are fetched from ChromaDB in one call for
+        # the whole batch, through the same filter; matches it does not return are dropped
+        documents = {result["id"]: {**result, "distance": None} for dense in dense_batch for result in dense}
+        missing = list({chunk_id for lexical in lexical_batch for chunk_id, _ in lexical if chunk_id not in documents})
+        if missing:
+            found = self.indexer.collection.get(ids=missing, where=where, include=["documents", "metadatas"])
+            for chunk_id, document, metadata in zip(found["ids"], found["documents"], found["metadatas"]):
+                documents[chunk_id] = {"id": chunk_id, "document": document, "metadata": metadata, "distance": None}
+
+        fused_batch = []
+        for dense, lexical in zip(dense_batch, lexical_batch):
+            lexical = [(chunk_id, score) for chunk_id, score in lexical if chunk_id in documents]
+            ranking = reciprocal_rank_fusion([[result["id"] for result in dense], [chunk_id for chunk_id, _ in lexical]])
+            own = {result["id"]: result for result in dense}
+            bm25_scores = dict(lexical)
+            fused_batch.append([{**own.get(chunk_id, documents[chunk_id]), "score": score,
+                                 "bm25_score": bm25_scores.get(chunk_id)}
+                                for chunk_id, score in ranking[:top_k]])
+        return fused_batch
 
 if __name__ == "__main__":
     processor = QueryProcessor()
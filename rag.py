@@ -1,36 +1,37 @@
-import requests
-from typing import List, Dict, Any
+import asyncio
+import time
+from typing import List, Dict, Any, Iterator, AsyncIterator
 import config
+import metrics
 import utils
+from answer_cache import AnswerCache
+from context_builder import ContextBuilder
+from llm_client import OllamaClient
 
 logger = utils.setup_logging()
 
 class RAG:
-    def __init__(self, ollama_url: str = config.OLLAMA_API_URL):
+    def __init__(self, ollama_url: str = config.OLLAMA_API_URL, client: OllamaClient = None,
+                 model: str = config.OLLAMA_MODEL, cache: AnswerCache = None, context_builder: ContextBuilder = None):
         self.ollama_url = ollama_url
+        self.model = model
+        self.client = client if client is not None else OllamaClient(ollama_url)
+        self.cache = cache
+        self.context_builder = context_builder if context_builder is not None else ContextBuilder()
 
-    def generate_answer(self, query: str, retrieved_docs: List[Dict[str, Any]]) -> dict:
-        """Generate answer using RAG with Ollama."""
-        # Prepare context from retrieved documents
-        context = "\n\n".join([doc["document"] for doc in retrieved_docs])
-        prompt = f"Context:\n{context}\n\nQuestion: {query}\n\nAnswer based on the context:"
-
-        # Call Ollama API
-        payload = {
-            "model": "llama2",  # Assuming LLaMA2 is loaded
+    def build_payload(self, query: str, context: Dict[str, Any], stream: bool = False) -> dict:
+        """Ollama /api/generate request for a query and its context (from context_builder.build)."""
+        prompt = f"Context:\n{context['text']}\n\nQuestion: {query}\n\nAnswer based on the context:"
+        return {
+            "model": self.model,
             "prompt": prompt,
-            "stream": False
+            "stream": stream
         }
-        try:
-            response = requests.post(f"{self.ollama_url}/api/generate", json=payload)
-            response.raise_for_status()
-            result = response.json()
-            answer = result.get("response", "No answer generated.")
-        except Exception as e:
-            logger.error(f"Error generating answer: {e}")
-            answer = "Error in generating answer."
 
-        # Add citations
+    def _context_stats(self, context: Dict[str, Any]) -> Dict[str, int]:
+        return {key: context[key] for key in ("prompt_tokens", "retrieved_tokens", "tokens_saved")}
+
+    def build_citations(self, retrieved_docs: List[Dict[str, Any]]) -> List[str]:
         citations = []
         for doc in retrieved_docs:
             meta = doc.get("metadata", {})
@@ -38,8 +39,127 @@ class RAG:
             section = meta.get('section', 'Unknown Section')
             citation = f"{case_name}, {section}"
             citations.append(citation)
+        return citations
+
+    def generate_answer(self, query: str, retrieved_docs: List[Dict[str, Any]]) -> dict:
+        """Generate answer using RAG with Ollama."""
+        if self.cache is not None:
+            with metrics.span("answer_cache") as record:
+                cached = self.cache.get(query, retrieved_docs, self.model)
+                record["items"] = int(cached is not None)
+            if cached is not None:
+                return cached
+        with metrics.span("context_build", items=len(retrieved_docs)):
+            context = self.context_builder.build(retrieved_docs)
+        payload = self.build_payload(query, context)
+        try:
+            with metrics.span("generate", items=1):
+                result = self.client.generate(payload)
+            answer = result.get("response", "No answer generated.")
+        except Exception as e:
+            logger.error(f"Error generating answer: {e}")
+            return {"answer": "Error in generating answer.", "citations": self.build_citations(retrieved_docs)}
+        response = {"answer": answer, "citations": self.build_citations(retrieved_docs), "context": self._context_stats(context)}
+        if self.cache is not None:
+            self.cache.put(query, retrieved_docs, self.model, response)
+        return response
+
+    async def agenerate_answer(self, query: str, retrieved_docs: List[Dict[str, Any]]) -> dict:
+        """generate_answer for async callers: the Ollama call does not block the event loop."""
+        # Cache lookups may embed the query for the semantic tier, so they run off the event loop
+        if self.cache is not None:
+            with metrics.span("answer_cache") as record:
+                cached = await asyncio.to_thread(self.cache.get, query, retrieved_docs, self.model)
+                record["items"] = int(cached is not None)
+            if cached is not None:
+                return cached
+        with metrics.span("context_build", items=len(retrieved_docs)):
+            context = await asyncio.to_thread(self.context_builder.build, retrieved_docs)
+        payload = self.build_payload(query, context)
+        try:
+            with metrics.span("generate", items=1):
+                result = await self.client.agenerate(payload)
+            answer = result.get("response", "No answer generated.")
+        except Exception as e:
+            logger.error(f"Error generating answer: {e}")
+            return {"answer": "Error in generating answer.", "citations": self.build_citations(retrieved_docs)}
+        response = {"answer": answer, "citations": self.build_citations(retrieved_docs), "context": self._context_stats(context)}
+        if self.cache is not None:
+            await asyncio.to_thread(self.cache.put, query, retrieved_docs, self.model, response)
+        return response
+
+    def stream_answer(self, query: str, retrieved_docs: List[Dict[str, Any]]) -> Iterator[str]:
+        """Yield answer tokens as Ollama generates them; errors are raised to the caller.
+
+        A cached answer is yielded whole; a generated one is cached only once
+        Ollama reports it done. The "generate_stream" stage spans the
+        whole stream (including the time the caller takes to consume it) and
+        counts tokens; "generate_first_token" is the time to the first one.
+        """
+        if self.cache is not None:
+            with metrics.span("answer_cache") as record:
+                cached = self.cache.get(query, retrieved_docs, self.model)
+                record["items"] = int(cached is not None)
+            if cached is not None:
+                yield cached["answer"]
+                return
+        tokens = []
+        with metrics.span("context_build", items=len(retrieved_docs)):
+            context = self.context_builder.build(retrieved_docs)
+        started = time.perf_counter()
+        done = False
+        for part in self.client.stream(self.build_payload(query, context, stream=True)):
+            if part.get("error"):
+                raise RuntimeError(f"Ollama stream failed: {part['error']}")
+            if part.get("response"):
+                if not tokens:
+                    metrics.observe("generate_first_token", time.perf_counter() - started)
+                tokens.append(part["response"])
+                yield part["response"]
+            if part.get("done"):
+                done = True
+                break
+        metrics.observe("generate_stream", time.perf_counter() - started, len(tokens))
+        if not done:
+            logger.warning(f"Ollama stream ended before the answer was done; not caching {len(tokens)} tokens")
+        elif self.cache is not None:
+            self.cache.put(query, retrieved_docs, self.model,
+                           {"answer": "".join(tokens), "citations": self.build_citations(retrieved_docs)})
+
+    async def astream_answer(self, query: str, retrieved_docs: List[Dict[str, Any]]) -> AsyncIterator[str]:
+        """stream_answer for async callers."""
+        if self.cache is not None:
+            with metrics.span("answer_cache") as record:
+                cached = await asyncio.to_thread(self.cache.get, query, retrieved_docs, self.model)
+                record["items"] = int(cached is not None)
+            if cached is not None:
+                yield cached["answer"]
+                return
+        tokens = []
+        with metrics.span("context_build", items=len(retrieved_docs)):
+            context = await asyncio.to_thread(self.context_builder.build, retrieved_docs)
+        started = time.perf_counter()
+        done = False
+        async for part in self.client.astream(self.build_payload(query, context, stream=True)):
+            if part.get("error"):
+                raise RuntimeError(f"Ollama stream failed: {part['error']}")
+            if part.get("response"):
+                if not tokens:
+                    metrics.observe("generate_first_token", time.perf_counter() - started)
+                tokens.append(part["response"])
+                yield part["response"]
+            if part.get("done"):
+                done = True
+                break
+        metrics.observe("generate_stream", time.perf_counter() - started, len(tokens))
+        if not done:
+            logger.warning(f"Ollama stream ended before the answer was done; not caching {len(tokens)} tokens")
+        elif self.cache is not None:
+            await asyncio.to_thread(self.cache.put, query, retrieved_docs, self.model,
+                                    {"answer": "".join(tokens), "citations": self.build_citations(retrieved_docs)})
 
-        return {"answer": answer, "citations": citations}
+    async def aclose(self):
+        await self.client.aclose()
 
 if __name__ == "__main__":
     rag = RAG()
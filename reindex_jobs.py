@@ -0,0 +1,159 @@
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+import config
+import utils
+from embedding import Embedder
+from run_pipeline import run_full_pipeline
+
+logger = utils.setup_logging()
+
+def folder_signature(folder: str) -> tuple:
+    """(path, size, mtime) of every .txt file under folder; changes whenever a file is added, edited or removed."""
+    signature = []
+    for file_path in utils.list_txt_files(folder):
+        try:
+            stat = os.stat(file_path)
+        except FileNotFoundError:
+            continue
+        signature.append((file_path, stat.st_size, stat.st_mtime_ns))
+    return tuple(sorted(signature))
+
+class ReindexRunner:
+    """Incrementally re-index a folder in a background thread while queries are served.
+
+    Each job runs the streaming pipeline over input_dir: only new or changed
+    files are chunked, embedded and upserted (through the process's shared
+    Indexer, so caches built on the old chunks are invalidated), and chunks
+    of deleted or replaced files are removed. Jobs run one at a time; a job
+    submitted while another is still queued joins it, since one run picks up
+    every change. With a watch interval the folder is polled and a job is
+    queued whenever its listing changes.
+    """
+
+    def __init__(self, input_dir: str = config.UPLOAD_FOLDER, embedder: Embedder = None,
+                 watch_interval: float = config.REINDEX_WATCH_INTERVAL_SECONDS,
+                 history: int = config.REINDEX_JOB_HISTORY):
+        self.input_dir = input_dir
+        self.embedder = embedder
+        self.watch_interval = watch_interval
+        self.history = history
+        self.jobs = OrderedDict()
+        self._queued = None
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        os.makedirs(input_dir, exist_ok=True)
+        self._worker = threading.Thread(target=self._run, name="reindex-worker", daemon=True)
+        self._worker.start()
+        self._watcher = None
+        if watch_interval:
+            self._watcher = threading.Thread(target=self._watch, name="reindex-watcher", daemon=True)
+            self._watcher.start()
+
+    def submit(self, reason: str = "manual") -> Dict[str, Any]:
+        """Queue a re-index job (or join the one already queued) and return its status."""
+        with self._lock:
+            if self._queued is not None:
+                return dict(self.jobs[self._queued])
+            job = {"id": uuid.uuid4().hex[:12], "reason": reason, "state": "queued", "submitted_at": time.time(),
+                   "started_at": None, "finished_at": None, "files": 0, "files_indexed": 0, "chunks": 0,
+                   "chunks_indexed": 0, "chunks_skipped": 0, "stale_files_removed": 0, "elapsed_s": 0.0,
+                   "chunks_per_s": 0.0, "error": None}
+            self.jobs[job["id"]] = job
+            self._queued = job["id"]
+            finished = [job_id for job_id, other in self.jobs.items() if other["state"] in ("done", "failed", "cancelled")]
+            for job_id in finished[:max(0, len(finished) - self.history)]:
+                del self.jobs[job_id]
+        self._queue.put(job["id"])
+        logger.info(f"Queued re-index job {job['id']} of {self.input_dir} ({reason})")
+        return dict(job)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def list_jobs(self) -> List[Dict[str, Any]]:
+        """Status of the remembered jobs, newest first."""
+        with self._lock:
+            return [dict(job) for job in reversed(self.jobs.values())]
+
+    def _update(self, job_id: str, totals: Dict[str, Any]):
+        with self._lock:
+            job = self.jobs[job_id]
+            for key in ("files", "files_indexed", "chunks", "chunks_indexed", "chunks_skipped", "stale_files_removed",
+                        "elapsed_s"):
+                if key in totals:
+                    job[key] = totals[key]
+            job["chunks_per_s"] = job["chunks_indexed"] / job["elapsed_s"] if job["elapsed_s"] else 0.0
+
+    def _set_state(self, job_id: str, state: str):
+        with self._lock:
+            self.jobs[job_id]["state"] = state
+
+    def _run(self):
+        while True:
+            job_id = self._queue.get()
+            if job_id is None:
+                return
+            with self._lock:
+                self._queued = None
+                job = self.jobs[job_id]
+                job["state"] = "running"
+                job["started_at"] = time.time()
+            try:
+                # Waits while another process (e.g. a pipeline run from the command line) writes the stores
+                with utils.index_write_lock(on_wait=lambda: self._set_state(job_id, "waiting")):
+                    self._set_state(job_id, "running")
+                    # Preprocessing runs inline: forking worker processes from a threaded server is not safe,
+                    # and upload batches are small
+                    totals = run_full_pipeline(num_workers=0, input_dir=self.input_dir, embedder=self.embedder,
+                                               progress=lambda totals: self._update(job_id, totals))
+                self._update(job_id, totals)
+                state, error = "done", None
+            except Exception as e:
+                logger.error(f"Re-index job {job_id} failed: {e}")
+                state, error = "failed", str(e)
+            with self._lock:
+                job.update(state=state, error=error, finished_at=time.time())
+            logger.info(f"Re-index job {job_id} {state}: {job['files']} files, {job['chunks_indexed']} chunks indexed "
+                        f"in {job['elapsed_s']:.1f}s")
+
+    def _watch(self):
+        last = folder_signature(self.input_dir)
+        while not self._stopped.wait(self.watch_interval):
+            try:
+                signature = folder_signature(self.input_dir)
+            except OSError as e:
+                logger.error(f"Could not list {self.input_dir}: {e}")
+                continue
+            if signature != last:
+                last = signature
+                self.submit("watch")
+
+    def close(self, timeout: float = None):
+        """Stop watching and let the running job, if any, finish; queued jobs are dropped."""
+        self._stopped.set()
+        with self._lock:
+            self._queued = None
+            while True:
+                try:
+                    job_id = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                self.jobs[job_id].update(state="cancelled", finished_at=time.time())
+        self._queue.put(None)
+        self._worker.join(timeout)
+
+if __name__ == "__main__":
+    runner = ReindexRunner(watch_interval=0)
+    job = runner.submit()
+    while runner.get(job["id"])["state"] in ("queued", "waiting", "running"):
+        time.sleep(1)
+    print(runner.get(job["id"]))
+    runner.close()
@@ -0,0 +1,121 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Dict, List
+import numpy as np
+import config
+import models
+import utils
+
+logger = utils.setup_logging()
+
+def _load_cross_encoder(model_name: str, max_length: int):
+    from sentence_transformers import CrossEncoder
+    model = CrossEncoder(model_name, max_length=max_length)
+    logger.info(f"Loaded cross-encoder: {model_name}")
+    return model
+
+def _pair_key(query: str, result: Dict[str, Any]) -> tuple:
+    # The text hash makes a re-indexed chunk with new text miss instead of reusing a stale score
+    return query, result.get("id"), hashlib.sha1(result["document"].encode("utf-8")).hexdigest()
+
+class CrossEncoderReranker:
+    """Re-score retrieved candidates with a cross-encoder and keep the best.
+
+    The model is loaded once per process and scores (query, passage) pairs
+    jointly, which ranks far better than comparing separate embeddings but
+    costs a forward pass per pair; pairs are scored in batches and their
+    scores kept in an LRU of cache_size entries, so repeated queries and
+    candidates shared across queries are scored once.
+    """
+
+    def __init__(self, model_name: str = config.RERANKER_MODEL_NAME, batch_size: int = config.RERANK_BATCH_SIZE,
+                 max_length: int = config.RERANK_MAX_LENGTH, cache_size: int = config.RERANK_CACHE_MAX_ENTRIES):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        self.model = models.get_model(f"cross-encoder:{model_name}:{max_length}",
+                                      lambda: _load_cross_encoder(model_name, max_length))
+        self._scores = OrderedDict()
+        self._lock = threading.Lock()
+        # Only one forward pass at a time: torch already uses every core for one
+        self._predict_lock = threading.Lock()
+        self._latencies = deque(maxlen=1000)
+        self.counters = {"calls": 0, "pairs": 0, "pairs_scored": 0, "cache_hits": 0}
+
+    def _score(self, pairs: List[tuple], keys: List[tuple]) -> List[float]:
+        scores = [None] * len(pairs)
+        todo = {}
+        with self._lock:
+            for i, key in enumerate(keys):
+                score = self._scores.get(key)
+                if score is not None:
+                    self._scores.move_to_end(key)
+                    scores[i] = score
+                else:
+                    todo.setdefault(key, []).append(i)
+            self.counters["pairs"] += len(pairs)
+            self.counters["cache_hits"] += len(pairs) - sum(len(indices) for indices in todo.values())
+        if not todo:
+            return scores
+
+        # Each distinct uncached pair is scored once, in one predict call for the whole batch
+        with self._predict_lock:
+            fresh = self.model.predict([pairs[indices[0]] for indices in todo.values()], batch_size=self.batch_size,
+                                       show_progress_bar=False, convert_to_numpy=True)
+        fresh = np.asarray(fresh, dtype=np.float32).reshape(len(todo), -1)[:, -1]
+        with self._lock:
+            self.counters["pairs_scored"] += len(todo)
+            for (key, indices), score in zip(todo.items(), fresh):
+                self._scores[key] = float(score)
+                for i in indices:
+                    scores[i] = float(score)
+            while len(self._scores) > self.cache_size:
+                self._scores.popitem(last=False)
+        return scores
+
+    def rerank(self, query: str, results: List[Dict[str, Any]], top_k: int) -> List[Dict[str, Any]]:
+        """Top top_k of results by cross-encoder score, each with a "rerank_score"."""
+        return self.rerank_batch([query], [results], top_k)[0]
+
+    def rerank_batch(self, queries: List[str], results_batch: List[List[Dict[str, Any]]],
+                     top_k: int) -> List[List[Dict[str, Any]]]:
+        """rerank for several queries, scoring every query's candidates together."""
+        started = time.perf_counter()
+        pairs = [(query, result["document"]) for query, results in zip(queries, results_batch) for result in results]
+        keys = [_pair_key(query, result) for query, results in zip(queries, results_batch) for result in results]
+        scores = iter(self._score(pairs, keys))
+        reranked_batch = []
+        for results in results_batch:
+            scored = [{**result, "rerank_score": next(scores)} for result in results]
+            # Stable sort: ties keep the retrieval order
+            scored.sort(key=lambda result: result["rerank_score"], reverse=True)
+            reranked_batch.append(scored[:top_k])
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.counters["calls"] += 1
+            self._latencies.append(elapsed)
+        logger.info(f"Re-ranked {len(pairs)} candidates for {len(queries)} queries in {elapsed * 1000:.1f}ms")
+        return reranked_batch
+
+    def clear(self):
+        with self._lock:
+            self._scores.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Call and pair counts, score cache hit rate and re-ranking latency percentiles (ms)."""
+        with self._lock:
+            latencies = np.array(self._latencies) * 1000
+            stats = dict(self.counters)
+            stats["cache_entries"] = len(self._scores)
+            stats["cache_hit_rate"] = stats["cache_hits"] / stats["pairs"] if stats["pairs"] else 0.0
+        stats["latency_ms"] = {f"p{p}": float(np.percentile(latencies, p)) if len(latencies) else None for p in (50, 95, 99)}
+        return stats
+
+if __name__ == "__main__":
+    reranker = CrossEncoderReranker()
+    candidates = [{"id": "a", "document": "The appeal is dismissed for want of jurisdiction."},
+                  {"id": "b", "document": "Termination of service without a show-cause notice is unlawful."}]
+    for result in reranker.rerank("Can an employee be terminated without notice?", candidates, 2):
+        print(f"{result['rerank_score']:.3f} {result['document']}")
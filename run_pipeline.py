@@ -1,8 +1,17 @@
-import os
-import pickle
+import argparse
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from typing import List, Dict, Any, Iterator, Optional, Tuple, Callable
+import numpy as np
 from data_ingestion import DataIngestion
-from preprocessing import Preprocessor
+import preprocessing
 from embedding import Embedder
+from indexing import Indexer
+from embedding_store import EmbeddingStore
+import metrics
+import models
 import utils
 import config
 import logging
@@ -10,31 +19,333 @@ import logging
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
-def run_full_pipeline():
-    # Step 1: Ingest data
-    ingestion = DataIngestion()
-    ingested_data = ingestion.run_ingestion()
-    logger.info(f"Ingested {len(ingested_data)} files")
-
-    # Step 2: Preprocess and chunk data
-    preprocessor = Preprocessor()
-    all_chunks = []
-    for metadata in ingested_data:
-        chunks = preprocessor.process_document(metadata)
-        all_chunks.extend(chunks)
-    logger.info(f"Processed into {len(all_chunks)} chunks")
-
-    # Step 3: Embed chunks
-    embedder = Embedder()
-    chunk_texts = [chunk["chunk_text"] for chunk in all_chunks]
-    embeddings = embedder.encode_chunks(chunk_texts)
-    logger.info(f"Generated embeddings for {len(embeddings)} chunks")
-
-    # Step 4: Save chunks and embeddings to .pkl file
-    output_path = os.path.join(os.getcwd(), "processed_data.pkl")
-    with open(output_path, "wb") as f:
-        pickle.dump({"chunks": all_chunks, "embeddings": embeddings}, f)
-    logger.info(f"Saved processed data to {output_path}")
+# Marks the end of a stream between stages
+_END_OF_STREAM = object()
+
+def _get_indexer() -> Indexer:
+    # Shared by the embedding and index stages; created after the worker pool has forked
+    return models.get_indexer()
+
+class _FileProgress:
+    """Count each file's outstanding chunks for one stage and report files as they complete it."""
+
+    def __init__(self, on_file_done: Callable[[str], None] = None):
+        self.on_file_done = on_file_done
+        self.remaining = {}
+        self.lock = threading.Lock()
+
+    def expect(self, file_path: str, count: int):
+        with self.lock:
+            self.remaining[file_path] = self.remaining.get(file_path, 0) + count
+        if count == 0:
+            self._completed(file_path, 0)
+
+    def completed(self, chunks: List[Dict[str, Any]]):
+        counts = {}
+        for chunk in chunks:
+            counts[chunk["file_path"]] = counts.get(chunk["file_path"], 0) + 1
+        for file_path, count in counts.items():
+            self._completed(file_path, count)
+
+    def _completed(self, file_path: str, count: int):
+        with self.lock:
+            self.remaining[file_path] -= count
+            done = self.remaining[file_path] == 0
+            if done:
+                del self.remaining[file_path]
+        if done and self.on_file_done is not None:
+            self.on_file_done(file_path)
+
+class _Stage(threading.Thread):
+    """Pipeline stage thread: handle items from a bounded queue until the end marker."""
+
+    def __init__(self, name: str, in_queue: "queue.Queue"):
+        super().__init__(name=name, daemon=True)
+        self.in_queue = in_queue
+        self.error = None
+
+    def run(self):
+        while True:
+            item = self.in_queue.get()
+            if item is _END_OF_STREAM:
+                break
+            if self.error is not None:
+                # Keep draining so the producer never blocks on a dead consumer
+                continue
+            try:
+                self.handle(item)
+            except Exception as e:
+                logger.error(f"{self.name} failed: {e}")
+                self.error = e
+        if self.error is None:
+            try:
+                self.finish()
+            except Exception as e:
+                logger.error(f"{self.name} failed: {e}")
+                self.error = e
+
+    def handle(self, item):
+        raise NotImplementedError
+
+    def finish(self):
+        pass
+
+class _EmbeddingStage(_Stage):
+    """Embed chunked documents in batches, append them to the embedding store and pass them to indexing."""
+
+    def __init__(self, chunk_queue: "queue.Queue", index_queue: "queue.Queue", store: EmbeddingStore, batch_size: int,
+                 embedded: _FileProgress, indexed: _FileProgress, embedder: Embedder = None):
+        super().__init__("embedding-stage", chunk_queue)
+        self.index_queue = index_queue
+        self.store = store
+        self.batch_size = batch_size
+        self.embedded = embedded
+        self.indexed = indexed
+        # A caller's embedder (e.g. the API's, already loaded) is used but not closed
+        self.embedder = embedder
+        self.owns_embedder = embedder is None
+        self.buffer = []
+        self.total_chunks = 0
+        self.skipped_chunks = 0
+
+    def handle(self, item: Tuple[str, List[Dict[str, Any]]]):
+        file_path, chunks = item
+        self.embedded.expect(file_path, len(chunks))
+        self.indexed.expect(file_path, len(chunks))
+        self.buffer.extend(chunks)
+        while len(self.buffer) >= self.batch_size:
+            batch, self.buffer = self.buffer[:self.batch_size], self.buffer[self.batch_size:]
+            self._embed_batch(batch)
+
+    def finish(self):
+        if self.buffer:
+            self._embed_batch(self.buffer)
+            self.buffer = []
+        if self.embedder is not None and self.owns_embedder:
+            self.embedder.close()
+
+    def _embed_batch(self, batch: List[Dict[str, Any]]):
+        # Chunks already in the index (e.g. from an interrupted run) are not re-encoded
+        existing = _get_indexer().existing_ids([utils.make_chunk_id(chunk) for chunk in batch])
+        if existing:
+            done = [chunk for chunk in batch if utils.make_chunk_id(chunk) in existing]
+            batch = [chunk for chunk in batch if utils.make_chunk_id(chunk) not in existing]
+            self.skipped_chunks += len(done)
+            self.embedded.completed(done)
+            # The index stage still adds them to the lexical index, which may have lost them in the interruption
+            self.index_queue.put((done, None))
+        if not batch:
+            return
+
+        # The model is loaded lazily so preprocessing workers are forked before it exists
+        if self.embedder is None:
+            self.embedder = Embedder()
+        start = time.perf_counter()
+        embeddings = self.embedder.encode_chunks([chunk["chunk_text"] for chunk in batch])
+        elapsed = time.perf_counter() - start
+        self.store.append(batch, embeddings)
+        self.total_chunks += len(batch)
+        logger.info(f"Embedded {len(batch)} chunks in {elapsed:.2f}s ({len(batch) / max(elapsed, 1e-9):.1f} chunks/s), "
+                    f"{self.total_chunks} so far")
+        self.embedded.completed(batch)
+        self.index_queue.put((batch, embeddings))
+
+class _IndexStage(_Stage):
+    """Upsert embedded batches into ChromaDB while the next batch is being encoded.
+
+    The lexical index buffers chunks until it flushes a segment, so chunks
+    only count towards their file being indexed once they are flushed;
+    otherwise a crash would leave files marked indexed whose BM25 entries
+    were never written. Batches without embeddings are already in the
+    vector index and are only (re-)added to the lexical index.
+    """
+
+    def __init__(self, index_queue: "queue.Queue", indexed: _FileProgress):
+        super().__init__("index-stage", index_queue)
+        self.indexed = indexed
+        self.total_chunks = 0
+        self.unflushed = []
+
+    def handle(self, item: Tuple[List[Dict[str, Any]], Optional[np.ndarray]]):
+        chunks, embeddings = item
+        indexer = _get_indexer()
+        if embeddings is None:
+            if indexer.lexical is not None:
+                indexer.lexical.add(chunks)
+        else:
+            start = time.perf_counter()
+            indexer.upsert_chunks(chunks, embeddings)
+            elapsed = time.perf_counter() - start
+            self.total_chunks += len(chunks)
+            logger.info(f"Indexed {len(chunks)} chunks in {elapsed:.2f}s ({len(chunks) / max(elapsed, 1e-9):.1f} chunks/s), "
+                        f"{self.total_chunks} so far")
+        self.unflushed.extend(chunks)
+        # Adding a full segment's worth of chunks flushes it
+        if indexer.lexical is None or not indexer.lexical.buffered():
+            self._flushed()
+
+    def finish(self):
+        _get_indexer().flush()
+        self._flushed()
+
+    def _flushed(self):
+        chunks, self.unflushed = self.unflushed, []
+        self.indexed.completed(chunks)
+
+def _iter_chunked_documents(documents: Iterator[Dict[str, Any]], num_workers: int, max_pending: int) -> Iterator[Tuple[str, List[Dict[str, Any]]]]:
+    """Preprocess documents in a process pool, keeping at most max_pending in flight.
+
+    Yields (file_path, chunks) in completion order.
+    """
+    def collect(result: Tuple[List[Dict[str, Any]], float]) -> List[Dict[str, Any]]:
+        chunks, seconds = result
+        metrics.observe("preprocess", seconds, len(chunks))
+        return chunks
+
+    if num_workers <= 0:
+        for metadata in documents:
+            yield metadata["file_path"], collect(preprocessing.process_document_in_worker(metadata))
+        return
+
+    with ProcessPoolExecutor(max_workers=num_workers, initializer=preprocessing.init_worker) as pool:
+        pending = {}
+        for metadata in documents:
+            pending[pool.submit(preprocessing.process_document_in_worker, metadata)] = metadata["file_path"]
+            if len(pending) >= max_pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield pending.pop(future), collect(future.result())
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield pending.pop(future), collect(future.result())
+
+def index_from_store(store: EmbeddingStore = None, batch_size: int = config.CHROMA_UPSERT_BATCH_SIZE):
+    """Rebuild the ChromaDB index from the embedding store without re-encoding anything."""
+    with utils.index_write_lock():
+        store = store or EmbeddingStore()
+        indexer = _get_indexer()
+        total = 0
+        started = time.perf_counter()
+        for chunks, embeddings in store.iter_batches(batch_size):
+            ids = [chunk["chunk_id"] for chunk in chunks]
+            if indexer.lexical is not None:
+                # Backfills the lexical index for chunks that were in ChromaDB before it existed
+                indexer.lexical.add(chunks)
+            existing = indexer.existing_ids(ids)
+            keep = [i for i, chunk_id in enumerate(ids) if chunk_id not in existing]
+            if keep:
+                indexer.upsert_chunks([chunks[i] for i in keep], embeddings[keep])
+                total += len(keep)
+        indexer.flush()
+        models.get_judgment_index().sync(store)
+    elapsed = time.perf_counter() - started
+    logger.info(f"Indexed {total} chunks from {store.store_dir} in {elapsed:.1f}s ({total / max(elapsed, 1e-9):.1f} chunks/s)")
+    return total
+
+def run_full_pipeline(num_workers: int = config.PIPELINE_NUM_WORKERS,
+                      max_pending: int = config.PIPELINE_MAX_PENDING_DOCS,
+                      queue_size: int = config.PIPELINE_QUEUE_SIZE,
+                      embed_batch_size: int = config.PIPELINE_EMBED_BATCH_CHUNKS,
+                      store_dir: str = config.EMBEDDING_STORE_DIR,
+                      input_dir: str = config.DATASET_FOLDER,
+                      embedder: Embedder = None,
+                      progress: Callable[[Dict[str, Any]], None] = None) -> Dict[str, Any]:
+    """Stream ingest -> preprocess (process pool) -> batch embed -> upsert into ChromaDB.
+
+    Each stage is connected by a bounded buffer, so a slow embedder or index
+    blocks the earlier stages instead of letting chunks pile up in memory.
+    Per-file stage completion is recorded in the manifest, so an interrupted
+    run resumes with the files it had not finished, and a run over a folder
+    whose files are all indexed only stats them.
+
+    progress, if given, is called with the running totals whenever a file is
+    chunked or fully indexed; the final totals are returned.
+    """
+    before = metrics.stage_totals()
+    with utils.index_write_lock(), metrics.profile("pipeline"):
+        ingestion = DataIngestion(input_dir=input_dir, required_stage="indexed")
+        store = EmbeddingStore(store_dir)
+        started = time.perf_counter()
+        totals = {"files": 0, "chunks": 0, "files_indexed": 0, "chunks_embedded": 0, "chunks_indexed": 0,
+                  "chunks_skipped": 0, "stale_files_removed": 0, "elapsed_s": 0.0}
+        totals_lock = threading.Lock()
+
+        def report():
+            if progress is not None:
+                with totals_lock:
+                    totals.update(chunks_embedded=embedding_stage.total_chunks, chunks_indexed=index_stage.total_chunks,
+                                  chunks_skipped=embedding_stage.skipped_chunks, elapsed_s=time.perf_counter() - started)
+                    progress(dict(totals))
+
+        def file_indexed(file_path: str):
+            ingestion.mark_stage(file_path, "indexed")
+            with totals_lock:
+                totals["files_indexed"] += 1
+            report()
+
+        embedded = _FileProgress(lambda file_path: ingestion.mark_stage(file_path, "embedded"))
+        indexed = _FileProgress(file_indexed)
+        chunk_queue = queue.Queue(maxsize=queue_size)
+        index_queue = queue.Queue(maxsize=config.PIPELINE_INDEX_QUEUE_SIZE)
+        embedding_stage = _EmbeddingStage(chunk_queue, index_queue, store, embed_batch_size, embedded, indexed, embedder)
+        index_stage = _IndexStage(index_queue, indexed)
+        embedding_stage.start()
+        index_stage.start()
+
+        try:
+            for file_path, chunks in _iter_chunked_documents(ingestion.iter_ingestion(), num_workers, max_pending):
+                with totals_lock:
+                    totals["files"] += 1
+                    totals["chunks"] += len(chunks)
+                ingestion.mark_stage(file_path, "chunked")
+                report()
+                chunk_queue.put((file_path, chunks))
+        finally:
+            chunk_queue.put(_END_OF_STREAM)
+            embedding_stage.join()
+            index_queue.put(_END_OF_STREAM)
+            index_stage.join()
+
+        for stage in (embedding_stage, index_stage):
+            if stage.error is not None:
+                raise stage.error
+
+        # Files that were modified or deleted since the last run leave stale chunks behind
+        stale_hashes = ingestion.get_stale_hashes()
+        if stale_hashes:
+            indexer = _get_indexer()
+            for sha256 in stale_hashes:
+                indexer.delete_file_chunks(sha256)
+                store.delete_file(sha256)
+                ingestion.manifest.clear_stale_hash(sha256)
+            logger.info(f"Removed stale chunks of {len(stale_hashes)} modified or deleted files")
+        # Judgment vectors (two-stage retrieval) follow the chunks now in the store
+        models.get_judgment_index().sync(store)
+
+        elapsed = time.perf_counter() - started
+        totals.update(chunks_embedded=embedding_stage.total_chunks, chunks_indexed=index_stage.total_chunks,
+                      chunks_skipped=embedding_stage.skipped_chunks, stale_files_removed=len(stale_hashes), elapsed_s=elapsed)
+        logger.info(f"Ingested {totals['files']} files")
+        logger.info(f"Processed into {totals['chunks']} chunks ({embedding_stage.skipped_chunks} already indexed)")
+        logger.info(f"Generated embeddings for {embedding_stage.total_chunks} chunks")
+        logger.info(f"Indexed {index_stage.total_chunks} chunks in {elapsed:.1f}s "
+                    f"({index_stage.total_chunks / max(elapsed, 1e-9):.1f} chunks/s overall)")
+        logger.info(f"Saved embeddings to {store.store_dir}")
+    # Every stage recorded in the process while this ran, including queries served alongside a re-index
+    logger.info(f"Per-stage summary:\n{metrics.summary_table(before, totals['elapsed_s'])}")
+    return totals
 
 if __name__ == "__main__":
-    run_full_pipeline()
+    parser = argparse.ArgumentParser(description="Ingest, chunk, embed and index the judgment corpus.")
+    parser.add_argument("--from-store", action="store_true", help="Only (re)index chunks already in the embedding store (also backfills the BM25 index)")
+    parser.add_argument("--workers", type=int, default=config.PIPELINE_NUM_WORKERS, help="Preprocessing processes (0 = inline)")
+    parser.add_argument("--profile", choices=["cprofile", "sampling"], default=config.PROFILER,
+                        help="Profile the run; the report is written under config.PROFILE_DIR")
+    args = parser.parse_args()
+    config.PROFILER = args.profile
+    if args.from_store:
+        with metrics.profile("index_from_store"):
+            index_from_store()
+    else:
+        run_full_pipeline(num_workers=args.workers)
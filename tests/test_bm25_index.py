@@ -0,0 +1,57 @@
+import pytest
+from bm25_index import BM25Index
+
+TOPICS = ["bail petition arrest", "service tribunal dismissal", "eviction tenant rent", "customs duty assessment"]
+
+def make_chunk(i: int, sha256: str) -> dict:
+    text = f"{TOPICS[i % len(TOPICS)]} paragraph{i} " * (i % 3 + 1)
+    return {"chunk_id": f"{sha256}_FACTS_{i}", "sha256": sha256, "chunk_text": text, "section": "FACTS", "chunk_index": i}
+
+def assert_same_scores(index: BM25Index, reference: BM25Index):
+    for query in TOPICS + ["paragraph5 bail", "tenant paragraph14 duty"]:
+        got = dict(index.search(query, top_k=20))
+        expected = dict(reference.search(query, top_k=20))
+        assert got.keys() == expected.keys()
+        for chunk_id, score in expected.items():
+            assert got[chunk_id] == pytest.approx(score, rel=1e-5)
+
+def test_merge_drops_deleted_chunks_from_statistics(tmp_path):
+    index = BM25Index(str(tmp_path / "index"), segment_max_docs=4)
+    index.add([make_chunk(i, "a" if i < 4 else "b") for i in range(8)])
+    index.delete_file("a")
+    # Fills two more segments; the merges rewrite the segment holding the deleted chunks
+    index.add([make_chunk(i, "c") for i in range(8, 16)])
+    index.flush()
+    live = [make_chunk(i, "b") for i in range(4, 8)] + [make_chunk(i, "c") for i in range(8, 16)]
+    reference = BM25Index(str(tmp_path / "reference"), segment_max_docs=100)
+    reference.add(live)
+    reference.flush()
+
+    index._refresh(force=True)
+    assert len(index) == 12
+    assert index._num_docs == 12
+    assert index._avg_length == pytest.approx(reference._avg_length)
+    assert index.conn.execute("SELECT SUM(num_docs), SUM(total_length) FROM segments").fetchone() == \
+        reference.conn.execute("SELECT SUM(num_docs), SUM(total_length) FROM segments").fetchone()
+    assert_same_scores(index, reference)
+    # Later segments are numbered after the merged one's full range
+    index.add([make_chunk(16, "d")])
+    index.flush()
+    assert len(index) == 13
+    assert index.search("paragraph16")[0][0] == "d_FACTS_16"
+
+def test_masked_chunks_do_not_count_before_merge(tmp_path):
+    index = BM25Index(str(tmp_path / "index"), segment_max_docs=100)
+    index.add([make_chunk(i, "a" if i < 4 else "b") for i in range(10)])
+    index.flush()
+    index.delete_file("a")
+    reference = BM25Index(str(tmp_path / "reference"), segment_max_docs=100)
+    reference.add([make_chunk(i, "b") for i in range(4, 10)])
+    reference.flush()
+
+    # Masked chunks' postings still count towards document frequencies until their segment is merged
+    index._refresh(force=True)
+    assert index._num_docs == 6
+    assert index._avg_length == pytest.approx(reference._avg_length)
+    assert [chunk_id for chunk_id, _ in index.search("bail petition", top_k=20)] == \
+        [chunk_id for chunk_id, _ in reference.search("bail petition", top_k=20)]
@@ -2,10 +2,20 @@ import logging
 import os
 import hashlib
 import re
+import threading
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from contextlib import contextmanager
+from itertools import accumulate
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple, Callable
 import config
 
+try:
+    import fcntl
+except ImportError:  # Windows: writers are only serialized within the process
+    fcntl = None
+
 # Setup logging
 logging.basicConfig(level=getattr(logging, config.LOGGING_LEVEL), format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -14,33 +24,134 @@ def setup_logging():
     """Setup logging configuration."""
     return logger
 
+# Read buffer for hashing files; large reads keep hashing I/O-bound
+HASH_BUFFER_SIZE = 1024 * 1024
+
 def get_file_sha256(file_path: str) -> str:
     """Compute SHA256 hash of a file for idempotence."""
     hash_sha256 = hashlib.sha256()
-    with open(file_path, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            hash_sha256.update(chunk)
+    buffer = bytearray(HASH_BUFFER_SIZE)
+    view = memoryview(buffer)
+    with open(file_path, "rb", buffering=0) as f:
+        while True:
+            n = f.readinto(buffer)
+            if not n:
+                break
+            hash_sha256.update(view[:n])
     return hash_sha256.hexdigest()
 
 def list_txt_files(directory: str) -> List[str]:
     """List all .txt files in the directory recursively."""
     return [str(f) for f in Path(directory).rglob("*.txt")]
 
+# flock locks belong to an open file, so threads of one process are serialized by
+# _write_lock and only the outermost holder opens and locks the file
+_write_lock = threading.RLock()
+_write_lock_file = None
+_write_lock_depth = 0
+
+@contextmanager
+def index_write_lock(path: str = config.INDEX_WRITE_LOCK_PATH, blocking: bool = True,
+                     on_wait: Callable[[], None] = None):
+    """Hold the exclusive lock of the index stores' writers (reentrant within a thread).
+
+    Without blocking, RuntimeError is raised if another thread or process holds
+    it; otherwise on_wait, if given, is called before waiting for it.
+    """
+    global _write_lock_file, _write_lock_depth
+    if not _write_lock.acquire(blocking=False):
+        if not blocking:
+            raise RuntimeError("Another writer is updating the index")
+        if on_wait is not None:
+            on_wait()
+        _write_lock.acquire()
+    try:
+        if _write_lock_depth == 0:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            lock_file = open(path, "a")
+            try:
+                if fcntl is not None:
+                    try:
+                        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        if not blocking:
+                            raise RuntimeError(f"Another process is updating the index ({path} is locked)")
+                        logger.info(f"Waiting for another process to finish updating the index ({path})")
+                        if on_wait is not None:
+                            on_wait()
+                        fcntl.flock(lock_file, fcntl.LOCK_EX)
+            except BaseException:
+                lock_file.close()
+                raise
+            _write_lock_file = lock_file
+        _write_lock_depth += 1
+        try:
+            yield
+        finally:
+            _write_lock_depth -= 1
+            if _write_lock_depth == 0:
+                # Closing the file releases the flock
+                _write_lock_file.close()
+                _write_lock_file = None
+    finally:
+        _write_lock.release()
+
+# Runs of 3+ newlines; the literal prefix lets the regex engine skip ahead quickly
+_BLANK_LINES_RE = re.compile(r'\n\n\n+')
+
 def normalize_text(text: str) -> str:
     """Normalize text: fix encoding, remove excessive whitespace."""
-    # Replace weird control characters
+    # Each step is a C-level scan; this is several times faster than per-character regexes
     text = text.replace('\r\n', '\n')
-    text = re.sub(r'\n{3,}', '\n\n', text)
+    text = _BLANK_LINES_RE.sub('\n\n', text)
     text = text.replace('\x0c', '')  # form feeds
-    text = re.sub(r'\x00+', '', text)  # null bytes
+    text = text.replace('\x00', '')  # null bytes
     return text.strip()
 
+# Patterns like "Constitution Petitions Nos. 11 -15, 18 -22"
+CASE_NUMBER_RE = re.compile(r'(?:Constitution Petitions?|W\.P\.|C\.A\.)\s*(?:Nos?\.?|No\.?)\s*([\d\s\-,\.]+)', re.I)
+PRESENT_BLOCK_RE = re.compile(r'PRESENT\s*:\s*(.*?)\n\n', re.S | re.I)
+# One name per line: a name must not run into the next "MR. JUSTICE"
+JUDGE_RE = re.compile(r'MR\. JUSTICE ([A-Z \t\-]+)', re.I)
+HEARING_DATES_RE = re.compile(r'Dates of hearing:\s*(.*?)\.', re.I)
+
+# Case types and their canonical prefix
+CASE_KINDS = (("constitution petition", "C.P."), ("w.p", "W.P."), ("c.a", "C.A."))
+# A case number as a user types it: "C.A. No. 123", "c.a.123", "CP 7" or a bare "123"
+_CASE_REFERENCE_RE = re.compile(r'^\s*(constitution petitions?|c\.?\s*p\.?|w\.?\s*p\.?|c\.?\s*a\.?)?\s*(?:nos?\.?)?\s*(\d+)\s*$', re.I)
+_CASE_RANGE_RE = re.compile(r'(\d+)(?:\s*-\s*(\d+))?')
+# Longest "Nos. 11-15" range expanded into individual case numbers
+MAX_CASE_RANGE = 100
+
+def _case_kind(prefix: str) -> str:
+    prefix = prefix.lower()
+    return next((kind for name, kind in CASE_KINDS if name in prefix), "")
+
 def extract_case_numbers(text: str) -> List[str]:
-    """Extract case numbers from text using regex."""
-    # Patterns like "Constitution Petitions Nos. 11 -15, 18 -22"
-    pattern = r'(?:Constitution Petitions?|W\.P\.|C\.A\.)\s*(?:Nos?\.?|No\.?)\s*([\d\s\-,\.]+)'
-    matches = re.findall(pattern, text, re.I)
-    return [match.strip() for match in matches if match.strip()]
+    """Canonical case numbers cited in text: "Constitution Petitions Nos. 11 -13" -> ["C.P. 11", "C.P. 12", "C.P. 13"]."""
+    case_numbers = []
+    for match in CASE_NUMBER_RE.finditer(text):
+        kind = _case_kind(match.group(0)[:match.start(1) - match.start(0)])
+        for first, last in _CASE_RANGE_RE.findall(match.group(1)):
+            first = int(first)
+            last = int(last) if last and 0 <= int(last) - first <= MAX_CASE_RANGE else first
+            for number in range(first, last + 1):
+                case_number = f"{kind} {number}"
+                if case_number not in case_numbers:
+                    case_numbers.append(case_number)
+    return case_numbers
+
+def canonical_case_numbers(reference: str) -> List[str]:
+    """Canonical forms a user's case number may refer to: one with its type given, one per type for a bare number."""
+    m = _CASE_REFERENCE_RE.match(reference)
+    if not m:
+        raise ValueError(f"Not a case number: {reference!r}")
+    number = int(m.group(2))
+    if m.group(1):
+        prefix = re.sub(r'[\s.]', '', m.group(1).lower())
+        kind = "C.P." if prefix.startswith("constitution") or prefix == "cp" else "W.P." if prefix == "wp" else "C.A."
+        return [f"{kind} {number}"]
+    return [f"{kind} {number}" for _, kind in CASE_KINDS]
 
 def extract_title(text: str) -> str:
     """Extract case title from text."""
@@ -51,83 +162,142 @@ def extract_title(text: str) -> str:
             return line.strip()
     return ""
 
+def normalize_judge(name: str) -> str:
+    """Canonical judge name: uppercase, single-spaced."""
+    return " ".join(name.split()).upper()
+
 def extract_judges(text: str) -> List[str]:
     """Extract judges from text."""
     # Look for PRESENT block
-    m = re.search(r'PRESENT\s*:\s*(.*?)\n\n', text, re.S | re.I)
+    m = PRESENT_BLOCK_RE.search(text)
     if m:
         block = m.group(1)
-        judges = re.findall(r'MR\. JUSTICE ([A-Z\s\-]+)', block, re.I)
-        return [judge.strip() for judge in judges]
+        judges = JUDGE_RE.findall(block)
+        return [normalize_judge(judge) for judge in judges if judge.strip()]
     return []
 
 def extract_dates(text: str) -> str:
     """Extract hearing dates from text."""
     # Pattern: Dates of hearing: 24-31/5, ... 2010.
-    m = re.search(r'Dates of hearing:\s*(.*?)\.', text, re.I)
+    m = HEARING_DATES_RE.search(text)
     if m:
         return m.group(1).strip()
     return ""
 
-def detect_sections(text: str) -> List[Dict[str, str]]:
-    """Detect sections in the text."""
-    # Common section headers
-    section_patterns = [
-        r'ORDER',
-        r'JUDGMENT',
-        r'OPINION',
-        r'ARGUMENTS',
-        r'FACTS',
-        r'ISSUES',
-        r'REASONING',
-        r'CONCLUSION',
-        r'HELD'
-    ]
+_YEAR_RE = re.compile(r'\b(1[89]\d\d|20\d\d)\b')
+# "C.A. No. 123 of 2019"
+CASE_YEAR_RE = re.compile(r'(?:Constitution Petitions?|W\.P\.|C\.A\.)\s*(?:Nos?\.?)\s*[\d\s\-,\.]+of\s+(\d{4})', re.I)
+
+def extract_year(text: str, hearing_dates: str = "") -> Optional[int]:
+    """Year of the judgment: the last year in its hearing dates, else the year of the first case it cites."""
+    years = _YEAR_RE.findall(hearing_dates)
+    if years:
+        return int(years[-1])
+    m = CASE_YEAR_RE.search(text)
+    return int(m.group(1)) if m else None
+
+# Common section headers, matched at the start of a line
+SECTION_HEADER_RE = re.compile(r'\s*(?:ORDER|JUDGMENT|OPINION|ARGUMENTS|FACTS|ISSUES|REASONING|CONCLUSION|HELD)', re.I)
+
+def _find_repeated_lines(lines: List[str]) -> set:
+    """Lines that look like running headers/footers (more than 5 occurrences)."""
+    return {line for line, count in Counter(lines).items() if count > 5 and len(line.strip()) > 10}
+
+def _assemble_sections(lines: List[str], drop: set, keep_empty: bool = False) -> Tuple[str, List[Dict[str, Any]]]:
+    """Join lines (minus drop) and record section body spans in one pass.
+
+    Sections whose body is only whitespace are left out unless keep_empty.
+    """
+    kept = []
     sections = []
-    lines = text.split('\n')
     current_section = "INTRODUCTION"
-    current_text = ""
+    body_start = 0
+    pos = 0
     for line in lines:
-        line_upper = line.upper().strip()
-        if any(re.match(pattern, line_upper) for pattern in section_patterns):
-            if current_text:
-                sections.append({"section": current_section, "text": current_text.strip()})
-            current_section = line_upper
-            current_text = ""
-        else:
-            current_text += line + '\n'
-    if current_text:
-        sections.append({"section": current_section, "text": current_text.strip()})
-    return sections
+        if line in drop:
+            continue
+        if SECTION_HEADER_RE.match(line):
+            if pos > body_start:
+                sections.append((current_section, body_start, pos))
+            current_section = line.strip().upper()
+            body_start = pos + len(line) + 1
+        kept.append(line)
+        pos += len(line) + 1
+    if pos > body_start:
+        sections.append((current_section, body_start, pos))
+
+    text = '\n'.join(kept)
+    spans = []
+    for section, start, end in sections:
+        # Trim surrounding whitespace without copying the body
+        end = min(end, len(text))
+        while start < end and text[start].isspace():
+            start += 1
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        if end > start or keep_empty:
+            spans.append({"section": section, "start_char": start, "end_char": end})
+    return text, spans
+
+def section_spans(text: str) -> List[Dict[str, Any]]:
+    """Detect sections and return their bodies as offsets into text."""
+    return _assemble_sections(text.split('\n'), set())[1]
+
+def clean_document(text: str) -> Tuple[str, List[Dict[str, Any]]]:
+    """Normalize, strip repeated headers/footers and detect sections.
+
+    Returns the cleaned text and its section spans ({"section", "start_char",
+    "end_char"} offsets into the cleaned text).
+    """
+    lines = normalize_text(text).split('\n')
+    return _assemble_sections(lines, _find_repeated_lines(lines))
+
+def detect_sections(text: str) -> List[Dict[str, str]]:
+    """Detect sections in the text; a section whose body is only blank lines has text ""."""
+    return [{"section": span["section"], "text": text[span["start_char"]:span["end_char"]]}
+            for span in _assemble_sections(text.split('\n'), set(), keep_empty=True)[1]]
 
 def strip_repeated_headers_footers(text: str) -> str:
     """Remove repeated headers and footers."""
     lines = text.split('\n')
-    # Identify repeated lines (simple heuristic: lines that appear more than 5 times)
-    from collections import Counter
-    line_counts = Counter(lines)
-    repeated = {line for line, count in line_counts.items() if count > 5 and len(line.strip()) > 10}
-    # Remove repeated lines
-    cleaned_lines = [line for line in lines if line not in repeated]
-    return '\n'.join(cleaned_lines)
+    repeated = _find_repeated_lines(lines)
+    return '\n'.join(line for line in lines if line not in repeated)
 
 def sentence_tokenize(text: str) -> List[str]:
     """Tokenize text into sentences using spaCy or nltk."""
+    return sentence_tokenize_batch([text])[0]
+
+def sentence_tokenize_batch(texts: List[str]) -> List[List[str]]:
+    """Tokenize several texts into sentences with one batched spaCy pass."""
+    return [[text[start:end] for start, end in spans] for text, spans in zip(texts, sentence_spans_batch(texts))]
+
+def sentence_spans_batch(texts: List[str]) -> List[List[Tuple[int, int]]]:
+    """Return (start_char, end_char) of every sentence in each text."""
+    import models
     try:
-        import spacy
-        nlp = spacy.load("en_core_web_sm")
-        doc = nlp(text)
-        return [sent.text for sent in doc.sents]
+        nlp = models.get_sentence_splitter()
     except ImportError:
-        import nltk
-        nltk.download('punkt')
-        from nltk.tokenize import sent_tokenize
-        return sent_tokenize(text)
+        sent_tokenize = models.get_nltk_sentence_tokenizer()
+        return [_locate_sentences(text, sent_tokenize(text)) for text in texts]
+    return [[(sent.start_char, sent.end_char) for sent in doc.sents]
+            for doc in nlp.pipe(texts, batch_size=config.SPACY_BATCH_SIZE)]
+
+def _locate_sentences(text: str, sentences: List[str]) -> List[Tuple[int, int]]:
+    """Recover sentence offsets by scanning forward through text."""
+    spans = []
+    cursor = 0
+    for sent in sentences:
+        start = text.find(sent, cursor)
+        if start < 0:
+            continue
+        cursor = start + len(sent)
+        spans.append((start, cursor))
+    return spans
 
 def chunk_sentences(sentences: List[str], target_tokens: int = 800, overlap_tokens: int = 200) -> List[str]:
     """Chunk sentences into text chunks based on token count."""
-    from transformers import AutoTokenizer
-    tokenizer = AutoTokenizer.from_pretrained("bert-base-uncased")  # Simple tokenizer
+    import models
+    tokenizer = models.get_chunk_tokenizer()
     chunks = []
     current_chunk = ""
     current_tokens = 0
@@ -153,13 +323,56 @@ def chunk_sentences(sentences: List[str], target_tokens: int = 800, overlap_toke
         chunks.append(current_chunk.strip())
     return chunks
 
-def build_manifest_entry(file_path: str) -> Dict[str, Any]:
+def chunk_sentence_spans(text: str, spans: List[Tuple[int, int]], target_tokens: int = 800,
+                         overlap_tokens: int = 200, tokenizer=None) -> List[Dict[str, Any]]:
+    """Chunk text along sentence spans, tokenizing each sentence exactly once.
+
+    Chunks are exact slices of text with their start_char/end_char. Consecutive
+    chunks share trailing sentences totalling at most overlap_tokens.
+    """
+    spans = [(start, end) for start, end in spans if text[start:end].strip()]
+    if not spans:
+        return []
+    if tokenizer is None:
+        import models
+        tokenizer = models.get_chunk_tokenizer()
+    encoded = tokenizer([text[start:end] for start, end in spans], add_special_tokens=False)["input_ids"]
+    # prefix[k] is the token count of sentences [0, k)
+    prefix = [0, *accumulate(len(ids) for ids in encoded)]
+    num_sentences = len(spans)
+
+    chunks = []
+    first = 0
+    while first < num_sentences:
+        # Longest run of sentences from `first` that fits the budget (at least one sentence)
+        last = max(first + 1, bisect_right(prefix, prefix[first] + target_tokens) - 1)
+        start_char, end_char = spans[first][0], spans[last - 1][1]
+        chunks.append({"chunk_text": text[start_char:end_char], "start_char": start_char, "end_char": end_char})
+        if last >= num_sentences:
+            break
+        # Next chunk starts at the earliest sentence keeping the overlap within budget
+        first = bisect_left(prefix, prefix[last] - overlap_tokens, first + 1, last)
+    return chunks
+
+def make_chunk_id(chunk: Dict[str, Any]) -> str:
+    """Stable index ID of a chunk: file content hash, section and position."""
+    return f"{chunk['sha256']}_{chunk['section']}_{chunk['chunk_index']}"
+
+def build_manifest_entry(file_path: str, stat: os.stat_result = None, sha256: str = None) -> Dict[str, Any]:
     """Build manifest entry for a file."""
-    stat = os.stat(file_path)
+    if stat is None:
+        stat = os.stat(file_path)
     return {
         "file_path": file_path,
         "file_name": os.path.basename(file_path),
         "file_size": stat.st_size,
         "last_modified": stat.st_mtime,
-        "sha256": get_file_sha256(file_path)
+        "inode": stat.st_ino,
+        "sha256": sha256 if sha256 is not None else get_file_sha256(file_path)
     }
+
+def manifest_entry_matches_stat(entry: Dict[str, Any], stat: os.stat_result) -> bool:
+    """True if a manifest entry still describes the file with this stat()."""
+    return (entry.get("file_size") == stat.st_size
+            and entry.get("last_modified") == stat.st_mtime
+            and entry.get("inode") == stat.st_ino)
@@ -0,0 +1,433 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+import config
+import utils
+from embedding_store import EmbeddingStore
+
+logger = utils.setup_logging()
+
+# Metadata fields (as written by indexing.chunk_metadata) that where filters can use, and their store columns
+FILTER_FIELDS = {"year": "year", "section": "section", "case_name": "case_name", "file_name": "file_name",
+                 "sha256_file": "sha256", "judges": "judges", "case_numbers": "case_numbers"}
+_LIST_FIELDS = ("judges", "case_numbers")
+
+# Names accepted for NumpyVectorIndex mode and dtype
+MODES = ("exact", "ivf")
+DTYPES = ("float32", "int8")
+_INT8_SLICE_ROWS = 1024
+
+def nearest_centroids(vectors: np.ndarray, centroids: np.ndarray, block_rows: int = 65536) -> np.ndarray:
+    """Index of the nearest centroid (L2) of each row, computed in blocks."""
+    # argmin |x - c|^2 = argmax (x.c - |c|^2 / 2)
+    half_norms = 0.5 * (centroids * centroids).sum(axis=1)
+    assignments = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), block_rows):
+        block = np.asarray(vectors[start:start + block_rows], dtype=np.float32)
+        assignments[start:start + len(block)] = np.argmax(block @ centroids.T - half_norms, axis=1)
+    return assignments
+
+def kmeans(vectors: np.ndarray, num_clusters: int, iterations: int = 10, seed: int = 0) -> np.ndarray:
+    """Lloyd's k-means over float32 rows; returns (num_clusters, dim) centroids."""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), num_clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = nearest_centroids(vectors, centroids)
+        counts = np.bincount(assignments, minlength=num_clusters)
+        # Per-cluster sums in one pass over the rows sorted by cluster
+        order = np.argsort(assignments, kind="stable")
+        nonempty = np.flatnonzero(counts)
+        starts = (np.cumsum(counts) - counts)[nonempty]
+        centroids[nonempty] = np.add.reduceat(vectors[order], starts, axis=0) / counts[nonempty, None]
+        # Empty clusters restart from random rows
+        empty = np.flatnonzero(counts == 0)
+        centroids[empty] = vectors[rng.choice(len(vectors), len(empty), replace=False)]
+    return centroids
+
+def _grow(array: np.ndarray, rows: int) -> np.ndarray:
+    # Capacity grows geometrically so appending a few rows does not copy the whole array
+    if rows <= len(array):
+        return array
+    grown = np.zeros((max(rows, len(array) * 3 // 2),) + array.shape[1:], dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+def _top(distances: np.ndarray, rows: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    # The k smallest distances of each column (unordered) with their rows; rows is per row or, like distances, per entry
+    if rows.ndim == 1:
+        rows = np.repeat(rows[:, None], distances.shape[1], axis=1)
+    if len(distances) > k:
+        part = np.argpartition(distances, k - 1, axis=0)[:k]
+        return np.take_along_axis(rows, part, axis=0), np.take_along_axis(distances, part, axis=0)
+    return rows, distances
+
+class NumpyVectorIndex:
+    """In-process vector search over the embedding store's memory-mapped matrix.
+
+    "exact" mode scans every row in blocks, one matrix multiply per block
+    for the whole query batch; "ivf" mode scores only the rows of the
+    k-means partitions nearest the query. With dtype "int8" the scan runs
+    over a quantized in-memory copy (a quarter of the memory) and the best
+    rescore x k candidates are re-scored exactly. Distances are squared L2,
+    as ChromaDB reports them.
+
+    Where filters are evaluated against per-value row bitmaps built from
+    the store's metadata. The matrix, metadata and deletions written by
+    other processes (e.g. the pipeline) are picked up on the next search,
+    and IVF centroids are trained by flush() and shared through the store
+    directory.
+    """
+
+    def __init__(self, store: EmbeddingStore = None, mode: str = config.NUMPY_INDEX_MODE,
+                 dtype: str = config.NUMPY_INDEX_DTYPE, block_rows: int = config.NUMPY_INDEX_BLOCK_ROWS,
+                 num_lists: int = config.NUMPY_IVF_LISTS, num_probes: int = config.NUMPY_IVF_PROBES,
+                 min_ivf_rows: int = config.NUMPY_IVF_MIN_ROWS, rescore: int = config.NUMPY_INT8_RESCORE,
+                 filter_exact_rows: int = config.NUMPY_FILTER_EXACT_ROWS,
+                 bitmap_cache_size: int = config.NUMPY_BITMAP_CACHE_SIZE):
+        if mode not in MODES:
+            raise ValueError(f"Unknown vector index mode {mode!r}; expected one of {', '.join(MODES)}")
+        if dtype not in DTYPES:
+            raise ValueError(f"Unknown vector index dtype {dtype!r}; expected one of {', '.join(DTYPES)}")
+        # Opened without crash recovery: truncating the matrix here could cut off a running pipeline's writes
+        self.store = store if store is not None else EmbeddingStore(recover=False)
+        self.mode = mode
+        self.dtype = dtype
+        self.block_rows = block_rows
+        self.num_lists = num_lists
+        self.num_probes = num_probes
+        self.min_ivf_rows = min_ivf_rows
+        self.rescore = rescore
+        self.filter_exact_rows = filter_exact_rows
+        self.bitmap_cache_size = bitmap_cache_size
+        self.ivf_path = os.path.join(self.store.store_dir, "ivf.npz")
+        self._lock = threading.RLock()
+
+        self._rows = 0
+        self._matrix = None
+        self._norms = np.zeros(0, dtype=np.float32)
+        self._codes = np.zeros((0, 0), dtype=np.int8)
+        self._scales = np.zeros(0, dtype=np.float32)
+        self._deleted = np.zeros(0, dtype=bool)
+        self._num_deleted = 0
+        # field -> value -> rows with that value, and a cache of (field, value) -> row bitmap
+        self._postings = {field: {} for field in FILTER_FIELDS}
+        self._bitmaps = OrderedDict()
+        self._centroids = None
+        self._assignments = np.zeros(0, dtype=np.int32)
+        self._trained_rows = 0
+        self._list_offsets = None
+        self._list_rows = None
+        self._version = None
+        self._ivf_mtime = None
+        self._refresh()
+
+    # Loading
+
+    def _refresh(self, force: bool = False):
+        # data_version changes when another connection (e.g. the pipeline's) commits
+        version = self.store.conn.execute("PRAGMA data_version").fetchone()[0]
+        ivf_mtime = os.stat(self.ivf_path).st_mtime_ns if self.mode == "ivf" and os.path.exists(self.ivf_path) else None
+        if version == self._version and ivf_mtime == self._ivf_mtime and not force:
+            return
+        rows = len(self.store)
+        if rows > self._rows:
+            self._extend(rows)
+        self._deleted = np.zeros(rows, dtype=bool)
+        self._deleted[self.store.deleted_rows()] = True
+        self._num_deleted = int(self._deleted.sum())
+        self._bitmaps.clear()
+        if ivf_mtime != self._ivf_mtime:
+            self._load_ivf()
+        self._assign_tail()
+        self._version = version
+        self._ivf_mtime = ivf_mtime
+
+    def _extend(self, rows: int):
+        """Load rows self._rows..rows-1: norms, int8 codes and filter postings."""
+        start = self._rows
+        self._matrix = self.store.vectors()
+        self._norms = _grow(self._norms, rows)
+        if self.dtype == "int8":
+            self._codes = _grow(self._codes if self._codes.shape[1] else np.zeros((0, self.store.dim), dtype=np.int8), rows)
+            self._scales = _grow(self._scales, rows)
+        for block_start in range(start, rows, self.block_rows):
+            block_end = min(block_start + self.block_rows, rows)
+            block = np.asarray(self._matrix[block_start:block_end], dtype=np.float32)
+            self._norms[block_start:block_end] = (block * block).sum(axis=1)
+            if self.dtype == "int8":
+                # Symmetric per-row scale: the largest component maps to 127
+                scales = np.maximum(np.abs(block).max(axis=1), 1e-12) / 127
+                self._codes[block_start:block_end] = np.round(block / scales[:, None]).astype(np.int8)
+                self._scales[block_start:block_end] = scales
+
+        added = {field: {} for field in FILTER_FIELDS}
+        for row, values in self.store.iter_columns(list(FILTER_FIELDS.values()), start):
+            for field, column in FILTER_FIELDS.items():
+                value = values[column]
+                if field in _LIST_FIELDS:
+                    for item in value:
+                        added[field].setdefault(item, []).append(row)
+                elif value is not None and (field != "year" or value):
+                    added[field].setdefault(value, []).append(row)
+        for field, values in added.items():
+            postings = self._postings[field]
+            for value, new_rows in values.items():
+                new_rows = np.array(new_rows, dtype=np.int32)
+                postings[value] = np.concatenate([postings[value], new_rows]) if value in postings else new_rows
+        self._rows = rows
+        if rows - start > self.block_rows:
+            logger.info(f"Loaded {rows - start} vectors into the {self.mode}/{self.dtype} vector index ({rows} rows)")
+
+    def _load_ivf(self):
+        self._centroids = None
+        self._assignments = np.zeros(0, dtype=np.int32)
+        self._trained_rows = 0
+        # Lists built from the previous partitions are rebuilt by _assign_tail
+        self._list_rows = None
+        if self.mode != "ivf" or not os.path.exists(self.ivf_path):
+            return
+        with np.load(self.ivf_path) as data:
+            self._centroids = data["centroids"]
+            self._assignments = data["assignments"]
+        self._trained_rows = len(self._assignments)
+
+    def _assign_tail(self):
+        # Rows added since training join their nearest existing partition
+        if self._centroids is None:
+            return
+        if len(self._assignments) > self._rows:
+            # Another process trained on rows added after this one last read the row count
+            self._assignments = self._assignments[:self._rows]
+            self._list_rows = None
+        if len(self._assignments) < self._rows:
+            tail = nearest_centroids(self._matrix[len(self._assignments):self._rows], self._centroids, self.block_rows)
+            self._assignments = np.concatenate([self._assignments, tail])
+        elif self._list_rows is not None and len(self._list_rows) == self._rows:
+            return
+        counts = np.bincount(self._assignments, minlength=len(self._centroids))
+        self._list_offsets = np.concatenate([[0], np.cumsum(counts)])
+        self._list_rows = np.argsort(self._assignments, kind="stable").astype(np.int32)
+
+    def __len__(self) -> int:
+        """Searchable (not deleted) rows."""
+        with self._lock:
+            self._refresh()
+            return self._rows - self._num_deleted
+
+    # Filters
+
+    def _bitmap(self, field: str, value: Any) -> np.ndarray:
+        key = (field, value)
+        bitmap = self._bitmaps.get(key)
+        if bitmap is None:
+            bitmap = np.zeros(self._rows, dtype=bool)
+            rows = self._postings[field].get(value)
+            if rows is not None:
+                bitmap[rows] = True
+            self._bitmaps[key] = bitmap
+            while len(self._bitmaps) > self.bitmap_cache_size:
+                self._bitmaps.popitem(last=False)
+        else:
+            self._bitmaps.move_to_end(key)
+        return bitmap
+
+    def _any_of(self, field: str, values) -> np.ndarray:
+        bitmap = np.zeros(self._rows, dtype=bool)
+        for value in values:
+            bitmap |= self._bitmap(field, value)
+        return bitmap
+
+    def _evaluate(self, where: Dict[str, Any]) -> np.ndarray:
+        """Bitmap of the rows matching a ChromaDB-style where clause."""
+        clauses = []
+        for key, condition in where.items():
+            if key in ("$and", "$or"):
+                bitmaps = [self._evaluate(clause) for clause in condition]
+                combined = bitmaps[0].copy()
+                for bitmap in bitmaps[1:]:
+                    combined = combined & bitmap if key == "$and" else combined | bitmap
+                clauses.append(combined)
+                continue
+            if key not in FILTER_FIELDS:
+                raise ValueError(f"Field {key!r} cannot be filtered by the numpy vector index")
+            if not isinstance(condition, dict):
+                condition = {"$eq": condition}
+            for operator, value in condition.items():
+                if operator in ("$eq", "$contains"):
+                    clauses.append(self._bitmap(key, value))
+                elif operator == "$in":
+                    clauses.append(self._any_of(key, value))
+                elif operator in ("$gt", "$gte", "$lt", "$lte"):
+                    compare = {"$gt": np.greater, "$gte": np.greater_equal, "$lt": np.less, "$lte": np.less_equal}[operator]
+                    clauses.append(self._any_of(key, [item for item in self._postings[key] if compare(item, value)]))
+                else:
+                    raise ValueError(f"Unsupported where operator {operator!r}")
+        bitmap = clauses[0].copy()
+        for clause in clauses[1:]:
+            bitmap &= clause
+        return bitmap
+
+    def _allowed(self, where: Optional[Dict[str, Any]]) -> Optional[np.ndarray]:
+        # Live rows matching where, or None when every row is allowed
+        if where:
+            return self._evaluate(where) & ~self._deleted
+        return ~self._deleted if self._num_deleted else None
+
+    # Search
+
+    def _distances(self, rows, queries: np.ndarray, exact: bool = False) -> np.ndarray:
+        """|x|^2 - 2 x.q for the given rows (a slice or sorted indices) and queries: (rows, queries)."""
+        if self.dtype == "int8" and not exact:
+            codes, scales = self._codes[rows], self._scales[rows]
+            # Converted a cache-sized slice at a time: one float32 copy of the whole block costs more than the multiply
+            scores = np.concatenate([codes[start:start + _INT8_SLICE_ROWS].astype(np.float32) @ queries.T
+                                     for start in range(0, len(codes), _INT8_SLICE_ROWS)]) * scales[:, None]
+        else:
+            scores = np.asarray(self._matrix[rows], dtype=np.float32) @ queries.T
+        return self._norms[rows][:, None] - 2 * scores
+
+    def _scan(self, queries: np.ndarray, k: int, allowed: Optional[np.ndarray],
+              candidates: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Best k per query over every row (or the sorted candidate rows), one block at a time."""
+        total = self._rows if candidates is None else len(candidates)
+        best_rows, best_distances = [], []
+        for start in range(0, total, self.block_rows):
+            end = min(start + self.block_rows, total)
+            rows = np.arange(start, end) if candidates is None else candidates[start:end]
+            distances = self._distances(slice(start, end) if candidates is None else rows, queries)
+            if allowed is not None and candidates is None:
+                distances[~allowed[start:end]] = np.inf
+            top_rows, top_distances = _top(distances, rows, k)
+            best_rows.append(top_rows)
+            best_distances.append(top_distances)
+        return _top(np.concatenate(best_distances), np.concatenate(best_rows), k) if len(best_rows) > 1 \
+            else (best_rows[0], best_distances[0])
+
+    def _probe(self, query: np.ndarray, k: int, allowed: Optional[np.ndarray]) -> np.ndarray:
+        """Rows of the partitions nearest query, widened until at least k rows pass the filter."""
+        half_norms = 0.5 * (self._centroids * self._centroids).sum(axis=1)
+        order = np.argsort(half_norms - self._centroids @ query)
+        rows = np.zeros(0, dtype=np.int32)
+        for start in range(0, len(order), self.num_probes):
+            lists = order[start:start + self.num_probes]
+            found = [self._list_rows[self._list_offsets[i]:self._list_offsets[i + 1]] for i in lists]
+            found = np.concatenate([rows, *found])
+            rows = found[allowed[found]] if allowed is not None else found
+            if len(rows) >= k:
+                break
+        return np.sort(rows)
+
+    def _finish(self, queries: np.ndarray, k: int, rows: np.ndarray,
+                distances: np.ndarray) -> Tuple[List[np.ndarray], List[np.ndarray]]:
+        # Drop filtered-out (inf) entries, re-score int8 candidates exactly, sort and cut to k
+        query_norms = (queries * queries).sum(axis=1)
+        result_rows, result_distances = [], []
+        for j in range(len(queries)):
+            keep = np.isfinite(distances[:, j])
+            candidate_rows, candidate_distances = rows[keep, j], distances[keep, j]
+            if self.dtype == "int8" and len(candidate_rows):
+                candidate_rows = np.unique(candidate_rows)
+                candidate_distances = self._distances(candidate_rows, queries[j:j + 1], exact=True)[:, 0]
+            order = np.argsort(candidate_distances, kind="stable")[:k]
+            result_rows.append(candidate_rows[order])
+            result_distances.append(np.maximum(candidate_distances[order] + query_norms[j], 0.0))
+        return result_rows, result_distances
+
+    def search(self, query_embeddings: np.ndarray, k: int,
+               where: Optional[Dict[str, Any]] = None) -> Tuple[List[np.ndarray], List[np.ndarray]]:
+        """Rows and squared L2 distances of the k nearest live rows matching where, nearest first, per query."""
+        queries = np.ascontiguousarray(np.atleast_2d(query_embeddings), dtype=np.float32)
+        with self._lock:
+            self._refresh()
+            allowed = self._allowed(where)
+            matching = self._rows if allowed is None else int(allowed.sum())
+            if matching == 0 or k <= 0:
+                return ([np.zeros(0, dtype=np.int64) for _ in queries], [np.zeros(0, dtype=np.float32) for _ in queries])
+            # int8 scans keep extra candidates for the exact re-score
+            candidates_k = min(k * self.rescore if self.dtype == "int8" else k, matching)
+
+            if self.mode == "ivf" and self._centroids is not None and matching > self.filter_exact_rows:
+                # Each query probes its own partitions
+                result_rows, result_distances = [], []
+                for query in queries:
+                    probed = self._probe(query, candidates_k, allowed)
+                    rows, distances = self._scan(query[None], min(candidates_k, len(probed)), None, probed)
+                    found_rows, found_distances = self._finish(query[None], k, rows, distances)
+                    result_rows += found_rows
+                    result_distances += found_distances
+                return result_rows, result_distances
+            if allowed is not None and matching <= max(self.filter_exact_rows, self._rows // 8):
+                # Selective filters: score only the matching rows
+                rows, distances = self._scan(queries, candidates_k, None, np.flatnonzero(allowed))
+            else:
+                rows, distances = self._scan(queries, candidates_k, allowed)
+            return self._finish(queries, k, rows, distances)
+
+    def filter_rows(self, rows: List[int], where: Optional[Dict[str, Any]]) -> List[int]:
+        """The rows, among live ones, that match where."""
+        with self._lock:
+            self._refresh()
+            allowed = self._allowed(where)
+            return [row for row in rows if row < self._rows and (allowed is None or allowed[row])]
+
+    def chunks(self, rows: List[int]) -> List[Dict[str, Any]]:
+        """Stored chunks (text and metadata) at the given rows, in that order."""
+        return self.store.get_chunks(rows)
+
+    def rows_for_ids(self, chunk_ids: List[str]) -> Dict[str, int]:
+        return self.store.rows_for_ids(chunk_ids)
+
+    # Writing
+
+    def existing_ids(self, chunk_ids: List[str]) -> set:
+        return self.store.existing_ids(chunk_ids)
+
+    def add(self, chunks: List[Dict[str, Any]], embeddings: np.ndarray) -> int:
+        """Append chunks not stored yet; the pipeline has normally appended them to the store already."""
+        added = self.store.append(chunks, embeddings)
+        with self._lock:
+            self._refresh(force=True)
+        return added
+
+    def delete_file(self, sha256: str):
+        self.store.delete_file(sha256)
+        with self._lock:
+            self._refresh(force=True)
+
+    def train(self, num_lists: int = None, sample_rows: int = config.NUMPY_IVF_TRAIN_SAMPLE):
+        """Train IVF partitions on a sample of live rows, assign every row and save them next to the store."""
+        with self._lock:
+            self._refresh()
+            live = np.flatnonzero(~self._deleted[:self._rows])
+            num_lists = num_lists or self.num_lists or max(1, int(np.sqrt(len(live))))
+            num_lists = min(num_lists, len(live))
+            rng = np.random.default_rng(0)
+            sample = np.sort(rng.choice(live, min(len(live), max(sample_rows, num_lists)), replace=False))
+            vectors = np.asarray(self._matrix[sample], dtype=np.float32)
+            rows = self._rows
+            matrix = self._matrix
+        # Training and assignment run outside the lock, so searches continue meanwhile
+        centroids = kmeans(vectors, num_lists)
+        assignments = nearest_centroids(matrix[:rows], centroids, self.block_rows)
+        tmp_path = self.ivf_path + ".tmp.npz"
+        np.savez(tmp_path, centroids=centroids, assignments=assignments)
+        os.replace(tmp_path, self.ivf_path)
+        logger.info(f"Trained {num_lists} IVF partitions over {rows} rows ({len(sample)} sampled)")
+        with self._lock:
+            self._refresh(force=True)
+
+    def flush(self):
+        """In "ivf" mode, train the partitions once there are enough rows, and retrain when the rows double."""
+        if self.mode != "ivf":
+            return
+        with self._lock:
+            self._refresh()
+            live = self._rows - self._num_deleted
+            due = live >= self.min_ivf_rows and (self._centroids is None or self._rows >= 2 * self._trained_rows)
+        if due:
+            self.train()
+
+    def close(self):
+        self.store.close()